@@ -1,11 +1,75 @@
 import os
+from asyncio import AbstractEventLoop, get_running_loop
+from functools import cache
+from typing import TypedDict
+from weakref import WeakKeyDictionary
 
 import redis.asyncio as aredis
 
-from .typings import CacherConnectionType
+from .typings import CacherConnectionPoolType, CacherConnectionType
+
+
+class RedisPoolConfig(TypedDict):
+    max_connections: int
+    timeout: float  # seconds to wait for a free connection
+    health_check_interval: int  # seconds, the idle connections are checked before they are used
+
+
+def redis_pool_config() -> RedisPoolConfig:
+    return RedisPoolConfig(
+        max_connections=int(os.getenv("redis_max_connections", 50)),
+        timeout=float(os.getenv("redis_pool_timeout", 20)),
+        health_check_interval=int(os.getenv("redis_health_check_interval", 30)),
+    )
+
+
+@cache
+def _redis_pools() -> WeakKeyDictionary[AbstractEventLoop, CacherConnectionPoolType]:
+    return WeakKeyDictionary()
+
+
+def connect_redis_pool() -> CacherConnectionPoolType:
+    """
+    Returns the connection pool shared by all of the redis clients of the running event loop.
+    The connections are bound to the loop they are opened in, so the loops do not share a pool (i.e. in tests).
+    Use close_redis_pool to close it, a new one is created on the next call.
+    """
+    pools = _redis_pools()
+    loop = get_running_loop()
+    pool = pools.get(loop)
+    if pool is None:
+        pool = aredis.BlockingConnectionPool(
+            host=os.getenv("redis_host", ""),
+            port=int(os.getenv("redis_port", "")),
+            decode_responses=True,
+            **redis_pool_config(),
+        )
+        pools[loop] = pool
+    return pool
 
 
 def get_redis_connection() -> CacherConnectionType:
-    host = os.getenv("redis_host", "")
-    port = os.getenv("redis_port", "")
-    return aredis.Redis(host=host, port=int(port), decode_responses=True)
+    """
+    Returns a client of the shared pool, it is cheap to create one.
+    Closing the client does not close the pool.
+    """
+    return aredis.Redis(connection_pool=connect_redis_pool())
+
+
+def get_pubsub_connection() -> CacherConnectionType:
+    """
+    Returns a client with its own connection for listening, it is held while listening,
+    so the listeners do not take the connections of the shared pool. Close it once it is done.
+    """
+    return aredis.Redis(
+        host=os.getenv("redis_host", ""),
+        port=int(os.getenv("redis_port", "")),
+        decode_responses=True,
+        health_check_interval=redis_pool_config()["health_check_interval"],
+    )
+
+
+async def close_redis_pool() -> None:
+    pool = _redis_pools().pop(get_running_loop(), None)
+    if pool is not None:
+        await pool.aclose()
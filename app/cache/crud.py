@@ -1,21 +1,99 @@
 from collections import deque
 from contextlib import asynccontextmanager
-from typing import AsyncIterator, Sequence, TypedDict
+from typing import AsyncIterator, Callable, Sequence, TypedDict
 
-from cache.core import get_redis_connection
-from redis import ConnectionError
+from cache.core import get_pubsub_connection, get_redis_connection
+from common.tools import chunked
+from redis import ConnectionError, WatchError
 
 from .typings import CacherConnectionType
 
+SET_CHUNK_SIZE = 1_000
+
+
 async def delete_key(*keys: str) -> None:
     r = get_redis_connection()
     await r.delete(*keys)
 
+async def get_value(key: str) -> str | None:
+    r = get_redis_connection()
+    return await r.get(key)
+
+
+async def set_value(key: str, value: str, *, ttl_ms: int) -> None:
+    r = get_redis_connection()
+    await r.set(key, value, px=ttl_ms)
+
+
+async def get_hash_values(fields_by_key: dict[str, Sequence[str]]) -> dict[str, list[str | None]]:
+    """
+    Returns the values of the fields of multiple hashes in a single round trip, None for the missing ones.
+    """
+    r = get_redis_connection()
+    async with r.pipeline(transaction=False) as pipe:
+        for key, fields in fields_by_key.items():
+            pipe.hmget(key, list(fields))
+        values = await pipe.execute()
+    return dict(zip(fields_by_key, values))
+
+
+async def set_hash_values(key: str, values: dict[str, str], *, ttl_ms: int) -> None:
+    r = get_redis_connection()
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping=values)
+        pipe.pexpire(key, ttl_ms)
+        await pipe.execute()
+
+
+async def set_checked_hash_values(
+    checked_fields: dict[str, Sequence[str]],
+    select: Callable[[dict[str, list[str | None]]], dict[str, dict[str, str]]],
+    *,
+    ttls_ms: dict[str, int],
+) -> None:
+    """
+    Reads the checked fields of the hashes, then sets the values selected by select from them in a transaction,
+    the ttl of each set hash is given by ttls_ms. It is retried if any of the checked hashes is changed in the meantime.
+    """
+    r = get_redis_connection()
+    async with r.pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                await pipe.watch(*checked_fields)
+                checked = {key: (await pipe.hmget(key, list(fields)) if fields else []) for key, fields in checked_fields.items()}
+                selected = {key: values for key, values in select(checked).items() if values}
+                pipe.multi()
+                for key, values in selected.items():
+                    pipe.hset(key, mapping=values)
+                    pipe.pexpire(key, ttls_ms[key])
+                await pipe.execute()
+                return
+            except WatchError:
+                continue
+
+
+async def delete_hash_fields(fields_by_key: dict[str, Sequence[str]]) -> None:
+    r = get_redis_connection()
+    async with r.pipeline(transaction=False) as pipe:
+        for key, fields in fields_by_key.items():
+            pipe.hdel(key, *fields)
+        await pipe.execute()
+
+
 async def add_vals_to_set(key: str, *val: str) -> None:
+    await add_vals_to_sets({key: val})
+
+
+async def add_vals_to_sets(vals_by_key: dict[str, Sequence[str]]) -> None:
+    """
+    Adds the values to multiple sets in a single round trip, SET_CHUNK_SIZE values per SADD.
+    """
     r = get_redis_connection()
-    added = await r.sadd(key, *val)
-    while added < len(val):
-        added += await r.sadd(key, *val[added:])
+    async with r.pipeline(transaction=False) as pipe:
+        for key, vals in vals_by_key.items():
+            for chunk in chunked(vals, SET_CHUNK_SIZE):
+                pipe.sadd(key, *chunk)
+        await pipe.execute()
 
 
 async def fetch_vals(name: str) -> Sequence[str]:
@@ -37,7 +115,7 @@ class RedisResponse(TypedDict):
 
 @asynccontextmanager
 async def listen_on_key(key: str, *, r_conn: CacherConnectionType | None = None) -> AsyncIterator[AsyncIterator[RedisResponse]]:
-    r = r_conn or get_redis_connection()
+    r = r_conn or get_pubsub_connection()
     ps = r.pubsub()
     try:
         await ps.subscribe(key)
@@ -53,3 +131,14 @@ async def listen_on_key(key: str, *, r_conn: CacherConnectionType | None = None)
 async def broadcast(key: str, value: str, *, r_conn: CacherConnectionType | None = None):
     r = r_conn or get_redis_connection()
     await r.publish(key, value)
+
+
+async def broadcast_many(messages: Sequence[tuple[str, str]], *, r_conn: CacherConnectionType | None = None) -> None:
+    """
+    Publishes the (key, value) messages in their order, in a single round trip.
+    """
+    r = r_conn or get_redis_connection()
+    async with r.pipeline(transaction=False) as pipe:
+        for key, value in messages:
+            pipe.publish(key, value)
+        await pipe.execute()
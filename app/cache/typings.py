@@ -3,3 +3,4 @@ from typing import TypeAlias
 import redis.asyncio as aredis
 
 CacherConnectionType: TypeAlias = aredis.Redis
+CacherConnectionPoolType: TypeAlias = aredis.BlockingConnectionPool
@@ -0,0 +1,74 @@
+from asyncio import Future, Task, TimerHandle, create_task, gather, get_running_loop
+from typing import Awaitable, Callable, Generic, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+BatchHandler = Callable[[list[T]], Awaitable[list[R | Exception]]]
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Collects the submitted items for max_delay seconds or until max_batch_size items are collected,
+    then handles them with a single call of the handler.
+    The handler returns the results in the order of the items,
+    an exception returned in place of a result is raised only for its item.
+    """
+
+    def __init__(self, handler: BatchHandler[T, R], *, max_batch_size: int, max_delay: float, name: str) -> None:
+        self._handler = handler
+        self._max_batch_size = max_batch_size
+        self._max_delay = max_delay
+        self._name = name
+        self._pending: list[tuple[T, Future[R]]] = []
+        self._timer: TimerHandle | None = None
+        self._running: set[Task] = set()
+
+    async def submit(self, item: T) -> R:
+        """
+        Waits until the batch of the item is handled, returns its result.
+        """
+        loop = get_running_loop()
+        result: Future[R] = loop.create_future()
+        self._pending.append((item, result))
+        if len(self._pending) >= self._max_batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._max_delay, self.flush)
+        return await result
+
+    def flush(self) -> None:
+        """
+        Starts handling the collected items without waiting for the timer.
+        """
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = create_task(self._handle(batch), name=self._name)
+        # keep a reference until it is done, otherwise the task might be garbage collected
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def close(self) -> None:
+        self.flush()
+        if self._running:
+            await gather(*self._running, return_exceptions=True)
+
+    async def _handle(self, batch: list[tuple[T, Future[R]]]) -> None:
+        try:
+            results = await self._handler([item for item, _ in batch])
+        except Exception as exc:
+            for _, result in batch:
+                if not result.done():
+                    result.set_exception(exc)
+            return
+        for (_, result), value in zip(batch, results):
+            if result.done():
+                continue
+            if isinstance(value, Exception):
+                result.set_exception(value)
+            else:
+                result.set_result(value)
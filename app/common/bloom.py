@@ -0,0 +1,38 @@
+import math
+from hashlib import blake2b
+
+
+class BloomFilter:
+    """
+    A set that answers "maybe present" or "definitely not present" in a fixed amount of memory.
+    It is sized for the given capacity and false positive rate; items cannot be removed.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self._bit_count = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hash_count = max(1, round(self._bit_count / capacity * math.log(2)))
+        self._bits = bytearray((self._bit_count + 7) // 8)
+        self.count = 0
+
+    @property
+    def size_in_bytes(self) -> int:
+        return len(self._bits)
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def clear(self) -> None:
+        self._bits = bytearray(len(self._bits))
+        self.count = 0
+
+    def _positions(self, item: str) -> list[int]:
+        # double hashing, the k positions are derived from two halves of a single digest
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self._bit_count for i in range(self._hash_count)]
@@ -0,0 +1,46 @@
+import math
+
+MIN_PRECISION = 4
+MAX_PRECISION = 14
+
+
+def precision_for_error(error_rate: float) -> int:
+    """
+    The number of index bits, i.e. log2 of the register count, giving the standard error 1.04 / sqrt(registers).
+    """
+    precision = math.ceil(2 * math.log2(1.04 / error_rate))
+    return min(max(precision, MIN_PRECISION), MAX_PRECISION)
+
+
+def standard_error(precision: int) -> float:
+    return 1.04 / math.sqrt(1 << precision)
+
+
+def registers_from_entries(entries: list[int], precision: int, rank_bits: int) -> list[int]:
+    """
+    The registers of a sparse sketch, kept as the entries of its non-empty registers: register << rank_bits | rank.
+    The registers missing from the entries are empty.
+    """
+    registers = [0] * (1 << precision)
+    rank_mask = (1 << rank_bits) - 1
+    for entry in entries:
+        register = entry >> rank_bits
+        registers[register] = max(registers[register], entry & rank_mask)
+    return registers
+
+
+def estimate_cardinality(registers: list[int]) -> int:
+    """
+    The HyperLogLog estimate, with the linear counting of the empty registers for the small cardinalities.
+    The hashes are 64 bits long, so the estimate needs no correction for the large ones.
+    """
+    register_count = len(registers)
+    if register_count >= 128:
+        alpha = 0.7213 / (1 + 1.079 / register_count)
+    else:
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(register_count, 0.673)
+    estimate = alpha * register_count**2 / sum(2.0**-register for register in registers)
+    empty_registers = registers.count(0)
+    if estimate <= 2.5 * register_count and empty_registers:
+        estimate = register_count * math.log(register_count / empty_registers)
+    return round(estimate)
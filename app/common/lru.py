@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from typing import Generic, Hashable, TypeVar, overload
+
+_K = TypeVar("_K", bound=Hashable)
+_V = TypeVar("_V")
+_D = TypeVar("_D")
+
+
+class LRUCache(Generic[_K, _V]):
+    """
+    A dict keeping at most max_size items, the least recently used ones are evicted first.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max_size
+        self._items: OrderedDict[_K, _V] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: _K) -> bool:
+        return key in self._items
+
+    @overload
+    def get(self, key: _K) -> _V | None:
+        ...
+
+    @overload
+    def get(self, key: _K, default: _D) -> _V | _D:
+        ...
+
+    def get(self, key, default=None):
+        try:
+            self._items.move_to_end(key)
+        except KeyError:
+            return default
+        return self._items[key]
+
+    def put(self, key: _K, value: _V) -> tuple[_K, _V] | None:
+        """
+        Returns the evicted item, if any.
+        """
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self._max_size:
+            return self._items.popitem(last=False)
+        return None
+
+    def pop(self, key: _K) -> _V | None:
+        return self._items.pop(key, None)
+
+    def clear(self) -> None:
+        self._items.clear()
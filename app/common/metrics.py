@@ -0,0 +1,21 @@
+from collections import Counter
+from typing import Callable
+
+_counters: Counter[str] = Counter()
+_gauges: dict[str, Callable[[], int | float]] = {}
+
+
+def increment(name: str, value: int = 1) -> None:
+    _counters[name] += value
+
+
+def register_gauge(name: str, getter: Callable[[], int | float]) -> None:
+    """
+    Registers a value to be read when the metrics are collected
+    (i.e. the current size of a cache)
+    """
+    _gauges[name] = getter
+
+
+def snapshot() -> dict[str, int | float]:
+    return {**_counters, **{name: getter() for name, getter in _gauges.items()}}
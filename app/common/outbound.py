@@ -0,0 +1,210 @@
+import json
+import os
+from asyncio import CancelledError, Event as AsyncEvent, Task, current_task, wait_for
+from collections import deque
+from enum import Enum
+from typing import TypedDict
+
+from common import metrics
+from common.tools import surpress_exc_coroutine
+from common.typings import SenderAsyncWebsocket, SerializableDataType
+
+SLOW_CONSUMER_CLOSE_CODE = 1008  # Policy Violation
+EVICTED_CLOSE_TIMEOUT = 1  # seconds
+
+
+class OverflowPolicy(str, Enum):
+    drop_oldest = "drop_oldest"  # drop the oldest queued live event
+    drop_newest = "drop_newest"  # drop the live event being pushed
+    disconnect = "disconnect"  # evict the connection
+
+
+class OutboundQueueConfig(TypedDict):
+    max_messages: int
+    max_bytes: int
+    high_water_bytes: int
+    policy: OverflowPolicy
+
+
+def outbound_queue_config() -> OutboundQueueConfig:
+    return OutboundQueueConfig(
+        max_messages=int(os.getenv("outbound_max_messages", 1000)),
+        max_bytes=int(os.getenv("outbound_max_bytes", 4 * 1024 * 1024)),
+        high_water_bytes=int(os.getenv("outbound_high_water_bytes", 1024 * 1024)),
+        policy=OverflowPolicy(os.getenv("outbound_overflow_policy", OverflowPolicy.drop_oldest.value)),
+    )
+
+
+class OutboundQueue:
+    """
+    Bounded queue of the frames waiting to be written to a websocket.
+    A single writer task (run) drains it, so the producers never wait for the socket.
+
+    There are two kinds of producers:
+      - push: live events. Never waits; once the queue is full the overflow policy is applied.
+      - send_text/send_json: query results, EOSE, COUNT, NOTICE. They are never dropped,
+        instead the sender waits until the queue is drained below the high water marks.
+    The high water mark of the messages takes the same share of max_messages as high_water_bytes of max_bytes,
+    so a query sending many small frames leaves room for the live events as a query sending large ones does.
+    Frame sizes are measured in characters, which is close enough to bytes for the nostr payloads.
+    """
+
+    def __init__(
+        self,
+        ws: SenderAsyncWebsocket,
+        *,
+        max_messages: int,
+        max_bytes: int,
+        high_water_bytes: int,
+        policy: OverflowPolicy,
+    ) -> None:
+        self._ws = ws
+        self._max_messages = max_messages
+        self._max_bytes = max_bytes
+        self._high_water_bytes = min(high_water_bytes, max_bytes)
+        self._high_water_messages = max(1, max_messages * self._high_water_bytes // max(max_bytes, 1))
+        self._policy = policy
+        self._frames: deque[tuple[str, bool]] = deque()  # (frame, is droppable)
+        self._queued_bytes = 0
+        self._not_empty = AsyncEvent()
+        self._below_high_water = AsyncEvent()
+        self._below_high_water.set()
+        self._drained = AsyncEvent()
+        self._drained.set()
+        self._closed = AsyncEvent()
+        self._writer: Task | None = None
+        self.evicted = False
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        self.dropped_messages = 0
+
+    @property
+    def queued_messages(self) -> int:
+        return len(self._frames)
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._queued_bytes
+
+    @property
+    def is_closed(self) -> bool:
+        return self._closed.is_set()
+
+    def push(self, frame: str) -> None:
+        """
+        Queues a live event frame without waiting.
+        """
+        if self.is_closed:
+            return
+        while self._is_full(len(frame)):
+            if self._policy == OverflowPolicy.disconnect:
+                self._evict()
+                return
+            if self._policy == OverflowPolicy.drop_newest or not self._drop_oldest():
+                self._count_drop()
+                return
+        self._append(frame, droppable=True)
+
+    async def send_text(self, data: str) -> None:
+        while not self.is_closed and self._is_above_high_water():
+            await self._below_high_water.wait()
+        if not self.is_closed:
+            self._append(data, droppable=False)
+
+    async def send_json(self, data: SerializableDataType) -> None:
+        await self.send_text(json.dumps(data, separators=(",", ":")))
+
+    def stop(self) -> None:
+        """
+        Stops accepting frames and lets the writer exit.
+        """
+        self._mark_closed()
+
+    async def run(self) -> None:
+        """
+        The writer task, it exits when the queue is closed or the socket fails.
+        An evicted connection is closed even if the writer is stuck in a send.
+        """
+        self._writer = current_task()
+        try:
+            while not self.is_closed:
+                if not self._frames:
+                    self._not_empty.clear()
+                    await self._not_empty.wait()
+                    continue
+                frame, _ = self._frames.popleft()
+                self._release(len(frame))
+                if not self._frames:
+                    self._drained.set()
+                await self._ws.send_text(frame)
+                self.sent_messages += 1
+                self.sent_bytes += len(frame)
+                metrics.increment("outbound.sent_messages")
+                metrics.increment("outbound.sent_bytes", len(frame))
+        except CancelledError:
+            if not self.evicted:
+                raise
+        finally:
+            self._writer = None
+            self._mark_closed()
+        if self.evicted:
+            close = wait_for(self._ws.close(SLOW_CONSUMER_CLOSE_CODE), EVICTED_CLOSE_TIMEOUT)
+            await surpress_exc_coroutine(close, Exception)
+
+    async def flush(self, timeout: float) -> None:
+        """
+        Waits until the already queued frames are written or the timeout exceeds.
+        """
+        await surpress_exc_coroutine(wait_for(self._drained.wait(), timeout), TimeoutError)
+
+    def _is_full(self, frame_size: int) -> bool:
+        return len(self._frames) >= self._max_messages or self._queued_bytes + frame_size > self._max_bytes
+
+    def _is_above_high_water(self) -> bool:
+        return self._queued_bytes >= self._high_water_bytes or len(self._frames) >= self._high_water_messages
+
+    def _append(self, frame: str, *, droppable: bool) -> None:
+        self._frames.append((frame, droppable))
+        self._drained.clear()
+        self._queued_bytes += len(frame)
+        if self._is_above_high_water():
+            self._below_high_water.clear()
+        self._not_empty.set()
+
+    def _release(self, frame_size: int) -> None:
+        """
+        Call it after the frame is removed from the queue.
+        """
+        self._queued_bytes -= frame_size
+        if not self._is_above_high_water():
+            self._below_high_water.set()
+
+    def _drop_oldest(self) -> bool:
+        for i, (frame, droppable) in enumerate(self._frames):
+            if droppable:
+                del self._frames[i]
+                self._release(len(frame))
+                if not self._frames:
+                    self._drained.set()
+                self._count_drop()
+                return True
+        return False
+
+    def _count_drop(self) -> None:
+        self.dropped_messages += 1
+        metrics.increment("outbound.dropped_messages")
+
+    def _evict(self) -> None:
+        self.evicted = True
+        metrics.increment("outbound.evicted_connections")
+        self._mark_closed()
+        if self._writer is not None and self._writer is not current_task():
+            # the writer may be waiting for a client that never reads, it closes the socket once it is cancelled
+            self._writer.cancel("Slow Consumer Evicted")
+
+    def _mark_closed(self) -> None:
+        self._closed.set()
+        # wake up the writer and the waiting senders
+        self._not_empty.set()
+        self._below_high_water.set()
+        self._drained.set()
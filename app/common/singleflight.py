@@ -0,0 +1,64 @@
+from asyncio import CancelledError, Task, create_task, shield
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+from common import metrics
+
+_K = TypeVar("_K", bound=Hashable)
+_V = TypeVar("_V")
+
+
+class _Flight(Generic[_V]):
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: Task[_V]) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[_K, _V]):
+    """
+    Runs a single call of a key at a time, the concurrent callers of the same key wait for its result instead.
+    The call runs in its own task, so cancelling a waiter does not cancel it while the others are waiting;
+    it is cancelled once all of its waiters are cancelled.
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._flights: dict[_K, _Flight[_V]] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def run(self, key: _K, call: Callable[[], Awaitable[_V]]) -> _V:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._start(key, call)
+        else:
+            metrics.increment(f"{self._name}.shared")
+        flight.waiters += 1
+        try:
+            return await shield(flight.task)
+        except CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # nobody is waiting for it anymore, the later callers start a new one
+                self._forget(key, flight)
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _start(self, key: _K, call: Callable[[], Awaitable[_V]]) -> _Flight[_V]:
+        async def run_call() -> _V:
+            return await call()
+
+        flight: _Flight[_V] = _Flight(create_task(run_call(), name=self._name.upper()))
+        self._flights[key] = flight
+        flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        # the waiters retrieve the result, an unwaited failure must not be reported as never retrieved
+        flight.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        metrics.increment(f"{self._name}.started")
+        return flight
+
+    def _forget(self, key: _K, flight: _Flight[_V]) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
@@ -34,6 +34,49 @@ def flat_tuple(arr: Iterable[Iterable[T]]) -> tuple[T, ...]:
     return tuple(a for sl in arr for a in sl)
 
 
+def chunked(arr: Sequence[T], size: int) -> Iterable[Sequence[T]]:
+    for start in range(0, len(arr), size):
+        yield arr[start : start + size]
+
+
+HEX_DIGITS = "0123456789abcdef"
+HEX_REGEX = re.compile(r"^[0-9a-f]*$")
+
+
+def next_hex_prefix(prefix: str) -> str:
+    """
+    The smallest string greater than every lowercase hex string starting with the prefix
+    """
+    stripped = prefix.rstrip("f")
+    if not stripped:
+        return "g"
+    return stripped[:-1] + HEX_DIGITS[HEX_DIGITS.index(stripped[-1]) + 1]
+
+
+def merge_hex_prefixes(prefixes: Iterable[str], full_length: int) -> tuple[list[str], list[tuple[str, str]]]:
+    """
+    Splits the prefixes into the full length values and the [start, end) ranges of the shorter ones.
+    Duplicates, the values covered by a shorter prefix and overlapping ranges are merged.
+    Anything but lowercase hex is dropped, it cannot match an id or a pubkey.
+    The empty prefix matches every value, as it does for the live events; its range covers all of the others.
+    """
+    ranges: list[tuple[str, str]] = []
+    full_values: list[str] = []
+    for prefix in sorted(set(p for p in prefixes if len(p) <= full_length and HEX_REGEX.match(p))):
+        if ranges and prefix < ranges[-1][1]:
+            # the sorting places a prefix right after the ranges covering it
+            continue
+        if len(prefix) == full_length:
+            full_values.append(prefix)
+            continue
+        end = next_hex_prefix(prefix)
+        if ranges and ranges[-1][1] == prefix:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((prefix, end))
+    return full_values, ranges
+
+
 def group_by(arr: list[T], key_getter: Callable[[T], _K], /) -> dict[_K, list[T]]:
     grouped_items: dict[_K, list[T]] = {}
     for item in arr:
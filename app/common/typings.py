@@ -7,6 +7,12 @@ class SenderAsyncWebsocket(Protocol):
     async def send_json(self, data: SerializableDataType) -> None:
         ...
 
+    async def send_text(self, data: str) -> None:
+        ...
+
+    async def close(self, code: int = 1000) -> None:
+        ...
+
 
 class ReceiverAsyncWebsocket(Protocol):
     async def receive_json(self) -> Coroutine[Any, Any, SerializableDataType]:
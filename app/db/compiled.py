@@ -0,0 +1,31 @@
+from typing import Callable, Hashable
+
+from common import metrics
+from common.lru import LRUCache
+from psycopg import sql
+
+from db.typings import DBConnection, RunnableQuery
+
+
+class CompiledQueries:
+    """
+    Rendered queries cached by their shape, so a repeating query is built and rendered only once.
+    The queries must bind all of their values as parameters; then postgres can keep them as prepared statements too.
+    """
+
+    def __init__(self, name: str, max_size: int) -> None:
+        self._name = name
+        self._queries: LRUCache[Hashable, sql.SQL] = LRUCache(max_size)
+
+    def __len__(self) -> int:
+        return len(self._queries)
+
+    def get(self, shape: Hashable, build: Callable[[], RunnableQuery], conn: DBConnection) -> sql.SQL:
+        query = self._queries.get(shape)
+        if query is not None:
+            metrics.increment(f"{self._name}.hits")
+            return query
+        metrics.increment(f"{self._name}.misses")
+        query = sql.SQL(build().as_string(conn))
+        self._queries.put(shape, query)
+        return query
@@ -0,0 +1,156 @@
+from typing import NamedTuple, Sequence
+
+from psycopg import sql
+
+from db.typings import DBConnection
+
+SCHEMA_MIGRATIONS_TABLE_NAME = "schema_migrations"
+MIGRATION_LOCK_KEY = 7_531_902  # an arbitrary key for the advisory lock of the runners
+
+
+class ConcurrentIndex(NamedTuple):
+    name: str
+    table_name: str
+    definition: str  # the part following ON table_name, e.g. "(created_at DESC)"
+    unique: bool = False
+
+
+class Migration(NamedTuple):
+    """
+    A schema change applied once, in the order of its version.
+    The prepared_indexes are built CONCURRENTLY and the preparations run one by one in their own transactions first,
+    for the steps that scan the tables without locking them against writes (i.e. VALIDATE CONSTRAINT).
+    statements run in a single transaction next; then the indexes are built and the dropped_indexes are dropped
+    CONCURRENTLY one by one, so the tables are never locked against writes while they are scanned.
+    Every step must be idempotent, an interrupted migration is run again from the beginning.
+    """
+
+    version: int
+    description: str
+    statements: Sequence[sql.Composable] = ()
+    indexes: Sequence[ConcurrentIndex] = ()
+    dropped_indexes: Sequence[str] = ()
+    prepared_indexes: Sequence[ConcurrentIndex] = ()
+    preparations: Sequence[sql.Composable] = ()
+
+
+async def applied_versions(conn: DBConnection, *, table_name: str = SCHEMA_MIGRATIONS_TABLE_NAME) -> set[int]:
+    await conn.execute(
+        sql.SQL(
+            "CREATE TABLE IF NOT EXISTS {table_name} (version INT PRIMARY KEY, description TEXT, applied_at TIMESTAMPTZ DEFAULT now())"
+        ).format(table_name=sql.Identifier(table_name))
+    )
+    cur = await conn.execute(sql.SQL("SELECT version FROM {table_name}").format(table_name=sql.Identifier(table_name)))
+    return {row[0] for row in await cur.fetchall()}
+
+
+async def build_index_concurrently(conn: DBConnection, index: ConcurrentIndex) -> None:
+    """
+    A failed concurrent build leaves an invalid index behind, which IF NOT EXISTS would skip; it is dropped and built again.
+    A valid index of the name is kept, even if its table is renamed since it is built (i.e. attached as a partition).
+    The indexes of partitioned tables cannot be built concurrently, see build_partitioned_index.
+    """
+    cur = await conn.execute(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s AND pg_table_is_visible(c.oid)",
+        (index.name,),
+    )
+    validity = await cur.fetchone()
+    if validity and validity[0]:
+        return
+    cur = await conn.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (index.table_name,))
+    is_partitioned = await cur.fetchone()
+    if is_partitioned and is_partitioned[0]:
+        await build_partitioned_index(conn, index)
+        return
+    if validity:
+        print(f"Dropping the invalid index {index.name}")
+        await conn.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {name}").format(name=sql.Identifier(index.name)))
+    await conn.execute(
+        sql.SQL("CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table_name} {definition}").format(
+            unique=sql.SQL("UNIQUE " if index.unique else ""),
+            name=sql.Identifier(index.name),
+            table_name=sql.Identifier(index.table_name),
+            definition=sql.SQL(index.definition),
+        )
+    )
+
+
+async def build_partitioned_index(conn: DBConnection, index: ConcurrentIndex) -> None:
+    """
+    Creates the index on the partitioned table only, which is invalid until an index of every partition is attached to it.
+    The indexes of the partitions are built concurrently one by one.
+    """
+    await conn.execute(
+        sql.SQL("CREATE {unique}INDEX IF NOT EXISTS {name} ON ONLY {table_name} {definition}").format(
+            unique=sql.SQL("UNIQUE " if index.unique else ""),
+            name=sql.Identifier(index.name),
+            table_name=sql.Identifier(index.table_name),
+            definition=sql.SQL(index.definition),
+        )
+    )
+    cur = await conn.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)",
+        (index.table_name,),
+    )
+    for (partition_name,) in await cur.fetchall():
+        # the partitions created after the index of the partitioned table have their indexes attached already
+        cur = await conn.execute(
+            "SELECT 1 FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s) AND x.indrelid = to_regclass(%s)",
+            (index.name, partition_name),
+        )
+        if await cur.fetchone():
+            continue
+        partition_index = ConcurrentIndex(f"{partition_name}_{index.name}"[:63], partition_name, index.definition, index.unique)
+        await build_index_concurrently(conn, partition_index)
+        await conn.execute(
+            sql.SQL("ALTER INDEX {name} ATTACH PARTITION {partition_index}").format(
+                name=sql.Identifier(index.name), partition_index=sql.Identifier(partition_index.name)
+            )
+        )
+
+
+async def apply_migration(conn: DBConnection, migration: Migration, *, table_name: str = SCHEMA_MIGRATIONS_TABLE_NAME) -> None:
+    for index in migration.prepared_indexes:
+        await build_index_concurrently(conn, index)
+    for statement in migration.preparations:
+        await conn.execute(statement)
+    async with conn.transaction():
+        for statement in migration.statements:
+            await conn.execute(statement)
+    for index in migration.indexes:
+        await build_index_concurrently(conn, index)
+    for index_name in migration.dropped_indexes:
+        await conn.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {name}").format(name=sql.Identifier(index_name)))
+    await conn.execute(
+        sql.SQL("INSERT INTO {table_name} (version, description) VALUES (%s, %s)").format(table_name=sql.Identifier(table_name)),
+        (migration.version, migration.description),
+    )
+
+
+async def run_migrations(
+    conn: DBConnection,
+    migrations: Sequence[Migration],
+    *,
+    target: int | None = None,
+    table_name: str = SCHEMA_MIGRATIONS_TABLE_NAME,
+) -> list[int]:
+    """
+    Applies the migrations that are not applied yet, up to the target version if it is given.
+    The connection is switched to autocommit, since the concurrent index builds cannot run in a transaction.
+    The runners are serialized with an advisory lock. Returns the applied versions.
+    """
+    await conn.set_autocommit(True)
+    await conn.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+    try:
+        applied = await applied_versions(conn, table_name=table_name)
+        newly_applied: list[int] = []
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if migration.version in applied or (target is not None and migration.version > target):
+                continue
+            print(f"Applying migration {migration.version}: {migration.description}")
+            await apply_migration(conn, migration, table_name=table_name)
+            newly_applied.append(migration.version)
+        return newly_applied
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
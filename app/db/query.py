@@ -1,4 +1,5 @@
-from typing import Callable, Sequence, TypeVar, overload
+from asyncio import CancelledError, ensure_future, shield, to_thread, wait
+from typing import Awaitable, Callable, Sequence, TypeVar, overload
 
 
 from db.typings import DBConnection, RunnableQuery
@@ -20,6 +21,7 @@ async def run_queries(
     *,
     no_return_queries: Sequence[tuple[RunnableQuery, Sequence]],
     parallel: bool = False,
+    prepare: bool | None = None,
     conn: DBConnection,
 ) -> dict:
     ...
@@ -32,6 +34,7 @@ async def run_queries(
     return_queries: dict[str, tuple[RunnableQuery, Sequence]],
     parallel: bool = False,
     data_converters: dict[str, Callable[[tuple], T]] = {"": ident},
+    prepare: bool | None = None,
     conn: DBConnection,
 ) -> dict[str, tuple[T, ...]]:
     ...
@@ -43,6 +46,7 @@ async def run_queries(
     return_queries: dict[str, tuple[RunnableQuery, Sequence]] = {},
     data_converters: dict[str, Callable[[tuple], T]] = {"": ident},
     parallel: bool = False,
+    prepare: bool | None = None,
     conn: DBConnection,
 ) -> dict[str, tuple[T, ...]]:
     """
@@ -50,6 +54,8 @@ async def run_queries(
     @PARAMETERS
     no_return_queries: a sequence of runnable queries which is not expected to return data [[NO_RETURN]]
     return_queries: a named query Mapping. The naming is required to allow paralellized queries. [[RETURN]]
+    prepare: True to run the queries as server-side prepared statements right away,
+        None to let psycopg prepare them after they repeat a few times on the connection
 
     NOTE:
         - It is not optimized for best performance, yet.
@@ -58,9 +64,27 @@ async def run_queries(
 
     cur = conn.cursor()
     for q, v in no_return_queries:
-        await cur.execute(q, v)
+        await cur.execute(q, v, prepare=prepare)
     results = {
-        rname: tuple(convert(r) if (convert := data_converters.get(rname)) else r for r in await (await cur.execute(q, v)).fetchall())
+        rname: tuple(convert(r) if (convert := data_converters.get(rname)) else r for r in await (await cur.execute(q, v, prepare=prepare)).fetchall())
         for rname, (q, v) in return_queries.items()
     }
     return results
+
+
+async def run_cancellable(aw: Awaitable[T], conn: DBConnection) -> T:
+    """
+    Awaits a query of the connection; if the caller is cancelled, the query is cancelled on the server too,
+    and the cancellation is raised once the query stops.
+    Otherwise the query would be interrupted midway and left running on a busy connection, which the pool has to replace.
+    """
+    task = ensure_future(aw)
+    try:
+        return await shield(task)
+    except CancelledError:
+        # cancel() opens a connection to the server and blocks until it is sent
+        await to_thread(conn.cancel)
+        await wait((task,))
+        if not task.cancelled():
+            task.exception()  # retrieves the expected QueryCanceled error
+        raise
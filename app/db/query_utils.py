@@ -2,10 +2,13 @@ from collections import OrderedDict
 from typing import Iterable, Literal, Sequence
 
 from psycopg import sql
+from psycopg.adapt import PyFormat
 from common.errors import ErrorTypes, InvalidMessageError
 
 from db.typings import FieldName, QueryComponents, RunnableQuery
 
+MAX_QUERY_PARAMS = 65535  # postgres protocol limit of the bind parameters per statement
+
 
 class __DBFuncs:
     def __init__(self, func: QueryComponents) -> None:
@@ -30,7 +33,7 @@ def create_runnable_query(
     from_t: str | RunnableQuery,
     where_clause: QueryComponents | Sequence[QueryComponents] = [],
     order_by: Sequence[tuple[FieldName, Literal["ASC", "DESC"] | None]] | None = None,
-    limit: int | None = None,
+    limit: int | QueryComponents | None = None,  # a placeholder can be given to bind it as a parameter
 ) -> RunnableQuery:
     # TODO: make table_name param support joins
     sts: list[QueryComponents | RunnableQuery] = []
@@ -135,6 +138,47 @@ def prepare_prefix_clause(
     return template.format(field_name=sql.Identifier(*fnames), prefix_regex=prefix_literals)
 
 
+def prepare_any_clause(
+    field_name: FieldName,
+    *,
+    array_type: Literal["bpchar", "int", "text"],
+    operator: Literal["=", "LIKE"] = "=",
+) -> QueryComponents:
+    """
+    Compares the field with the elements of a single array parameter bound in binary,
+    so the query does not change with the number of values.
+    The array is cast to the column type, otherwise postgres casts the column and cannot use its index.
+    """
+    template = sql.SQL("{field_name} {operator} ANY({values}::{array_type}[])")
+    fnames = field_name if isinstance(field_name, tuple) else (field_name,)
+    return template.format(
+        field_name=sql.Identifier(*fnames),
+        operator=sql.SQL(operator),
+        values=sql.Placeholder(format=PyFormat.BINARY),
+        array_type=sql.SQL(array_type),
+    )
+
+
+def prepare_prefix_ranges_clause(field_name: FieldName, range_count: int) -> QueryComponents:
+    """
+    Matches the full length values given as a single array parameter, or any of the [start, end) ranges of the prefixes
+    (see common.tools.merge_hex_prefixes). Unlike SIMILAR TO, each part can be answered by the btree index of the field.
+    The values are cast to the bpchar columns' type for the same reason.
+    """
+    fnames = field_name if isinstance(field_name, tuple) else (field_name,)
+    range_template = sql.SQL("({field_name} >= {start}::bpchar and {field_name} < {end}::bpchar)")
+    clauses = [prepare_any_clause(field_name, array_type="bpchar")]
+    clauses.extend(
+        range_template.format(
+            field_name=sql.Identifier(*fnames),
+            start=sql.Placeholder(format=PyFormat.BINARY),
+            end=sql.Placeholder(format=PyFormat.BINARY),
+        )
+        for _ in range(range_count)
+    )
+    return combine_or_clauses(*clauses) if range_count else clauses[0]
+
+
 def prepare_in_clause(
     field_name: str
     | tuple[str, ...],  # It can be a namespaced field-name (TableName.FieldName) then, the input should be ('TableName', 'FieldName')
@@ -160,6 +204,7 @@ def prepare_gte_lte_clause(
     *,
     gte: bool = False,
     lte: bool = False,
+    value_format: PyFormat = PyFormat.AUTO,
 ) -> QueryComponents:
     gte_template = sql.SQL("{field_name} >= {value}")
     lte_template = sql.SQL("{field_name} <= {value}")
@@ -170,9 +215,9 @@ def prepare_gte_lte_clause(
     elif isinstance(field_name, tuple):
         fnames = field_name
     if gte:
-        clauses.append(gte_template.format(field_name=sql.Identifier(*fnames), value=sql.Placeholder()))
+        clauses.append(gte_template.format(field_name=sql.Identifier(*fnames), value=sql.Placeholder(format=value_format)))
     if lte:
-        clauses.append(lte_template.format(field_name=sql.Identifier(*fnames), value=sql.Placeholder()))
+        clauses.append(lte_template.format(field_name=sql.Identifier(*fnames), value=sql.Placeholder(format=value_format)))
     return sql.SQL(" and ").join(clauses)
 
 
@@ -180,6 +225,9 @@ def prepare_insert_into(
     table_name: str,
     field_names: Sequence[FieldName],
     value_tuple_count: int = 1,
+    *,
+    skip_conflicts: bool = False,  # rows violating a unique constraint are skipped instead of failing the statement
+    returning: Sequence[str] | None = None,
 ) -> RunnableQuery:
     template = sql.SQL("INSERT INTO {table_name} ({field_names}) VALUES {values}")
 
@@ -194,11 +242,30 @@ def prepare_insert_into(
         for valstr in (sql.SQL(",").join(sql.Placeholder() for _ in range(field_count)) for _ in range(value_tuple_count))
     )
 
-    return template.format(
+    q = template.format(
         table_name=sql.Identifier(table_name),
         field_names=sql.SQL(",").join(fnames),
         values=values,
     )
+    if skip_conflicts:
+        q += sql.SQL(" ON CONFLICT DO NOTHING")
+    if returning:
+        q += sql.SQL(" RETURNING {returning}").format(returning=sql.SQL(",").join(map(sql.Identifier, returning)))
+    return q
+
+
+def prepare_function_call(function_name: str, arg_count: int) -> RunnableQuery:
+    return sql.SQL("SELECT {function_name}({args})").format(
+        function_name=sql.Identifier(function_name),
+        args=sql.SQL(",").join(sql.Placeholder() for _ in range(arg_count)),
+    )
+
+
+def max_rows_per_query(field_count: int) -> int:
+    """
+    Number of rows a multi-row statement can take without exceeding the placeholder limit of postgres
+    """
+    return MAX_QUERY_PARAMS // field_count
 
 
 def combine_or_clauses(*clauses: QueryComponents) -> QueryComponents:
@@ -211,7 +278,10 @@ def union_queries(*queries: RunnableQuery) -> RunnableQuery:
     )
 
 
-def prepare_delete_q(table_name: str, clauses: Sequence[QueryComponents]) -> RunnableQuery:
-    return sql.SQL("DELETE FROM {table_name} WHERE {clauses}").format(
+def prepare_delete_q(table_name: str, clauses: Sequence[QueryComponents], *, returning: Sequence[str] | None = None) -> RunnableQuery:
+    q = sql.SQL("DELETE FROM {table_name} WHERE {clauses}").format(
         table_name=sql.Identifier(table_name), clauses=sql.SQL(" and ").join(clauses)
     )
+    if returning:
+        q += sql.SQL(" RETURNING {returning}").format(returning=sql.SQL(",").join(map(sql.Identifier, returning)))
+    return q
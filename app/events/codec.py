@@ -0,0 +1,144 @@
+import json
+import os
+from functools import cache
+from typing import Any, Callable, Protocol
+
+from common.errors import NostrValidationError
+from pydantic import ValidationError
+from tags.data import parse_tags
+
+from events.data import Event, validate_kind
+from events.filters import Filters, filtered_tag_name
+
+try:
+    import orjson
+
+    fast_loads: Callable[[str | bytes], Any] = orjson.loads
+except ImportError:  # orjson is optional, the standard library parser is used instead
+    fast_loads = json.loads
+
+
+class Codec(Protocol):
+    def decode_frame(self, raw: str | bytes) -> Any:
+        ...
+
+    def decode_event(self, event_dict: dict[str, Any]) -> Event:
+        ...
+
+    def decode_filters(self, filters_dict: dict[str, Any]) -> Filters:
+        ...
+
+
+class PydanticCodec:
+    """
+    Validates the messages by building the pydantic models.
+    """
+
+    def decode_frame(self, raw: str | bytes) -> Any:
+        return json.loads(raw)
+
+    def decode_event(self, event_dict: dict[str, Any]) -> Event:
+        try:
+            event = Event(**event_dict)
+            _check(not _has_nul(event.content, event_dict.get("tags") or []), NUL_MESSAGE)
+        except (ValidationError, ValueError) as exc:
+            raise NostrValidationError("Invalid Event!", encapsulated_exc=exc)
+        return event
+
+    def decode_filters(self, filters_dict: dict[str, Any]) -> Filters:
+        try:
+            return Filters(**filters_dict)
+        except ValidationError as exc:
+            raise NostrValidationError("Invalid Filters!", encapsulated_exc=exc)
+
+
+EVENT_STR_FIELDS = ("id", "pubkey", "content", "sig")
+FILTER_STR_LIST_FIELDS = ("ids", "authors")
+FILTER_INT_FIELDS = ("since", "until", "limit")
+# postgres cannot store NUL characters in text columns, an event carrying one would fail its whole batch
+NUL_MESSAGE = "content and tags cannot contain NUL characters!"
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_str_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def _has_nul(content: str, rows: list[list[str]]) -> bool:
+    return "\x00" in content or any("\x00" in value for row in rows for value in row)
+
+
+def _check(condition: bool, message: str) -> None:
+    if not condition:
+        raise ValueError(message)
+
+
+class FastCodec:
+    """
+    Checks the fields by hand and builds the models without running the pydantic validation.
+    The kinds are checked by validate_kind and the tags are parsed by parse_tags, as the models do.
+    Unlike pydantic, mistyped values (i.e. "1" for an int) are rejected instead of being coerced.
+    """
+
+    def decode_frame(self, raw: str | bytes) -> Any:
+        return fast_loads(raw)
+
+    def decode_event(self, event_dict: dict[str, Any]) -> Event:
+        try:
+            for field in EVENT_STR_FIELDS:
+                _check(isinstance(event_dict[field], str), f"{field} must be a string!")
+            _check(_is_int(event_dict["created_at"]), "created_at must be an integer!")
+            _check(_is_int(event_dict["kind"]), "kind must be an integer!")
+            kind = validate_kind(event_dict["kind"])
+            rows = event_dict.get("tags") or []
+            _check(isinstance(rows, list) and all(isinstance(row, list) and _is_str_list(row) for row in rows), "Invalid Tags!")
+            _check(not _has_nul(event_dict["content"], rows), NUL_MESSAGE)
+            tags = parse_tags(rows)  # type: ignore
+        except (KeyError, IndexError, ValueError) as exc:
+            raise NostrValidationError("Invalid Event!", encapsulated_exc=exc)
+        return Event.construct(
+            id=event_dict["id"],
+            pubkey=event_dict["pubkey"],
+            created_at=event_dict["created_at"],
+            kind=kind,
+            tags=tags,
+            content=event_dict["content"],
+            sig=event_dict["sig"],
+        )
+
+    def decode_filters(self, filters_dict: dict[str, Any]) -> Filters:
+        values: dict[str, Any] = {}
+        tags: dict[str, set[str]] = {}
+        try:
+            for key, value in filters_dict.items():
+                if key.startswith("#"):
+                    _check(_is_str_list(value), f"{key} must be a list of strings!")
+                    tags[filtered_tag_name(key)] = set(value)
+                elif value is None:
+                    continue
+                elif key in FILTER_STR_LIST_FIELDS:
+                    _check(_is_str_list(value), f"{key} must be a list of strings!")
+                    values[key] = value
+                elif key == "kinds":
+                    _check(isinstance(value, list) and all(_is_int(k) for k in value), "kinds must be a list of integers!")
+                    values[key] = value
+                elif key in FILTER_INT_FIELDS:
+                    _check(_is_int(value), f"{key} must be an integer!")
+                    values[key] = value
+        except ValueError as exc:
+            raise NostrValidationError("Invalid Filters!", encapsulated_exc=exc)
+        return Filters.construct(**values, tags=tags)
+
+
+CODECS: dict[str, Callable[[], Codec]] = {"pydantic": PydanticCodec, "fast": FastCodec}
+
+
+@cache
+def get_codec() -> Codec:
+    """
+    Returns the codec configured by the event_codec env variable (fast by default).
+    """
+    return CODECS[os.getenv("event_codec", "fast")]()
@@ -1,39 +1,59 @@
+import os
 from collections import deque
-from itertools import groupby
-from typing import Sequence
-
+from functools import cache
+from typing import AsyncIterator, Sequence
+
+from common import metrics
+from common.hll import estimate_cardinality, registers_from_entries
+from common.tools import chunked, flat_tuple, merge_hex_prefixes
+from psycopg import sql
+from psycopg.adapt import PyFormat
+from db.compiled import CompiledQueries
 from db.core import connect_db_pool
-from db.query import run_queries
+from db.query import run_cancellable, run_queries
 from db.query_utils import (
     CountFunc,
+    combine_or_clauses,
     create_runnable_query,
+    max_rows_per_query,
+    prepare_any_clause,
     prepare_delete_q,
     prepare_equal_clause,
+    prepare_function_call,
     prepare_gte_lte_clause,
     prepare_in_clause,
     prepare_insert_into,
-    prepare_prefix_clause,
+    prepare_prefix_ranges_clause,
     prepare_select_statement,
     union_queries,
 )
-from db.typings import QueryComponents, RunnableQuery
-from tags.data.e_tag import E_TAG_TAG_NAME
-from tags.data.p_tag import P_TAG_TAG_NAME
+from db.typings import DBConnection, QueryComponents, RunnableQuery
 from tags.db import (
+    COUNTED_TAG_NAMES,
+    prepare_reference_count_query,
+    prepare_tag_filter_values,
     prepare_tag_filters,
-    query_tags,
+    prepare_tags_aggregation,
     write_tags,
+    write_tags_of_events,
 )
 
 from events.data import Event
 from events.db import (
+    EVENT_COUNT_SKETCH_TABLE_NAME,
     EVENT_FIELDS,
     EVENT_TABLE_NAME,
+    REPLACE_EVENT_FUNCTION_NAME,
+    SECONDS_PER_DAY,
+    SKETCH_RANK_BITS,
     db_to_nostr,
+    db_to_nostr_with_tags,
 )
-from events.filters import Filters
+from events.filters import Filters, FilterShape
 from events.typings import EventDBDict, EventNostrDict, KindType
 
+HEX_ID_LENGTH = 64  # ids and pubkeys are 32 bytes hex encoded
+
 
 async def delete_event_by_kind_pubkey(kind: KindType, pubkey: str) -> None:
     kind_clause = prepare_equal_clause("kind")
@@ -64,14 +84,19 @@ async def fetch_event_by_kind_pubkey(kind: KindType, pubkey: str) -> EventDBDict
             return None
 
 
-async def delete_events(pubkey: str, e_ids: Sequence[str]) -> None:
+async def delete_events(pubkey: str, e_ids: Sequence[str]) -> set[str]:
+    """
+    Deletes the events of the pubkey among the given ids, returns the ids of the deleted ones.
+    """
     pubkey_clause = prepare_equal_clause("pubkey")
-    id_clause = prepare_in_clause("id", 1)
-    delete_q = prepare_delete_q(EVENT_TABLE_NAME, (pubkey_clause, id_clause))
+    # the ids are bound as a single array, IN (%s) would compare the ids to the array literal
+    id_clause = prepare_any_clause("id", array_type="bpchar")
+    delete_q = prepare_delete_q(EVENT_TABLE_NAME, (pubkey_clause, id_clause), returning=["id"])
     pool = connect_db_pool()
     async with pool.connection() as conn:
         # Db Will automatically delete the associated tags
-        await run_queries(no_return_queries=[(delete_q, (pubkey, e_ids))], conn=conn)
+        query_results = await run_queries(return_queries={"ids": (delete_q, (pubkey, list(e_ids)))}, conn=conn)
+    return {row[0] for row in query_results["ids"]}
 
 
 async def write_event(event: Event) -> None:
@@ -98,123 +123,346 @@ async def write_event(event: Event) -> None:
             ],
             conn=conn,
         )
-        await write_tags(event.id, event.tags, conn=conn)
+        await write_tags(event.id, event.created_at, event.tags, conn=conn)
 
 
-def prepare_filter_clauses(f: Filters) -> tuple[Sequence[QueryComponents], Sequence[str | int]]:
+async def write_events(events: Sequence[Event]) -> set[str]:
+    """
+    Writes the events and their tags in a single transaction.
+    Already stored events are skipped row by row, the ids of the newly stored ones are returned.
+    """
+    inserted_ids: set[str] = set()
+    unique_events = list({event.id: event for event in events}.values())
+    pool = connect_db_pool()
+    async with pool.connection() as conn:
+        async with conn.transaction():
+            for chunk in chunked(unique_events, max_rows_per_query(len(EVENT_FIELDS))):
+                insert_query = prepare_insert_into(EVENT_TABLE_NAME, EVENT_FIELDS, len(chunk), skip_conflicts=True, returning=["id"])
+                values = flat_tuple((event.id, event.pubkey, event.created_at, event.kind, event.content, event.sig) for event in chunk)
+                query_results = await run_queries(return_queries={"ids": (insert_query, values)}, conn=conn)
+                inserted_ids.update(row[0] for row in query_results["ids"])
+            await write_tags_of_events(((event.id, event.created_at, event.tags) for event in unique_events if event.id in inserted_ids), conn=conn)
+    return inserted_ids
+
+
+async def replace_event(event: Event) -> bool:
+    """
+    Use this with replaceable events only! (metadata, contact list and 10000 <= kind < 20000)
+    Stores the event in place of the stored one of the same kind and pubkey in a single transaction,
+    unless the stored one is newer. Returns whether the event is stored.
+    """
+    replace_q = prepare_function_call(REPLACE_EVENT_FUNCTION_NAME, len(EVENT_FIELDS))
+    pool = connect_db_pool()
+    async with pool.connection() as conn:
+        async with conn.transaction():
+            query_results = await run_queries(
+                return_queries={"replaced": (replace_q, (event.id, event.pubkey, event.created_at, event.kind, event.content, event.sig))},
+                conn=conn,
+            )
+            is_stored: bool = query_results["replaced"][0][0]
+            if is_stored:
+                await write_tags(event.id, event.created_at, event.tags, conn=conn)
+    return is_stored
+
+
+def prepare_filter_clauses(shape: FilterShape) -> Sequence[QueryComponents]:
+    """
+    The where clauses of a filter, in the order of the values from prepare_filter.
+    """
     filter_queue: deque[QueryComponents] = deque()
-    values: deque[str | int] = deque()
-    if f.ids:
-        id_filter = prepare_prefix_clause((EVENT_TABLE_NAME, "id"), prefixes=f.ids)
-        filter_queue.append(id_filter)
+    if shape.ids is not None:
+        filter_queue.append(prepare_prefix_ranges_clause((EVENT_TABLE_NAME, "id"), shape.ids))
 
-    if f.authors:
-        author_filter = prepare_prefix_clause((EVENT_TABLE_NAME, "pubkey"), prefixes=f.authors)
-        filter_queue.append(author_filter)
+    if shape.authors is not None:
+        filter_queue.append(prepare_prefix_ranges_clause((EVENT_TABLE_NAME, "pubkey"), shape.authors))
 
-    if f.kinds:
-        kind_filter = prepare_in_clause((EVENT_TABLE_NAME, "kind"), value_count=len(f.kinds))
-        filter_queue.append(kind_filter)
-        values.extend(map(str, f.kinds))
+    if shape.kinds:
+        filter_queue.append(prepare_any_clause((EVENT_TABLE_NAME, "kind"), array_type="int"))
 
-    if f.since or f.until:
+    if shape.since or shape.until:
         btwn_filter = prepare_gte_lte_clause(
             (EVENT_TABLE_NAME, "created_at"),
-            gte=f.since is not None,
-            lte=f.until is not None,
+            gte=shape.since,
+            lte=shape.until,
+            value_format=PyFormat.BINARY,
         )
-        if f.since:
-            values.append(f.since)
-        if f.until:
-            values.append(f.until)
-
         filter_queue.append(btwn_filter)
 
-    tag_q, tag_vals = prepare_tag_filters(f.tags)
-    if tag_q:
-        tag_filter = prepare_in_clause((EVENT_TABLE_NAME, "id"), q=tag_q)
-        filter_queue.append(tag_filter)
-        values.extend(tag_vals)
+    # the tag names are ANDed, every one of them is matched by a subquery
+    for tag_q in prepare_tag_filters(shape.tags, since=shape.since, until=shape.until):
+        filter_queue.append(prepare_in_clause((EVENT_TABLE_NAME, "id"), q=tag_q))
 
-    return filter_queue, values
+    return filter_queue
 
 
-async def count_events(*filters: Filters) -> int:
-    filter_queries: deque[RunnableQuery] = deque()
-    filter_q_vals: deque[str | int] = deque()
-    for f in filters:
-        filter_queue, values = prepare_filter_clauses(f)
+def prepare_filter(f: Filters) -> tuple[FilterShape, list[str | int | list]]:
+    """
+    Returns the shape of the filter with its values
+    """
+    values: list[str | int | list] = []
+    prefix_range_counts: list[int | None] = []
+    for prefixes in (f.ids, f.authors):
+        # the empty prefix matches every event, the field is not filtered
+        if not prefixes or "" in prefixes:
+            prefix_range_counts.append(None)
+            continue
+        full_values, ranges = merge_hex_prefixes(prefixes, HEX_ID_LENGTH)
+        values.append(full_values)
+        values.extend(bound for prefix_range in ranges for bound in prefix_range)
+        prefix_range_counts.append(len(ranges))
+    if f.kinds:
+        values.append(f.kinds)
+    if f.since:
+        values.append(f.since)
+    if f.until:
+        values.append(f.until)
+    values.extend(prepare_tag_filter_values(f.tags, since=f.since, until=f.until))
+    if f.limit:
+        values.append(f.limit)
+    ids, authors = prefix_range_counts
+    shape = FilterShape(
+        ids=ids,
+        authors=authors,
+        kinds=bool(f.kinds),
+        since=bool(f.since),
+        until=bool(f.until),
+        tags=sum(1 for tag_values in f.tags.values() if tag_values),
+        limit=bool(f.limit),
+    )
+    return shape, values
 
-        select_statement = prepare_select_statement(["id"])
+
+@cache
+def get_compiled_event_queries() -> CompiledQueries:
+    """
+    Returns the compiled REQ and COUNT queries of this process, keyed by the shapes of their filters.
+    """
+    return CompiledQueries("query_cache", int(os.getenv("query_cache_size", 1024)))
+
+
+def prepare_events_query(*shapes: FilterShape, count: bool = False) -> RunnableQuery:
+    filter_queries: deque[RunnableQuery] = deque()
+    for shape in shapes:
+        select_statement = prepare_select_statement(["id"] if count else ((EVENT_TABLE_NAME, f) for f in EVENT_FIELDS))
         query = create_runnable_query(
-            select_statement, EVENT_TABLE_NAME, filter_queue, order_by=[((EVENT_TABLE_NAME, "created_at"), "DESC")], limit=f.limit
+            select_statement,
+            EVENT_TABLE_NAME,
+            prepare_filter_clauses(shape),
+            order_by=[((EVENT_TABLE_NAME, "created_at"), "DESC")],
+            limit=sql.Placeholder(format=PyFormat.BINARY) if shape.limit else None,
         )
         filter_queries.append(query)
-        filter_q_vals.extend(values)
-
-    from_t = union_queries(*filter_queries)
+    query = union_queries(*filter_queries)
+    if not count:
+        return prepare_select_with_tags(query)
     selector = prepare_select_statement([], as_names={CountFunc("id", True): "event_count"})
-    query = create_runnable_query(selector, from_t)
+    return create_runnable_query(selector, query)
+
+
+def prepare_select_with_tags(events_query: RunnableQuery) -> RunnableQuery:
+    """
+    Selects the events of the query with their tags aggregated in the published order, in a single query.
+    """
+    return sql.SQL("SELECT {fields}, {tags} FROM ({events_query}) {events} CROSS JOIN LATERAL ({tags_aggregation}) {event_tags}").format(
+        fields=sql.SQL(",").join(sql.Identifier(EVENT_TABLE_NAME, f) for f in EVENT_FIELDS),
+        tags=sql.Identifier("event_tags", "tags"),
+        events_query=events_query,
+        events=sql.Identifier(EVENT_TABLE_NAME),
+        tags_aggregation=prepare_tags_aggregation((EVENT_TABLE_NAME, "id"), (EVENT_TABLE_NAME, "created_at")),
+        event_tags=sql.Identifier("event_tags"),
+    )
+
+
+def compile_events_query(*filters: Filters, conn: DBConnection, count: bool = False) -> tuple[RunnableQuery, list[str | int | list]]:
+    """
+    Returns the cached query of the filter shapes with the values of the filters
+    """
+    prepared = [prepare_filter(f) for f in filters]
+    shapes = tuple(shape for shape, _ in prepared)
+    query = get_compiled_event_queries().get((count, shapes), lambda: prepare_events_query(*shapes, count=count), conn)
+    return query, [value for _, values in prepared for value in values]
+
+
+def prepare_reference_count(f: Filters) -> tuple[RunnableQuery, list[str | list[int]]] | None:
+    """
+    Returns the query counting the events of the filter from the tag reference counters, if the filter has their shape:
+    a single e or p tag value with or without kinds (i.e. the reactions to an event, the followers of a pubkey).
+    """
+    if f.ids or f.authors or f.since or f.until or len(f.tags) != 1:
+        return None
+    ((tag_name, tag_values),) = f.tags.items()
+    if tag_name not in COUNTED_TAG_NAMES or len(tag_values) != 1:
+        return None
+    values: list[str | list[int]] = [tag_name, *tag_values]
+    if f.kinds:
+        values.append(f.kinds)
+    return prepare_reference_count_query(kinds=bool(f.kinds)), values
+
+
+async def count_events(*filters: Filters) -> int:
+    """
+    A single filter of the counted shape is answered by the counters, the others are counted by the general query.
+    The counters cannot tell the events matching multiple filters apart, so the filters are not summed.
+    """
     pool = connect_db_pool()
+    if len(filters) == 1 and (reference_count := prepare_reference_count(filters[0])):
+        query, values = reference_count
+        async with pool.connection() as conn:
+            query_results = await run_queries(return_queries={"count": (query, values)}, prepare=True, conn=conn)
+        metrics.increment("count_events.counters")
+        event_count: int = query_results["count"][0][0]
+        return min(event_count, filters[0].limit) if filters[0].limit else event_count
     async with pool.connection() as conn:
+        query, filter_q_vals = compile_events_query(*filters, conn=conn, count=True)
         print(query.as_string(conn))
         query_results = await run_queries(
             return_queries={"count": (query, filter_q_vals)},
+            prepare=True,
             conn=conn,
         )
         print(query_results)
         count_data = query_results["count"]
-        event_count: int = count_data[0][0]
+        event_count = count_data[0][0]
     return event_count
 
 
-async def query_events(*filters: Filters) -> list[EventNostrDict]:
-    filter_queries: deque[RunnableQuery] = deque()
-    filter_q_vals: deque[str | int] = deque()
-    for f in filters:
-        filter_queue, values = prepare_filter_clauses(f)
+def max_merged_sketches() -> int:
+    """
+    The most sketches merged for a count, the broader filters are counted exactly since merging would cost more.
+    """
+    return int(os.getenv("count_sketch_max_merged", 1000))
 
-        select_statement = prepare_select_statement(((EVENT_TABLE_NAME, f) for f in EVENT_FIELDS))
-        query = create_runnable_query(
-            select_statement, EVENT_TABLE_NAME, filter_queue, order_by=[((EVENT_TABLE_NAME, "created_at"), "DESC")], limit=f.limit
-        )
-        filter_queries.append(query)
-        filter_q_vals.extend(values)
 
+def prepare_sketch_filter(f: Filters) -> tuple[QueryComponents, list[int | list]] | None:
+    """
+    Returns the clause selecting the count sketches of the filter, if it has their shape: full length authors and/or kinds,
+    with or without since and until at the UTC day boundaries, since the sketches cannot be split by the time of the day.
+    """
+    if f.ids or f.tags or f.limit or not (f.authors or f.kinds):
+        return None
+    if f.authors and any(len(author) != HEX_ID_LENGTH for author in f.authors):
+        return None
+    if (f.since and f.since % SECONDS_PER_DAY) or (f.until and (f.until + 1) % SECONDS_PER_DAY):
+        return None
+    clauses: list[QueryComponents] = []
+    values: list[int | list] = []
+    if f.authors:
+        clauses.append(prepare_any_clause("pubkey", array_type="bpchar"))
+        values.append(f.authors)
+    if f.kinds:
+        clauses.append(prepare_any_clause("kind", array_type="int"))
+        values.append(f.kinds)
+    if f.since or f.until:
+        clauses.append(prepare_gte_lte_clause("day", gte=bool(f.since), lte=bool(f.until)))
+        values.extend(timestamp // SECONDS_PER_DAY for timestamp in (f.since, f.until) if timestamp)
+    return sql.SQL(" and ").join(clauses), values
+
+
+async def approximate_count_events(*filters: Filters) -> int | None:
+    """
+    Estimates the number of the events matching any of the filters by merging the sketches of their days,
+    the events matching multiple filters are counted once. Returns None if the sketches are not built,
+    a filter cannot be answered from them or they match more than max_merged_sketches, then the events are counted exactly.
+    The matched sketches are counted up to the limit first, they are merged only if they are within it.
+    """
+    sketch_filters = [sketch_filter for f in filters if (sketch_filter := prepare_sketch_filter(f))]
+    if not filters or len(sketch_filters) != len(filters):
+        return None
+    clause = combine_or_clauses(*(clause for clause, _ in sketch_filters))
+    matched = create_runnable_query(sql.SQL("SELECT 1"), EVENT_COUNT_SKETCH_TABLE_NAME, clause, limit=sql.Placeholder())
+    entries = create_runnable_query(
+        sql.SQL("SELECT unnest({registers}) AS entry").format(registers=sql.Identifier("registers")), EVENT_COUNT_SKETCH_TABLE_NAME, clause
+    )
+    query = sql.SQL(
+        "SELECT c.enabled, c.index_bits, m.matched, CASE WHEN m.matched <= %s THEN ("
+        "SELECT array_agg(entry) FROM (SELECT max(entry) AS entry FROM ({entries}) e GROUP BY entry >> {rank_bits}) r"
+        ") END FROM {config} c, (SELECT count(*) AS matched FROM ({matched}) s) m"
+    ).format(
+        entries=entries,
+        rank_bits=sql.Literal(SKETCH_RANK_BITS),
+        config=sql.Identifier(f"{EVENT_COUNT_SKETCH_TABLE_NAME}_config"),
+        matched=matched,
+    )
+    max_merged = max_merged_sketches()
+    values = [value for _, filter_values in sketch_filters for value in filter_values]
+    pool = connect_db_pool()
+    async with pool.connection() as conn:
+        query_results = await run_queries(return_queries={"sketches": (query, [max_merged, *values, *values, max_merged + 1])}, conn=conn)
+    [(enabled, index_bits, matched_count, merged_entries)] = query_results["sketches"]
+    if not enabled:
+        return None
+    if matched_count > max_merged:
+        metrics.increment("count_events.sketches_skipped")
+        return None
+    metrics.increment("count_events.sketches")
+    return estimate_cardinality(registers_from_entries(merged_entries, index_bits, SKETCH_RANK_BITS)) if merged_entries else 0
+
+
+async def build_count_sketches(index_bits: int) -> int:
+    """
+    Sketches all of the stored events with 2^index_bits registers, the writes wait until it is done.
+    Returns the number of the built sketches.
+    """
     pool = connect_db_pool()
-    query = union_queries(*filter_queries)
     async with pool.connection() as conn:
+        cur = await conn.execute("SELECT build_event_count_sketches(%s)", (index_bits,))
+        row = await cur.fetchone()
+    return row[0] if row else 0
+
+
+async def disable_count_sketches() -> None:
+    pool = connect_db_pool()
+    async with pool.connection() as conn:
+        await conn.execute("SELECT disable_event_count_sketches()")
+
+
+async def query_events(*filters: Filters) -> list[EventNostrDict]:
+    pool = connect_db_pool()
+    async with pool.connection() as conn:
+        query, filter_q_vals = compile_events_query(*filters, conn=conn)
         print(query.as_string(conn))
         query_results = await run_queries(
             return_queries={"events": (query, filter_q_vals)},
-            data_converters={"events": db_to_nostr},
+            data_converters={"events": db_to_nostr_with_tags},
+            prepare=True,
             conn=conn,
         )
-        events: Sequence[EventDBDict] = query_results["events"]
-        event_ids = tuple(event["id"] for event in events)
-        if not len(event_ids):
-            return []
-
-        tags = await query_tags(event_ids, conn=conn)
-
-    event_e_tags = dict(groupby(sorted(tags.get(E_TAG_TAG_NAME, []), key=lambda e: e[0]), lambda e: e[0]))
-    event_p_tags = dict(groupby(sorted(tags.get(P_TAG_TAG_NAME, []), key=lambda p: p[0]), lambda p: p[0]))
-    return [
-        EventNostrDict(
-            **event,
-            tags=[
-                *event_e_tags.get(event["id"], []),  # type: ignore
-                *event_p_tags.get(event["id"], []),  # type: ignore
-            ],
-        )
-        for event in events
-    ]
+    return list(query_results["events"])
+
+
+async def stream_events(*filters: Filters, chunk_size: int) -> AsyncIterator[list[EventNostrDict]]:
+    """
+    Yields the matching events with their tags in chunks, reading them through a server-side cursor.
+    Only a chunk of events is kept in the memory at a time.
+    Use it with contextlib.aclosing, so the cursor is closed as soon as the consumer stops; if it is cancelled, the running query is cancelled too.
+    """
+    pool = connect_db_pool()
+    async with pool.connection() as conn:
+        query, filter_q_vals = compile_events_query(*filters, conn=conn)
+        async with conn.cursor(name="stream_events") as cur:
+            await run_cancellable(cur.execute(query, filter_q_vals), conn)
+            while rows := await run_cancellable(cur.fetchmany(chunk_size), conn):
+                yield [db_to_nostr_with_tags(row) for row in rows]
+
+
+async def stream_event_ids(*, chunk_size: int) -> AsyncIterator[list[str]]:
+    """
+    Yields the ids of all of the stored events in chunks, reading them through a server-side cursor.
+    """
+    select_ids = prepare_select_statement([(EVENT_TABLE_NAME, "id")])
+    query = create_runnable_query(select_ids, EVENT_TABLE_NAME)
+    pool = connect_db_pool()
+    async with pool.connection() as conn:
+        async with conn.cursor(name="stream_event_ids") as cur:
+            await cur.execute(query)
+            while rows := await cur.fetchmany(chunk_size):
+                yield [row[0] for row in rows]
 
 
 async def fetch_event(event_id: str) -> EventNostrDict | None:
     select_event = prepare_select_statement((EVENT_TABLE_NAME, f) for f in EVENT_FIELDS)
     clause = prepare_equal_clause((EVENT_TABLE_NAME, "id"))
-    event_query = create_runnable_query(select_event, EVENT_TABLE_NAME, clause)
+    event_query = prepare_select_with_tags(create_runnable_query(select_event, EVENT_TABLE_NAME, clause))
 
     pool = connect_db_pool()
     async with pool.connection() as conn:
@@ -222,11 +470,10 @@ async def fetch_event(event_id: str) -> EventNostrDict | None:
             return_queries={
                 "events": (event_query, (event_id,)),
             },
+            data_converters={"events": db_to_nostr_with_tags},
             conn=conn,
         )
-        events = [db_to_nostr(event) for event in query_results["events"]]
-        if len(events) == 0:
-            return None
-
-        tags = await query_tags((event_id,), conn=conn)
-    return EventNostrDict(**events[0], tags=[*tags.get(E_TAG_TAG_NAME, []), *tags.get(P_TAG_TAG_NAME, [])])
+    events = query_results["events"]
+    if len(events) == 0:
+        return None
+    return events[0]
@@ -17,13 +17,25 @@ IMPLEMENTED_KINDS = {METADATA_KIND, TEXT_NOTE_KIND, RECOMMEND_SERVER_KIND, CONTA
 
 def validate_kind(kind: KindType) -> KindType:
     if kind < 1000:
-        assert kind in IMPLEMENTED_KINDS, "These Kinds Are not Handled by this Relay (yet)!"
-    else:
-        assert 1000 <= kind < 30000, f"Unknown Kind {kind}!"
+        if kind not in IMPLEMENTED_KINDS:
+            raise ValueError("These Kinds Are not Handled by this Relay (yet)!")
+    elif not 1000 <= kind < 30000:
+        raise ValueError(f"Unknown Kind {kind}!")
 
     return kind
 
 
+def is_replaceable_kind(kind: KindType) -> bool:
+    """
+    Only the latest event of such a kind and pubkey is kept.
+    """
+    return kind in (METADATA_KIND, CONTACT_LIST_KIND) or 10000 <= kind < 20000
+
+
+def is_ephemeral_kind(kind: KindType) -> bool:
+    return 20000 < kind < 30000
+
+
 class Event(NostrModel):
     id: str  # 32-bytes lowercase hex-encoded sha256 of the serialized event data
     pubkey: str  # 32-bytes lowercase hex-encoded public key of the event creator
@@ -42,7 +54,7 @@ class Event(NostrModel):
         Used to obtain id. (Note that it needs to be applied sha256 to obtain final id!)
         """
         return json.dumps(
-            [0, self.pubkey, self.created_at, self.kind, [tag.nostr_dict for tag in self.tags], self.content],
+            [0, self.pubkey, self.created_at, self.kind, [tag.row for tag in self.tags], self.content],
             separators=(",", ":"),
             ensure_ascii=False,
         )
@@ -57,7 +69,7 @@ class Event(NostrModel):
             "pubkey": self.pubkey,
             "created_at": self.created_at,
             "kind": self.kind,
-            "tags": [tag.nostr_dict for tag in self.tags],
+            "tags": [list(tag.row) for tag in self.tags],
             "content": self.content,
             "sig": self.sig,
         }
@@ -70,9 +82,13 @@ class Event(NostrModel):
     def is_replaceable_event(self) -> bool:
         return 10000 <= self.kind < 20000
 
+    @property
+    def is_replaced_by_kind_pubkey(self) -> bool:
+        return is_replaceable_kind(self.kind)
+
     @property
     def is_ephemeral_event(self) -> bool:
-        return 20000 < self.kind < 30000
+        return is_ephemeral_kind(self.kind)
 
     @property
     def should_store_event(self) -> bool:
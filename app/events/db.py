@@ -1,11 +1,15 @@
 from typing import Any
 
-from events.typings import EventDBDict
+from events.typings import EventDBDict, EventNostrDict
 from psycopg import sql
 
 EVENT_TABLE_NAME = "event"
 EVENT_FIELDS = ["id", "pubkey", "created_at", "kind", "content", "sig"]
 EVENT_DB_FIELDS = [*EVENT_FIELDS, "source"]
+REPLACE_EVENT_FUNCTION_NAME = "replace_event"
+EVENT_COUNT_SKETCH_TABLE_NAME = "event_count_sketch"
+SKETCH_RANK_BITS = 6  # the low bits of a register entry of a sketch, keeping its rank
+SECONDS_PER_DAY = 86400
 
 
 def db_to_nostr(event_row: tuple[Any, ...]) -> EventDBDict:
@@ -19,63 +23,38 @@ def db_to_nostr(event_row: tuple[Any, ...]) -> EventDBDict:
     )
 
 
-# TODO: Write the up to date method for schemas
-
-
-def generate_sql_schema_e_tag() -> sql.SQL:
-    return sql.SQL(
-        """
-    CREATE TYPE marker_type AS ENUM ('reply', 'root', 'mention');
-    CREATE TABLE e_tag (
-      e_id SERIAL PRIMARY KEY,
-      associated_event CHAR(64) REFERENCES event(id) ON DELETE CASCADE,
-      event_id VARCHAR(64),
-      relay_url TEXT,
-      marker marker_type
-    );
-    CREATE INDEX "e_tag_event_id_index" ON e_tag (event_id);
-  """
-    )
-
-
-def generate_sql_schem_p_tag() -> sql.SQL:
-    return sql.SQL(
-        """
-    CREATE TABLE p_tag (
-      p_id SERIAL PRIMARY KEY,
-      associated_event CHAR(64) REFERENCES event(id) ON DELETE CASCADE,
-      pubkey VARCHAR(64),
-      relay_url TEXT,
-      pet_name VARCHAR(128)
-    );
-    CREATE INDEX "p_tag_pubkey_index" ON p_tag (pubkey);
-  """
-    )
-
-
-def generate_sql_schema_event() -> sql.SQL:
-    return sql.SQL(
-        """
-    CREATE TABLE event (
-        id CHAR(64) PRIMARY KEY,
-        pubkey CHAR(64),
-        created_at BIGINT,
-        kind INT,
-        content TEXT,
-        sig CHAR(128)
-    );
-    CREATE INDEX "event_kind_pubkey_index" ON event (kind, pubkey);
-    CREATE INDEX "event_pubkey_index" ON event (pubkey);
+def db_to_nostr_with_tags(event_row: tuple[Any, ...]) -> EventNostrDict:
     """
-    )
+    The tags come aggregated as the last column (see crud.prepare_select_with_tags)
+    """
+    return EventNostrDict(**db_to_nostr(event_row), tags=event_row[6])
 
 
 def clean_out_db() -> sql.SQL:
     return sql.SQL(
         """
-    DROP TABLE e_tag;
-    DROP TABLE p_tag;
-    DROP TYPE marker_type;
-    DROP TABLE event;
+    -- the tables of the baseline schema, before the migrations, reference the event table
+    DROP TABLE IF EXISTS e_tag CASCADE;
+    DROP TABLE IF EXISTS p_tag CASCADE;
+    DROP TYPE IF EXISTS marker_type CASCADE;
+    DROP FUNCTION IF EXISTS replace_event;
+    DROP FUNCTION IF EXISTS create_event_partitions;
+    DROP FUNCTION IF EXISTS drop_event_partitions;
+    DROP TABLE IF EXISTS tag_reference_count;
+    DROP TABLE IF EXISTS tag;
+    DROP TABLE IF EXISTS event;
+    DROP TABLE IF EXISTS event_id;
+    DROP FUNCTION IF EXISTS claim_inserted_event_id;
+    DROP FUNCTION IF EXISTS release_deleted_event_id;
+    DROP FUNCTION IF EXISTS count_inserted_tag_references;
+    DROP FUNCTION IF EXISTS uncount_deleted_tag_references;
+    DROP FUNCTION IF EXISTS sketch_inserted_events;
+    DROP FUNCTION IF EXISTS build_event_count_sketches;
+    DROP FUNCTION IF EXISTS disable_event_count_sketches;
+    DROP FUNCTION IF EXISTS event_count_sketch_of;
+    DROP FUNCTION IF EXISTS event_count_sketch_union;
+    DROP TABLE IF EXISTS event_count_sketch;
+    DROP TABLE IF EXISTS event_count_sketch_config;
+    DROP TABLE IF EXISTS schema_migrations;
     """
     )
@@ -1,5 +1,5 @@
 import re
-from typing import Any, Callable
+from typing import Any, Callable, NamedTuple
 
 from pydantic import BaseModel, Field, root_validator
 from tags.filters import prepare_tag_tests
@@ -8,6 +8,16 @@ from common.tools import create_range_test_func, create_regex_matcher_func, crea
 from events.typings import EventNostrDict
 
 
+def filtered_tag_name(key: str) -> str:
+    """
+    Returns the tag name of a #<tag name> filter key, only the single-letter tags are indexed by their values.
+    """
+    tag_name = key[1:]
+    if len(tag_name) != 1 or not tag_name.isascii() or not tag_name.isalpha():
+        raise ValueError(f"{key} is not a single-letter tag filter!")
+    return tag_name
+
+
 class Filters(BaseModel):
     """
     Base Model to validate Filter Requests
@@ -25,12 +35,28 @@ class Filters(BaseModel):
 
     @root_validator(pre=True)
     def group_tags(cls, values: dict[str, Any]) -> dict[str, Any]:
-        tags: dict[str, set[str]] = dict((key.strip("#"), set(val)) for (key, val) in values.items() if key.startswith("#"))
+        tags: dict[str, set[str]] = dict((filtered_tag_name(key), set(val)) for (key, val) in values.items() if key.startswith("#"))
 
         values["tags"] = tags
         return values
 
 
+class FilterShape(NamedTuple):
+    """
+    The parts of a filter that change its query, the values are bound as parameters.
+    ids and authors are the number of their prefix ranges, None if they are not filtered.
+    tags is the number of the filtered tag names, the names are bound as parameters as well.
+    """
+
+    ids: int | None
+    authors: int | None
+    kinds: bool
+    since: bool
+    until: bool
+    tags: int
+    limit: bool
+
+
 class EventFilterer:
     """
     A helper class to test out the Events using the Filters
@@ -62,7 +88,6 @@ class EventFilterer:
                 tags_test = prepare_tag_tests(f.tags)
                 tests.setdefault("tags", tags_test)
             self._tests.append(tests)
-        print(self._tests)
 
     def test_event(self, event: EventNostrDict) -> bool:
         return any(all(tester(event.get(key)) for (key, tester) in test.items()) for test in self._tests)
@@ -0,0 +1,376 @@
+import json
+import os
+import time
+from asyncio import Task, create_task
+from typing import Iterable, NamedTuple, Sequence, TypedDict
+
+from cache.crud import delete_hash_fields, delete_key, get_hash_values, set_checked_hash_values, set_hash_values
+from common import metrics
+from common.lru import LRUCache
+from subscriptions.hub import BroadcastEvent, SubscriptionHub
+from tags.data.e_tag import E_TAG_TAG_NAME
+
+from events.crud import query_events
+from events.data import EVENT_DELETION_KIND, is_replaceable_kind
+from events.filters import EventFilterer, Filters
+from events.recent import FULL_KEY_REGEX
+from events.typings import EventNostrDict, KindType
+
+SHARED_IDS_KEY_PREFIX = "hot_events:ids:"
+SHARED_LATEST_KEY_PREFIX = "hot_events:latest:"
+SHARED_DELETED_KEY_PREFIX = "hot_events:deleted:"
+
+LatestKey = tuple[KindType, str]  # kind, pubkey
+
+
+class HotEventsConfig(TypedDict):
+    max_entries: int  # of each of the caches, 0 disables them
+    ttl: float  # seconds, of the events cached in the memory and shared in redis
+    shared: bool  # keeps the events in redis too, for the other processes
+
+
+def hot_events_config() -> HotEventsConfig:
+    return HotEventsConfig(
+        max_entries=int(os.getenv("hot_events_max_entries", 10_000)),
+        ttl=float(os.getenv("hot_events_ttl", 300)),
+        shared=os.getenv("hot_events_shared", "0") == "1",
+    )
+
+
+class HotEvent(NamedTuple):
+    created_at: int
+    id: str
+    event: EventNostrDict
+    encoded: str
+    cached_at: float = 0.0  # time.monotonic() of caching it in the memory
+
+    @classmethod
+    def from_encoded(cls, encoded: str, event: EventNostrDict | None = None) -> "HotEvent":
+        event = event or json.loads(encoded)
+        return cls(event["created_at"], event["id"], event, encoded)
+
+    @property
+    def latest_key(self) -> LatestKey:
+        return self.event["kind"], self.event["pubkey"]
+
+
+class HotEvents:
+    """
+    The requested events by their ids and the latest replaceable events by their kinds and pubkeys.
+    The least recently used ones are evicted above max_entries of each in the memory, and they expire after ttl seconds there;
+    the shared ones are kept in redis hashes for ttl seconds, so the other processes do not read them from the db.
+    The replaceable events are cached only as the latest ones, a replaced event cannot be served by its id.
+
+    The memory is kept up to date by the broadcasted events, so the caches are used only while they are attached to the hub;
+    the ingest path updates redis once for all of the processes.
+    The bulk imports are not broadcasted, the latest events are dropped once their ids are published (see apply_imported).
+    The events read while a deletion or an import is applied are not cached, they may be the deleted or the replaced ones.
+    The deleted ids are kept in redis for at least ttl seconds, so the events read by the other processes
+    before the deletion are not shared again.
+    """
+
+    def __init__(self, *, max_entries: int, ttl: float, shared: bool) -> None:
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._shared = shared
+        self._by_id: LRUCache[str, HotEvent] = LRUCache(max(max_entries, 1))
+        self._latest: LRUCache[LatestKey, HotEvent] = LRUCache(max(max_entries, 1))
+        self._latest_keys: dict[str, LatestKey] = {}  # the keys of the latest events by their ids
+        self._deletions = 0
+        self._hub: SubscriptionHub | None = None
+        self._background_tasks: set[Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._by_id) + len(self._latest)
+
+    @property
+    def is_active(self) -> bool:
+        return self._hub is not None and self._max_entries > 0
+
+    def attach(self, hub: SubscriptionHub) -> None:
+        self._hub = hub
+        hub.add_tap(self.apply_broadcasted)
+        # the events broadcasted while the hub reconnects are missed
+        hub.add_reconnect_listener(self.clear)
+
+    def detach(self) -> None:
+        if self._hub:
+            self._hub.remove_tap(self.apply_broadcasted)
+            self._hub.remove_reconnect_listener(self.clear)
+            self._hub = None
+        self.clear()
+
+    def clear(self) -> None:
+        # the running reads may miss a deletion too
+        self._deletions += 1
+        self._by_id.clear()
+        self._latest.clear()
+        self._latest_keys.clear()
+
+    def can_serve(self, f: Filters) -> bool:
+        """
+        The filter asks for full ids, or for replaceable kinds of full authors, and its limit does not cut the result.
+        """
+        if f.ids:
+            is_exact = all(FULL_KEY_REGEX.match(event_id) for event_id in f.ids)
+            return is_exact and (not f.limit or f.limit >= len(set(f.ids)))
+        if f.authors and f.kinds:
+            is_exact = all(FULL_KEY_REGEX.match(author) for author in f.authors) and all(is_replaceable_kind(kind) for kind in f.kinds)
+            return is_exact and (not f.limit or f.limit >= len(set(f.authors)) * len(set(f.kinds)))
+        return False
+
+    async def split(self, filters: Iterable[Filters]) -> tuple[list[HotEvent], list[Filters]]:
+        """
+        Returns the events of the filters it can serve from the newest to the oldest one, and the rest of the filters.
+        """
+        if not self.is_active:
+            return [], list(filters)
+        served: list[Filters] = []
+        rest: list[Filters] = []
+        for f in filters:
+            (served if self.can_serve(f) else rest).append(f)
+        if not served:
+            return [], rest
+        ids = {event_id for f in served if f.ids for event_id in f.ids}
+        latest_keys = {(kind, author) for f in served if not f.ids and f.authors and f.kinds for author in f.authors for kind in f.kinds}
+        filterer = EventFilterer(*served)
+        events = [event for event in await self.get(ids, latest_keys) if filterer.test_event(event.event)]
+        metrics.increment("hot_events.served_filters", len(served))
+        return sorted(events, key=_sort_key, reverse=True), rest
+
+    async def get(self, ids: set[str], latest_keys: set[LatestKey]) -> list[HotEvent]:
+        """
+        Returns the cached events of the ids and of the latest keys, the missing ones are read from redis, then from the db.
+        """
+        found: dict[str, HotEvent] = {}
+        missing_ids: set[str] = set()
+        missing_latest: set[LatestKey] = set()
+        for event_id in ids:
+            if cached := self._get_by_id(event_id):
+                found[cached.id] = cached
+            else:
+                missing_ids.add(event_id)
+        for latest_key in latest_keys:
+            if cached := self._get_latest(latest_key):
+                found[cached.id] = cached
+            else:
+                missing_latest.add(latest_key)
+        metrics.increment("hot_events.hits", len(ids) + len(latest_keys) - len(missing_ids) - len(missing_latest))
+        if not (missing_ids or missing_latest):
+            return list(found.values())
+        deletions = self._deletions
+        read: list[HotEvent] = []
+        if self._shared:
+            # an id may be found in both of the hashes of the ids
+            read.extend({event.id: event for event in await self._get_shared(missing_ids, missing_latest)}.values())
+            missing_ids.difference_update(event.id for event in read)
+            missing_latest.difference_update(event.latest_key for event in read)
+            metrics.increment("hot_events.shared_hits", len(read))
+        if missing_ids or missing_latest:
+            stored = [HotEvent.from_encoded(json.dumps(event, separators=(",", ":")), event) for event in await self._read_stored(missing_ids, missing_latest)]
+            # the imports store the replaceable events without replacing the older ones
+            stored = _without_replaced(stored, missing_ids)
+            metrics.increment("hot_events.misses", len(missing_ids) + len(missing_latest))
+            if self._shared and deletions == self._deletions:
+                self._run_in_background(self._share(stored))
+            read.extend(stored)
+        if deletions == self._deletions:
+            for event in read:
+                self._put(event)
+        found.update((event.id, event) for event in read)
+        return list(found.values())
+
+    async def apply_replaced(self, event: EventNostrDict) -> None:
+        """
+        Caches the stored replacing event, unless a newer one is cached.
+        """
+        if not self.is_active:
+            return
+        hot_event = HotEvent.from_encoded(json.dumps(event, separators=(",", ":")), event)
+        self._put_latest(hot_event)
+        if self._shared:
+            await self._share([hot_event])
+
+    async def apply_deleted(self, pubkey: str, deleted_ids: Sequence[str]) -> None:
+        """
+        Forgets the deleted events; the other processes forget them in the memory once the deletion is broadcasted.
+        The kinds of the deleted events are not known, so all of the shared latest events of the pubkey are dropped.
+        """
+        if not self.is_active:
+            return
+        self._forget_deleted(pubkey, deleted_ids)
+        if self._shared:
+            generation = self._generation()
+            # the deleted ids are marked before they are deleted, the shares check them (see _share)
+            await set_hash_values(self._shared_deleted_key(generation), dict.fromkeys(deleted_ids, "1"), ttl_ms=int(self._ttl * 2000))
+            await delete_hash_fields({self._shared_ids_key(g): deleted_ids for g in (generation, generation - 1)})
+            await delete_key(self._shared_latest_key(pubkey))
+
+    def apply_imported(self, data: str) -> None:
+        """
+        The imported events may be newer than the cached latest ones; their ids do not tell the kinds and the pubkeys,
+        so all of the latest events are dropped from the memory. The importer drops the shared ones, see forget_shared_latest.
+        The events cached by their ids stay, the imports do not change them.
+        """
+        self._deletions += 1
+        self._latest.clear()
+        self._latest_keys.clear()
+
+    def apply_broadcasted(self, broadcasted: BroadcastEvent) -> None:
+        event = broadcasted.event
+        if event["kind"] == EVENT_DELETION_KIND:
+            deleted_ids = [tag[1] for tag in event.get("tags") or () if len(tag) > 1 and tag[0] == E_TAG_TAG_NAME]
+            self._forget_deleted(event["pubkey"], deleted_ids)
+        if is_replaceable_kind(event["kind"]) and (event["kind"], event["pubkey"]) in self._latest:
+            self._put_latest(HotEvent.from_encoded(broadcasted.encoded, event))
+
+    def _get_by_id(self, event_id: str) -> HotEvent | None:
+        if cached := self._by_id.get(event_id):
+            if not self._is_expired(cached):
+                return cached
+            self._by_id.pop(event_id)
+        if (latest_key := self._latest_keys.get(event_id)) and (latest := self._get_latest(latest_key)) and latest.id == event_id:
+            return latest
+        return None
+
+    def _get_latest(self, latest_key: LatestKey) -> HotEvent | None:
+        if (cached := self._latest.get(latest_key)) and self._is_expired(cached):
+            self._latest.pop(latest_key)
+            self._latest_keys.pop(cached.id, None)
+            return None
+        return cached
+
+    def _is_expired(self, event: HotEvent) -> bool:
+        return time.monotonic() - event.cached_at > self._ttl
+
+    def _put(self, event: HotEvent) -> None:
+        if is_replaceable_kind(event.event["kind"]):
+            self._put_latest(event)
+        else:
+            self._by_id.put(event.id, event._replace(cached_at=time.monotonic()))
+
+    def _put_latest(self, event: HotEvent) -> None:
+        latest_key = event.latest_key
+        cached = self._get_latest(latest_key)
+        if cached is not None:
+            if not _is_newer(event.event, cached.event):
+                return
+            self._latest_keys.pop(cached.id, None)
+        if evicted := self._latest.put(latest_key, event._replace(cached_at=time.monotonic())):
+            self._latest_keys.pop(evicted[1].id, None)
+        self._latest_keys[event.id] = latest_key
+
+    def _forget_deleted(self, pubkey: str, deleted_ids: Iterable[str]) -> None:
+        self._deletions += 1
+        for event_id in deleted_ids:
+            # only the events of the same pubkey are deleted
+            if (cached := self._by_id.get(event_id)) and cached.event["pubkey"] == pubkey:
+                self._by_id.pop(event_id)
+            if (latest_key := self._latest_keys.get(event_id)) and latest_key[1] == pubkey:
+                self._latest.pop(latest_key)
+                del self._latest_keys[event_id]
+
+    async def _get_shared(self, ids: set[str], latest_keys: set[LatestKey]) -> list[HotEvent]:
+        fields_by_key: dict[str, list[str]] = {}
+        if ids:
+            generation = self._generation()
+            for g in (generation, generation - 1):
+                fields_by_key[self._shared_ids_key(g)] = list(ids)
+        for kind, pubkey in latest_keys:
+            fields_by_key.setdefault(self._shared_latest_key(pubkey), []).append(str(kind))
+        values = await get_hash_values(fields_by_key)
+        return [HotEvent.from_encoded(encoded) for encoded_events in values.values() for encoded in encoded_events if encoded is not None]
+
+    async def _read_stored(self, ids: set[str], latest_keys: set[LatestKey]) -> list[EventNostrDict]:
+        filters: list[Filters] = []
+        if ids:
+            filters.append(Filters(ids=sorted(ids)))
+        if latest_keys:
+            # may read more of the latest events than asked, they are cached too
+            filters.append(Filters(authors=sorted({pubkey for _, pubkey in latest_keys}), kinds=sorted({kind for kind, _ in latest_keys})))
+        return await query_events(*filters)
+
+    async def _share(self, events: list[HotEvent]) -> None:
+        """
+        Shares the events unless they are marked as deleted, the latest ones unless newer ones are shared.
+        The marks are checked in the same transaction, so an event deleted in the meantime is not shared again.
+        """
+        if not events:
+            return
+        ttl_ms = int(self._ttl * 1000)
+        generation = self._generation()
+        event_ids = [event.id for event in events]
+        deleted_keys = [self._shared_deleted_key(g) for g in (generation, generation - 1)]
+        # the ids are kept in a hash per ttl, it expires once the next one is read instead
+        ids_key = self._shared_ids_key(generation)
+        latest_by_key: dict[str, dict[str, HotEvent]] = {}
+        for event in events:
+            if is_replaceable_kind(event.event["kind"]):
+                latest_by_key.setdefault(self._shared_latest_key(event.event["pubkey"]), {})[str(event.event["kind"])] = event
+
+        def select(checked: dict[str, list[str | None]]) -> dict[str, dict[str, str]]:
+            deleted = {event_id for key in deleted_keys for event_id, mark in zip(event_ids, checked[key]) if mark is not None}
+            selected = {ids_key: {event.id: event.encoded for event in events if not is_replaceable_kind(event.event["kind"]) and event.id not in deleted}}
+            for key, latest in latest_by_key.items():
+                selected[key] = {
+                    kind: event.encoded
+                    for (kind, event), stored in zip(latest.items(), checked[key])
+                    if event.id not in deleted and (stored is None or _is_newer(event.event, json.loads(stored)))
+                }
+            return selected
+
+        await set_checked_hash_values(
+            {**dict.fromkeys(deleted_keys, event_ids), **{key: list(latest) for key, latest in latest_by_key.items()}},
+            select,
+            ttls_ms={ids_key: ttl_ms * 2, **dict.fromkeys(latest_by_key, ttl_ms)},
+        )
+
+    def _generation(self) -> int:
+        return int(time.time() // self._ttl)
+
+    def _run_in_background(self, coroutine) -> None:
+        task = create_task(coroutine)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    @staticmethod
+    def _shared_ids_key(generation: int) -> str:
+        return f"{SHARED_IDS_KEY_PREFIX}{generation}"
+
+    @staticmethod
+    def _shared_latest_key(pubkey: str) -> str:
+        return f"{SHARED_LATEST_KEY_PREFIX}{pubkey}"
+
+    @staticmethod
+    def _shared_deleted_key(generation: int) -> str:
+        return f"{SHARED_DELETED_KEY_PREFIX}{generation}"
+
+
+def _sort_key(event: HotEvent) -> tuple[int, str]:
+    return event.created_at, event.id
+
+
+def _without_replaced(events: list[HotEvent], ids: set[str]) -> list[HotEvent]:
+    """
+    Keeps the latest one of the replaceable events of the same kind and pubkey, unless the others are asked by their ids.
+    """
+    latest: dict[LatestKey, HotEvent] = {}
+    for event in events:
+        if is_replaceable_kind(event.event["kind"]) and ((other := latest.get(event.latest_key)) is None or _is_newer(event.event, other.event)):
+            latest[event.latest_key] = event
+    return [event for event in events if not is_replaceable_kind(event.event["kind"]) or event.id in ids or latest[event.latest_key] is event]
+
+
+def _is_newer(event: EventNostrDict, other: EventNostrDict) -> bool:
+    """
+    Of the replaceable events with the same created_at, the one with the lowest id is kept, as replace_event does.
+    """
+    return event["created_at"] > other["created_at"] or (event["created_at"] == other["created_at"] and event["id"] < other["id"])
+
+
+async def forget_shared_latest(pubkeys: Iterable[str]) -> None:
+    """
+    Drops the shared latest events of the pubkeys, for the processes storing their events without broadcasting them.
+    """
+    if keys := [HotEvents._shared_latest_key(pubkey) for pubkey in set(pubkeys)]:
+        await delete_key(*keys)
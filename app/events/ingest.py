@@ -0,0 +1,100 @@
+import os
+from asyncio import AbstractEventLoop, Lock, get_running_loop
+from typing import Awaitable, Callable, Sequence, TypedDict
+
+from cache.crud import broadcast_many
+from common import metrics
+from common.batching import MicroBatcher
+
+from events.data import Event
+
+EventsWriter = Callable[[Sequence[Event]], Awaitable[set[str]]]
+BroadcastMessage = tuple[str, str]  # key, value
+
+
+class IngestBatcherConfig(TypedDict):
+    max_batch_size: int
+    max_delay: float
+
+
+def ingest_batcher_config() -> IngestBatcherConfig:
+    return IngestBatcherConfig(
+        max_batch_size=int(os.getenv("ingest_batch_size", 100)),
+        max_delay=int(os.getenv("ingest_batch_delay_ms", 5)) / 1000,
+    )
+
+
+class IngestBatcher(MicroBatcher[Event, bool]):
+    """
+    Stores the submitted events in batches with a single call of the writer.
+    submit returns False if the event was already stored.
+    If the batch fails, its events are written one by one, so a bad event fails only its own submit.
+    """
+
+    def __init__(self, writer: EventsWriter, *, max_batch_size: int, max_delay: float) -> None:
+        super().__init__(self._write, max_batch_size=max_batch_size, max_delay=max_delay, name="INGEST-BATCH-WRITER")
+        self._writer = writer
+
+    async def _write(self, events: list[Event]) -> list[bool | Exception]:
+        try:
+            inserted_ids = await self._writer(events)
+        except Exception:
+            metrics.increment("ingest.failed_batches")
+            return await self._write_one_by_one(events)
+        metrics.increment("ingest.batches")
+        metrics.increment("ingest.stored_events", len(inserted_ids))
+        metrics.increment("ingest.duplicate_events", len(events) - len(inserted_ids))
+        results: list[bool | Exception] = []
+        for event in events:
+            # an event submitted twice in the same batch is reported as new only once
+            results.append(event.id in inserted_ids)
+            inserted_ids.discard(event.id)
+        return results
+
+    async def _write_one_by_one(self, events: list[Event]) -> list[bool | Exception]:
+        results: list[bool | Exception] = []
+        for event in events:
+            try:
+                results.append(event.id in await self._writer([event]))
+            except Exception as exc:
+                metrics.increment("ingest.failed_events")
+                results.append(exc)
+        return results
+
+
+class BroadcastBatcherConfig(TypedDict):
+    max_batch_size: int
+    max_delay: float
+
+
+def broadcast_batcher_config() -> BroadcastBatcherConfig:
+    return BroadcastBatcherConfig(
+        max_batch_size=int(os.getenv("broadcast_batch_size", 100)),
+        max_delay=int(os.getenv("broadcast_batch_delay_ms", 1)) / 1000,
+    )
+
+
+class BroadcastBatcher(MicroBatcher[BroadcastMessage, None]):
+    """
+    Publishes the submitted messages in batches, a batch is published in a single pipelined round trip.
+    The batches are published one at a time, so the messages keep their order even if the batches overlap
+    (i.e. a deletion is not published before the event it deletes).
+    """
+
+    def __init__(self, *, max_batch_size: int, max_delay: float) -> None:
+        super().__init__(self._publish, max_batch_size=max_batch_size, max_delay=max_delay, name="BROADCAST-BATCH-PUBLISHER")
+        self._lock: tuple[AbstractEventLoop, Lock] | None = None
+
+    def _publish_lock(self) -> Lock:
+        # the batcher outlives the event loops (i.e. in tests), a lock is bound to its loop
+        loop = get_running_loop()
+        if self._lock is None or self._lock[0] is not loop:
+            self._lock = (loop, Lock())
+        return self._lock[1]
+
+    async def _publish(self, messages: list[BroadcastMessage]) -> list[None]:
+        async with self._publish_lock():
+            await broadcast_many(messages)
+        metrics.increment("broadcast.batches")
+        metrics.increment("broadcast.messages", len(messages))
+        return [None] * len(messages)
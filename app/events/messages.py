@@ -0,0 +1,16 @@
+import json
+
+from events.enums import MessageTypes
+
+
+def event_message_prefix(subscription_id: str) -> str:
+    """
+    Encoded head of the EVENT messages of a subscription.
+    It is computed once per subscription, then the already
+    encoded events are spliced in with encode_event_message.
+    """
+    return f"[{json.dumps(MessageTypes.Event.value)},{json.dumps(subscription_id)},"
+
+
+def encode_event_message(prefix: str, encoded_event: str) -> str:
+    return f"{prefix}{encoded_event}]"
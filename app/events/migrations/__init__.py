@@ -0,0 +1,31 @@
+from db.migrations import Migration
+
+from . import (
+    v001_event_table,
+    v002_replace_event,
+    v003_tag_table,
+    v004_created_at_indexes,
+    v005_partitions,
+    v006_tag_reference_count,
+    v007_event_count_sketch,
+    v008_replace_event_tie,
+    v009_sparse_count_sketches,
+    v010_event_ids,
+    v011_drop_zero_reference_counts,
+)
+
+# Append new migrations with the next version in a module of their own, never edit the applied ones.
+# The SQL of a migration is written out in its module, so it stays as it is applied even if the schema changes later.
+MIGRATIONS: tuple[Migration, ...] = (
+    v001_event_table.MIGRATION,
+    v002_replace_event.MIGRATION,
+    v003_tag_table.MIGRATION,
+    v004_created_at_indexes.MIGRATION,
+    v005_partitions.MIGRATION,
+    v006_tag_reference_count.MIGRATION,
+    v007_event_count_sketch.MIGRATION,
+    v008_replace_event_tie.MIGRATION,
+    v009_sparse_count_sketches.MIGRATION,
+    v010_event_ids.MIGRATION,
+    v011_drop_zero_reference_counts.MIGRATION,
+)
@@ -0,0 +1,29 @@
+"""
+The event table.
+"""
+
+from db.migrations import Migration
+from psycopg import sql
+
+
+EVENT_TABLE = sql.SQL(
+    """
+    CREATE TABLE IF NOT EXISTS event (
+        id CHAR(64) PRIMARY KEY,
+        pubkey CHAR(64),
+        created_at BIGINT,
+        kind INT,
+        content TEXT,
+        sig CHAR(128)
+    );
+    CREATE INDEX IF NOT EXISTS "event_kind_pubkey_index" ON event (kind, pubkey);
+    CREATE INDEX IF NOT EXISTS "event_pubkey_index" ON event (pubkey);
+    """
+)
+
+
+MIGRATION = Migration(
+    1,
+    "event table",
+    statements=(EVENT_TABLE,),
+)
@@ -0,0 +1,43 @@
+"""
+The replace_event function, it stores a replaceable event in place of the stored ones of the same kind and pubkey,
+unless one of them is newer, and returns whether the event is stored.
+The transaction level advisory lock serializes the replacements of the same (kind, pubkey),
+so the tags written after it in the same transaction are covered too.
+"""
+
+from db.migrations import Migration
+from psycopg import sql
+
+
+REPLACE_EVENT_FUNCTION = sql.SQL(
+    """
+    CREATE OR REPLACE FUNCTION replace_event(
+      new_id CHAR(64),
+      new_pubkey CHAR(64),
+      new_created_at BIGINT,
+      new_kind INT,
+      new_content TEXT,
+      new_sig CHAR(128)
+    ) RETURNS BOOLEAN AS $$
+    BEGIN
+      PERFORM pg_advisory_xact_lock(hashtextextended(new_pubkey || ':' || new_kind, 0));
+      IF EXISTS (SELECT 1 FROM event WHERE kind = new_kind AND pubkey = new_pubkey AND created_at >= new_created_at) THEN
+        RETURN FALSE;
+      END IF;
+      -- the tags of the replaced events are deleted by cascade
+      DELETE FROM event WHERE kind = new_kind AND pubkey = new_pubkey;
+      INSERT INTO event (id, pubkey, created_at, kind, content, sig)
+      VALUES (new_id, new_pubkey, new_created_at, new_kind, new_content, new_sig)
+      ON CONFLICT (id) DO NOTHING;
+      RETURN FOUND;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+MIGRATION = Migration(
+    2,
+    "replace_event function",
+    statements=(REPLACE_EVENT_FUNCTION,),
+)
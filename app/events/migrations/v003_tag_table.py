@@ -0,0 +1,68 @@
+"""
+All of the tags of the events in a single table, fields keeps the tag as it is published.
+The first values of the single-letter tags are indexed with the created_at of their events (NIP-12),
+so a #x filter is served by a single index range scan.
+The rows of the e_tag and p_tag tables are moved into it and they are dropped, if they exist.
+The positions are renumbered per event, the rows written before the positions were kept follow the ones with a position.
+"""
+
+from db.migrations import Migration
+from psycopg import sql
+
+
+TAG_TABLE = sql.SQL(
+    """
+    CREATE TABLE IF NOT EXISTS tag (
+      associated_event CHAR(64) REFERENCES event(id) ON DELETE CASCADE,
+      position INT,
+      tag_name TEXT,
+      value TEXT,
+      created_at BIGINT,
+      fields TEXT[],
+      PRIMARY KEY (associated_event, position)
+    );
+    CREATE INDEX IF NOT EXISTS "tag_name_value_created_at_index" ON tag (tag_name, value, created_at DESC)
+      INCLUDE (associated_event) WHERE value IS NOT NULL;
+  """
+)
+
+
+MOVE_TAGS = sql.SQL(
+    """
+    DO $$
+    BEGIN
+    IF to_regclass('e_tag') IS NULL THEN
+      RETURN;
+    END IF;
+    ALTER TABLE e_tag ADD COLUMN IF NOT EXISTS position INT;
+    ALTER TABLE p_tag ADD COLUMN IF NOT EXISTS position INT;
+    INSERT INTO tag (associated_event, position, tag_name, value, created_at, fields)
+    SELECT t.associated_event,
+           row_number() OVER (PARTITION BY t.associated_event ORDER BY t.position NULLS LAST, t.tag_name, t.row_id) - 1,
+           t.tag_name, t.value, event.created_at, t.fields
+    FROM (
+      SELECT associated_event, position, 'e' AS tag_name, e_id AS row_id, event_id::text AS value, CASE
+        WHEN marker IS NOT NULL THEN ARRAY['e', event_id, coalesce(relay_url, ''), marker::text]
+        WHEN relay_url <> '' THEN ARRAY['e', event_id, relay_url]
+        ELSE ARRAY['e', event_id] END AS fields
+      FROM e_tag
+      UNION ALL
+      SELECT associated_event, position, 'p', p_id, pubkey::text, CASE
+        WHEN pet_name <> '' THEN ARRAY['p', pubkey, coalesce(relay_url, ''), pet_name]
+        WHEN relay_url <> '' THEN ARRAY['p', pubkey, relay_url]
+        ELSE ARRAY['p', pubkey] END
+      FROM p_tag
+    ) t JOIN event ON event.id = t.associated_event;
+    DROP TABLE e_tag;
+    DROP TABLE p_tag;
+    DROP TYPE marker_type;
+    END $$;
+  """
+)
+
+
+MIGRATION = Migration(
+    3,
+    "tag table, moves the tags of e_tag and p_tag",
+    statements=(TAG_TABLE, MOVE_TAGS,),
+)
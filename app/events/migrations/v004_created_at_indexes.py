@@ -0,0 +1,19 @@
+"""
+REQs are ordered by created_at DESC with a limit, the indexes return the rows in that order.
+"""
+
+from db.migrations import ConcurrentIndex, Migration
+
+
+MIGRATION = Migration(
+    4,
+    "created_at ordered event indexes",
+    indexes=(
+        ConcurrentIndex("event_created_at_index", "event", "(created_at DESC)"),
+        ConcurrentIndex("event_kind_created_at_index", "event", "(kind, created_at DESC)"),
+        ConcurrentIndex("event_pubkey_kind_created_at_index", "event", "(pubkey, kind, created_at DESC)"),
+    ),
+    # (pubkey) is a prefix of (pubkey, kind, created_at DESC), and the kind and pubkey lookups compare both of its
+    # leading columns for equality; the kind only lookups are served by (kind, created_at DESC)
+    dropped_indexes=("event_kind_pubkey_index", "event_pubkey_index"),
+)
@@ -0,0 +1,331 @@
+"""
+The event and tag tables partitioned by created_at, a partition per month.
+create_event_partitions creates the monthly partitions starting from a month, the months whose events are
+in the default partition already are skipped. drop_event_partitions drops the partitions ending before a time,
+the tag partition first, so the event partition is detached without any tags referencing it.
+The id of an event is not unique by itself anymore, replace_event conflicts on (id, created_at).
+A tag partition references the event partition of the same range, so a partition is attached without checking its tags again.
+
+The existing tables are attached as the archive partitions instead of copying their rows:
+their keys are built concurrently, and the constraints proving their range and their references are validated
+without locking them against writes, so the tables are locked only to be renamed and attached.
+The events past the archive range are moved aside before the range is checked, and into their partitions after.
+The archive range ends at the start of the month after the next one, the archive partition holds the current and the next month.
+Until the tables are attached, the events created past the archive range cannot be stored: they fail with a check violation.
+It keeps a month ahead of the writes, so only the events dated more than a month ahead fail; unless the migration
+is interrupted and left for over a month, or runs longer than that. A resumed migration moves the range forward again,
+the moved checks are validated once more.
+"""
+
+from db.migrations import ConcurrentIndex, Migration
+from psycopg import sql
+
+
+CREATE_EVENT_PARTITIONS_FUNCTION = sql.SQL(
+    """
+    CREATE OR REPLACE FUNCTION create_event_partitions(first_month TIMESTAMPTZ, month_count INT) RETURNS INT AS $$
+    DECLARE
+      month_start TIMESTAMPTZ;
+      suffix TEXT;
+      created INT := 0;
+    BEGIN
+      -- the processes maintaining the partitions at the same time would create the same ones
+      PERFORM pg_advisory_xact_lock(hashtextextended('event_partitions', 0));
+      FOR i IN 0..month_count - 1 LOOP
+        month_start := date_trunc('month', first_month, 'UTC') + make_interval(months => i);
+        suffix := to_char(month_start AT TIME ZONE 'UTC', 'YYYY_MM');
+        CONTINUE WHEN to_regclass('event_' || suffix) IS NOT NULL;
+        BEGIN
+          EXECUTE format(
+            'CREATE TABLE %I PARTITION OF event FOR VALUES FROM (%s) TO (%s)',
+            'event_' || suffix, extract(epoch FROM month_start)::BIGINT, extract(epoch FROM month_start + interval '1 month')::BIGINT
+          );
+          EXECUTE format(
+            'CREATE TABLE %I PARTITION OF tag FOR VALUES FROM (%s) TO (%s)',
+            'tag_' || suffix, extract(epoch FROM month_start)::BIGINT, extract(epoch FROM month_start + interval '1 month')::BIGINT
+          );
+          EXECUTE format(
+            'ALTER TABLE %I ADD FOREIGN KEY (associated_event, created_at) REFERENCES %I (id, created_at) ON DELETE CASCADE',
+            'tag_' || suffix, 'event_' || suffix
+          );
+          created := created + 1;
+        EXCEPTION WHEN check_violation OR invalid_object_definition THEN
+          -- the default partition has events of the month, or the month is covered by the archive partition
+          RAISE WARNING 'The partitions of % are not created: %', suffix, SQLERRM;
+        END;
+      END LOOP;
+      RETURN created;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+DROP_EVENT_PARTITIONS_FUNCTION = sql.SQL(
+    """
+    CREATE OR REPLACE FUNCTION drop_event_partitions(before TIMESTAMPTZ) RETURNS INT AS $$
+    DECLARE
+      event_partition RECORD;
+      dropped INT := 0;
+    BEGIN
+      PERFORM pg_advisory_xact_lock(hashtextextended('event_partitions', 0));
+      FOR event_partition IN
+        SELECT c.relname AS name,
+               (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''(-?\\d+)''\\)'))[1]::BIGINT AS upper_bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'event'::regclass
+      LOOP
+        CONTINUE WHEN event_partition.upper_bound IS NULL OR event_partition.upper_bound > extract(epoch FROM before)::BIGINT;
+        EXECUTE format('DROP TABLE IF EXISTS %I', regexp_replace(event_partition.name, '^event_', 'tag_'));
+        EXECUTE format('ALTER TABLE event DETACH PARTITION %I', event_partition.name);
+        EXECUTE format('DROP TABLE %I', event_partition.name);
+        dropped := dropped + 1;
+      END LOOP;
+      RETURN dropped;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+REPLACE_EVENT_FUNCTION = sql.SQL(
+    """
+    CREATE OR REPLACE FUNCTION replace_event(
+      new_id CHAR(64),
+      new_pubkey CHAR(64),
+      new_created_at BIGINT,
+      new_kind INT,
+      new_content TEXT,
+      new_sig CHAR(128)
+    ) RETURNS BOOLEAN AS $$
+    BEGIN
+      PERFORM pg_advisory_xact_lock(hashtextextended(new_pubkey || ':' || new_kind, 0));
+      IF EXISTS (SELECT 1 FROM event WHERE kind = new_kind AND pubkey = new_pubkey AND created_at >= new_created_at) THEN
+        RETURN FALSE;
+      END IF;
+      -- the tags of the replaced events are deleted by cascade
+      DELETE FROM event WHERE kind = new_kind AND pubkey = new_pubkey;
+      INSERT INTO event (id, pubkey, created_at, kind, content, sig)
+      VALUES (new_id, new_pubkey, new_created_at, new_kind, new_content, new_sig)
+      ON CONFLICT DO NOTHING;
+      RETURN FOUND;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+# the tables are partitioned already if the migration is interrupted after its statements, the preparations are skipped
+# the checks are enforced on the new rows before they are validated, their bound is kept a month ahead of the writes:
+# it is the start of the month after the next one, and a resumed migration moves it forward to that month again
+ADD_ARCHIVE_RANGE_CHECKS = sql.SQL(
+    """
+    DO $$
+    DECLARE
+      archive_end BIGINT := extract(epoch FROM date_trunc('month', now(), 'UTC') + interval '2 months')::BIGINT;
+      checked_end BIGINT;
+    BEGIN
+      IF (SELECT relkind FROM pg_class WHERE oid = 'event'::regclass) = 'p' THEN
+        RETURN;
+      END IF;
+      SELECT (regexp_match(pg_get_constraintdef(oid), 'created_at < ''?(\\d+)'))[1]::BIGINT INTO checked_end
+      FROM pg_constraint WHERE conname = 'event_archive_range';
+      IF checked_end IS NOT NULL AND checked_end >= archive_end THEN
+        RETURN;
+      END IF;
+      ALTER TABLE event DROP CONSTRAINT IF EXISTS event_archive_range;
+      ALTER TABLE tag DROP CONSTRAINT IF EXISTS tag_archive_range;
+      EXECUTE format('ALTER TABLE event ADD CONSTRAINT event_archive_range CHECK (created_at IS NOT NULL AND created_at < %s) NOT VALID', archive_end);
+      EXECUTE format('ALTER TABLE tag ADD CONSTRAINT tag_archive_range CHECK (created_at IS NOT NULL AND created_at < %s) NOT VALID', archive_end);
+    END $$;
+    """
+)
+
+
+# the events of the later months are few, they are moved aside in a single transaction
+MOVE_ASIDE_LATER_EVENTS = sql.SQL(
+    """
+    DO $$
+    DECLARE
+      archive_end BIGINT;
+    BEGIN
+      IF (SELECT relkind FROM pg_class WHERE oid = 'event'::regclass) = 'p' OR to_regclass('event_later') IS NOT NULL THEN
+        RETURN;
+      END IF;
+      SELECT (regexp_match(pg_get_constraintdef(oid), 'created_at < ''?(\\d+)'))[1]::BIGINT INTO archive_end
+      FROM pg_constraint WHERE conname = 'event_archive_range';
+      CREATE TABLE event_later AS SELECT * FROM event WHERE created_at >= archive_end;
+      CREATE TABLE tag_later AS SELECT * FROM tag WHERE created_at >= archive_end;
+      -- the tags are deleted by cascade
+      DELETE FROM event WHERE created_at >= archive_end;
+    END $$;
+    """
+)
+
+
+# a validation scans the table without locking it against writes, every preparation runs in a transaction of its own
+VALIDATE_EVENT_ARCHIVE_RANGE = sql.SQL(
+    """
+    DO $$
+    BEGIN
+      IF (SELECT relkind FROM pg_class WHERE oid = 'event'::regclass) = 'p' THEN
+        RETURN;
+      END IF;
+      ALTER TABLE event VALIDATE CONSTRAINT event_archive_range;
+    END $$;
+    """
+)
+
+
+VALIDATE_TAG_ARCHIVE_RANGE = sql.SQL(
+    """
+    DO $$
+    BEGIN
+      IF (SELECT relkind FROM pg_class WHERE oid = 'event'::regclass) = 'p' THEN
+        RETURN;
+      END IF;
+      ALTER TABLE tag VALIDATE CONSTRAINT tag_archive_range;
+    END $$;
+    """
+)
+
+
+# the tags reference the events by the keys of the partitions before they are attached
+ADD_ARCHIVE_TAG_REFERENCES = sql.SQL(
+    """
+    DO $$
+    BEGIN
+      IF (SELECT relkind FROM pg_class WHERE oid = 'event'::regclass) = 'p' THEN
+        RETURN;
+      END IF;
+      IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'tag_archive_event_fkey') THEN
+        ALTER TABLE tag ADD CONSTRAINT tag_archive_event_fkey FOREIGN KEY (associated_event, created_at)
+          REFERENCES event (id, created_at) ON DELETE CASCADE NOT VALID;
+      END IF;
+    END $$;
+    """
+)
+
+
+VALIDATE_ARCHIVE_TAG_REFERENCES = sql.SQL(
+    """
+    DO $$
+    BEGIN
+      IF (SELECT relkind FROM pg_class WHERE oid = 'event'::regclass) = 'p' THEN
+        RETURN;
+      END IF;
+      ALTER TABLE tag VALIDATE CONSTRAINT tag_archive_event_fkey;
+    END $$;
+    """
+)
+
+
+ATTACH_ARCHIVE_PARTITIONS = sql.SQL(
+    """
+    DO $$
+    DECLARE
+      archive_end BIGINT;
+    BEGIN
+      IF (SELECT relkind FROM pg_class WHERE oid = 'event'::regclass) = 'p' THEN
+        RETURN;
+      END IF;
+      SELECT (regexp_match(pg_get_constraintdef(oid), 'created_at < ''?(\\d+)'))[1]::BIGINT INTO archive_end
+      FROM pg_constraint WHERE conname = 'event_archive_range';
+
+      -- the keys built by the preparations replace the ones of the ids, the validated checks prove the columns are not null
+      ALTER TABLE tag DROP CONSTRAINT tag_associated_event_fkey;
+      ALTER TABLE tag DROP CONSTRAINT tag_pkey;
+      ALTER TABLE event DROP CONSTRAINT event_pkey;
+      ALTER TABLE event ALTER created_at SET NOT NULL;
+      ALTER TABLE tag ALTER created_at SET NOT NULL;
+      ALTER TABLE event ADD CONSTRAINT event_archive_pkey PRIMARY KEY USING INDEX event_archive_pkey;
+      ALTER TABLE tag ADD CONSTRAINT tag_archive_pkey PRIMARY KEY USING INDEX tag_archive_pkey;
+      ALTER INDEX IF EXISTS event_created_at_index RENAME TO event_archive_created_at_index;
+      ALTER INDEX IF EXISTS event_kind_created_at_index RENAME TO event_archive_kind_created_at_index;
+      ALTER INDEX IF EXISTS event_pubkey_kind_created_at_index RENAME TO event_archive_pubkey_kind_created_at_index;
+      ALTER INDEX IF EXISTS tag_name_value_created_at_index RENAME TO tag_archive_name_value_created_at_index;
+      ALTER TABLE event RENAME TO event_archive;
+      ALTER TABLE tag RENAME TO tag_archive;
+
+      CREATE TABLE event (
+          id CHAR(64),
+          pubkey CHAR(64),
+          created_at BIGINT,
+          kind INT,
+          content TEXT,
+          sig CHAR(128),
+          PRIMARY KEY (id, created_at)
+      ) PARTITION BY RANGE (created_at);
+      CREATE TABLE tag (
+        associated_event CHAR(64),
+        position INT,
+        tag_name TEXT,
+        value TEXT,
+        created_at BIGINT,
+        fields TEXT[],
+        PRIMARY KEY (associated_event, created_at, position)
+      ) PARTITION BY RANGE (created_at);
+      EXECUTE format('ALTER TABLE event ATTACH PARTITION event_archive FOR VALUES FROM (MINVALUE) TO (%s)', archive_end);
+      EXECUTE format('ALTER TABLE tag ATTACH PARTITION tag_archive FOR VALUES FROM (MINVALUE) TO (%s)', archive_end);
+      ALTER TABLE event_archive DROP CONSTRAINT event_archive_range;
+      ALTER TABLE tag_archive DROP CONSTRAINT tag_archive_range;
+
+      CREATE TABLE event_default PARTITION OF event DEFAULT;
+      CREATE TABLE tag_default PARTITION OF tag DEFAULT;
+      ALTER TABLE tag_default ADD FOREIGN KEY (associated_event, created_at) REFERENCES event_default (id, created_at) ON DELETE CASCADE;
+      PERFORM create_event_partitions(to_timestamp(archive_end), 3);
+
+      -- the indexes of the other partitions are built concurrently afterwards
+      CREATE INDEX event_created_at_index ON ONLY event (created_at DESC);
+      CREATE INDEX event_kind_created_at_index ON ONLY event (kind, created_at DESC);
+      CREATE INDEX event_pubkey_kind_created_at_index ON ONLY event (pubkey, kind, created_at DESC);
+      CREATE INDEX tag_name_value_created_at_index ON ONLY tag (tag_name, value, created_at DESC)
+        INCLUDE (associated_event) WHERE value IS NOT NULL;
+      IF to_regclass('event_archive_created_at_index') IS NOT NULL THEN
+        ALTER INDEX event_created_at_index ATTACH PARTITION event_archive_created_at_index;
+      END IF;
+      IF to_regclass('event_archive_kind_created_at_index') IS NOT NULL THEN
+        ALTER INDEX event_kind_created_at_index ATTACH PARTITION event_archive_kind_created_at_index;
+      END IF;
+      IF to_regclass('event_archive_pubkey_kind_created_at_index') IS NOT NULL THEN
+        ALTER INDEX event_pubkey_kind_created_at_index ATTACH PARTITION event_archive_pubkey_kind_created_at_index;
+      END IF;
+      IF to_regclass('tag_archive_name_value_created_at_index') IS NOT NULL THEN
+        ALTER INDEX tag_name_value_created_at_index ATTACH PARTITION tag_archive_name_value_created_at_index;
+      END IF;
+
+      INSERT INTO event (id, pubkey, created_at, kind, content, sig)
+      SELECT id, pubkey, created_at, kind, content, sig FROM event_later;
+      INSERT INTO tag (associated_event, position, tag_name, value, created_at, fields)
+      SELECT associated_event, position, tag_name, value, created_at, fields FROM tag_later;
+      DROP TABLE event_later;
+      DROP TABLE tag_later;
+    END $$;
+    """
+)
+
+
+MIGRATION = Migration(
+    5,
+    "event and tag tables partitioned by month",
+    prepared_indexes=(
+        # the keys of the partitioned tables include created_at, they become the keys of the archive partitions
+        ConcurrentIndex("event_archive_pkey", "event", "(id, created_at)", unique=True),
+        ConcurrentIndex("tag_archive_pkey", "tag", "(associated_event, created_at, position)", unique=True),
+    ),
+    preparations=(
+        ADD_ARCHIVE_RANGE_CHECKS,
+        MOVE_ASIDE_LATER_EVENTS,
+        VALIDATE_EVENT_ARCHIVE_RANGE,
+        VALIDATE_TAG_ARCHIVE_RANGE,
+        ADD_ARCHIVE_TAG_REFERENCES,
+        VALIDATE_ARCHIVE_TAG_REFERENCES,
+    ),
+    statements=(CREATE_EVENT_PARTITIONS_FUNCTION, DROP_EVENT_PARTITIONS_FUNCTION, REPLACE_EVENT_FUNCTION, ATTACH_ARCHIVE_PARTITIONS),
+    indexes=(
+        ConcurrentIndex("event_created_at_index", "event", "(created_at DESC)"),
+        ConcurrentIndex("event_kind_created_at_index", "event", "(kind, created_at DESC)"),
+        ConcurrentIndex("event_pubkey_kind_created_at_index", "event", "(pubkey, kind, created_at DESC)"),
+        ConcurrentIndex("tag_name_value_created_at_index", "tag", "(tag_name, value, created_at DESC) INCLUDE (associated_event) WHERE value IS NOT NULL"),
+    ),
+)
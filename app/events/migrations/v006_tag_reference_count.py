@@ -0,0 +1,112 @@
+"""
+The number of events of each kind referencing an event id or a pubkey by their e and p tags, kept by triggers
+in the transactions writing the events. An event is counted once for a value, by the first of its tags with the value.
+The tags are counted after they are inserted, the events are uncounted before they are deleted, since their tags
+are deleted with them. The existing tags are counted in the same transaction, the triggers lock out the writes until then.
+drop_event_partitions uncounts the events of the dropped partitions, since dropping a partition skips the triggers.
+"""
+
+from db.migrations import Migration
+from psycopg import sql
+
+
+TAG_REFERENCE_COUNT = sql.SQL(
+    """
+    CREATE TABLE IF NOT EXISTS tag_reference_count (
+      tag_name TEXT,
+      value TEXT,
+      kind INT,
+      count BIGINT NOT NULL DEFAULT 0,
+      PRIMARY KEY (tag_name, value, kind)
+    );
+
+    CREATE OR REPLACE FUNCTION count_inserted_tag_references() RETURNS TRIGGER AS $$
+    BEGIN
+      INSERT INTO tag_reference_count (tag_name, value, kind, count)
+      SELECT n.tag_name, n.value, e.kind, count(*)
+      FROM new_tags n JOIN event e ON e.id = n.associated_event AND e.created_at = n.created_at
+      WHERE n.tag_name IN ('e', 'p') AND n.value IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM tag t
+        WHERE t.associated_event = n.associated_event AND t.created_at = n.created_at
+          AND t.tag_name = n.tag_name AND t.value = n.value AND t.position < n.position
+      )
+      GROUP BY n.tag_name, n.value, e.kind
+      -- the counters are locked in the same order by the concurrent writers
+      ORDER BY n.tag_name, n.value, e.kind
+      ON CONFLICT (tag_name, value, kind) DO UPDATE SET count = tag_reference_count.count + excluded.count;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION uncount_deleted_tag_references() RETURNS TRIGGER AS $$
+    BEGIN
+      UPDATE tag_reference_count c SET count = c.count - 1
+      FROM (
+        SELECT DISTINCT tag_name, value FROM tag
+        WHERE associated_event = OLD.id AND created_at = OLD.created_at AND tag_name IN ('e', 'p') AND value IS NOT NULL
+      ) t
+      WHERE c.tag_name = t.tag_name AND c.value = t.value AND c.kind = OLD.kind;
+      RETURN OLD;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS tag_reference_count_insert ON tag;
+    CREATE TRIGGER tag_reference_count_insert AFTER INSERT ON tag
+      REFERENCING NEW TABLE AS new_tags FOR EACH STATEMENT EXECUTE FUNCTION count_inserted_tag_references();
+    DROP TRIGGER IF EXISTS tag_reference_count_delete ON event;
+    CREATE TRIGGER tag_reference_count_delete BEFORE DELETE ON event
+      FOR EACH ROW EXECUTE FUNCTION uncount_deleted_tag_references();
+
+    INSERT INTO tag_reference_count (tag_name, value, kind, count)
+    SELECT t.tag_name, t.value, e.kind, count(DISTINCT t.associated_event)
+    FROM tag t JOIN event e ON e.id = t.associated_event AND e.created_at = t.created_at
+    WHERE t.tag_name IN ('e', 'p') AND t.value IS NOT NULL
+    GROUP BY t.tag_name, t.value, e.kind
+    ON CONFLICT (tag_name, value, kind) DO UPDATE SET count = excluded.count;
+    """
+)
+
+
+DROP_EVENT_PARTITIONS_FUNCTION = sql.SQL(
+    """
+    CREATE OR REPLACE FUNCTION drop_event_partitions(before TIMESTAMPTZ) RETURNS INT AS $$
+    DECLARE
+      event_partition RECORD;
+      dropped INT := 0;
+    BEGIN
+      PERFORM pg_advisory_xact_lock(hashtextextended('event_partitions', 0));
+      FOR event_partition IN
+        SELECT c.relname AS name,
+               (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''(-?\\d+)''\\)'))[1]::BIGINT AS upper_bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'event'::regclass
+      LOOP
+        CONTINUE WHEN event_partition.upper_bound IS NULL OR event_partition.upper_bound > extract(epoch FROM before)::BIGINT;
+        -- dropping a partition skips the triggers, the events are uncounted in bulk
+        IF to_regclass('tag_reference_count') IS NOT NULL AND to_regclass(regexp_replace(event_partition.name, '^event_', 'tag_')) IS NOT NULL THEN
+          EXECUTE format(
+            'UPDATE tag_reference_count c SET count = c.count - d.count FROM ('
+            '  SELECT t.tag_name, t.value, e.kind, count(DISTINCT t.associated_event) AS count'
+            '  FROM %I t JOIN %I e ON e.id = t.associated_event AND e.created_at = t.created_at'
+            '  WHERE t.tag_name IN (''e'', ''p'') AND t.value IS NOT NULL GROUP BY t.tag_name, t.value, e.kind'
+            ') d WHERE c.tag_name = d.tag_name AND c.value = d.value AND c.kind = d.kind',
+            regexp_replace(event_partition.name, '^event_', 'tag_'), event_partition.name
+          );
+        END IF;
+        EXECUTE format('DROP TABLE IF EXISTS %I', regexp_replace(event_partition.name, '^event_', 'tag_'));
+        EXECUTE format('ALTER TABLE event DETACH PARTITION %I', event_partition.name);
+        EXECUTE format('DROP TABLE %I', event_partition.name);
+        dropped := dropped + 1;
+      END LOOP;
+      RETURN dropped;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+MIGRATION = Migration(
+    6,
+    "tag reference counters",
+    statements=(TAG_REFERENCE_COUNT, DROP_EVENT_PARTITIONS_FUNCTION,),
+)
@@ -0,0 +1,144 @@
+"""
+HyperLogLog sketches of the event ids of each pubkey, kind and UTC day, for the approximate counts.
+A register is kept as a bitmap of the observed ranks, so the sketches of many buckets are merged by bit_or in the db.
+The ids are hashed with a random seed, the registers cannot be targeted by the ids mined by the clients.
+The sketches are built by build_event_count_sketches, they are kept up to date by a trigger afterwards;
+the deleted events stay in them until their days are dropped with their partitions by drop_event_partitions.
+"""
+
+from db.migrations import Migration
+from psycopg import sql
+
+
+EVENT_COUNT_SKETCH = sql.SQL(
+    """
+    CREATE TABLE IF NOT EXISTS event_count_sketch_config (
+      enabled BOOLEAN NOT NULL,
+      index_bits INT NOT NULL,  -- the sketches have 2^index_bits registers
+      seed BIGINT NOT NULL
+    );
+    INSERT INTO event_count_sketch_config (enabled, index_bits, seed)
+    SELECT false, 10, (random() * 2147483647)::BIGINT WHERE NOT EXISTS (SELECT 1 FROM event_count_sketch_config);
+
+    CREATE TABLE IF NOT EXISTS event_count_sketch (
+      pubkey CHAR(64),
+      kind INT,
+      day BIGINT,
+      registers BIT VARYING NOT NULL,  -- 32 bits per register
+      PRIMARY KEY (pubkey, kind, day)
+    );
+    CREATE INDEX IF NOT EXISTS event_count_sketch_kind_day_index ON event_count_sketch (kind, day);
+
+    -- the low bits of the hash select the register, the rank is the position of the first set bit of the others;
+    -- a single expression, so it is inlined into the queries
+    CREATE OR REPLACE FUNCTION event_count_sketch_of(event_id TEXT, empty_sketch BIT VARYING, index_bits INT, seed BIGINT)
+    RETURNS BIT VARYING AS $$
+      SELECT set_bit(
+        empty_sketch,
+        (hashtextextended(event_id, seed) & ((1 << index_bits) - 1))::INT * 32
+          + least(coalesce(nullif(position(B'1' IN substring(hashtextextended(event_id, seed)::BIT(64) FROM 1 FOR 64 - index_bits)), 0), 32), 32)
+          - 1,
+        1
+      )
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE OR REPLACE FUNCTION sketch_inserted_events() RETURNS TRIGGER AS $$
+    DECLARE
+      config RECORD;
+      empty_sketch BIT VARYING;
+    BEGIN
+      SELECT * INTO config FROM event_count_sketch_config;
+      IF NOT config.enabled THEN
+        RETURN NULL;
+      END IF;
+      empty_sketch := repeat('0', 32 << config.index_bits)::BIT VARYING;
+      INSERT INTO event_count_sketch (pubkey, kind, day, registers)
+      SELECT pubkey, kind, day, bit_or(event_count_sketch_of(id, empty_sketch, config.index_bits, config.seed))
+      FROM (SELECT id, pubkey, kind, floor(created_at / 86400.0)::BIGINT AS day FROM new_events) n
+      GROUP BY pubkey, kind, day
+      -- the sketches are locked in the same order by the concurrent writers
+      ORDER BY pubkey, kind, day
+      ON CONFLICT (pubkey, kind, day) DO UPDATE SET registers = event_count_sketch.registers | excluded.registers;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS event_count_sketch_insert ON event;
+    CREATE TRIGGER event_count_sketch_insert AFTER INSERT ON event
+      REFERENCING NEW TABLE AS new_events FOR EACH STATEMENT EXECUTE FUNCTION sketch_inserted_events();
+
+    -- sketches all of the events with 2^new_index_bits registers and enables the trigger, the writes wait until it is done
+    CREATE OR REPLACE FUNCTION build_event_count_sketches(new_index_bits INT) RETURNS BIGINT AS $$
+    DECLARE
+      config RECORD;
+      empty_sketch BIT VARYING := repeat('0', 32 << new_index_bits)::BIT VARYING;
+      built BIGINT;
+    BEGIN
+      LOCK TABLE event IN SHARE MODE;
+      UPDATE event_count_sketch_config SET enabled = true, index_bits = new_index_bits RETURNING * INTO config;
+      TRUNCATE event_count_sketch;
+      INSERT INTO event_count_sketch (pubkey, kind, day, registers)
+      SELECT pubkey, kind, day, bit_or(event_count_sketch_of(id, empty_sketch, config.index_bits, config.seed))
+      FROM (SELECT id, pubkey, kind, floor(created_at / 86400.0)::BIGINT AS day FROM event) e
+      GROUP BY pubkey, kind, day;
+      GET DIAGNOSTICS built = ROW_COUNT;
+      ANALYZE event_count_sketch;
+      RETURN built;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION disable_event_count_sketches() RETURNS VOID AS $$
+      UPDATE event_count_sketch_config SET enabled = false;
+      TRUNCATE event_count_sketch;
+    $$ LANGUAGE sql;
+    """
+)
+
+
+DROP_EVENT_PARTITIONS_FUNCTION = sql.SQL(
+    """
+    CREATE OR REPLACE FUNCTION drop_event_partitions(before TIMESTAMPTZ) RETURNS INT AS $$
+    DECLARE
+      event_partition RECORD;
+      dropped INT := 0;
+    BEGIN
+      PERFORM pg_advisory_xact_lock(hashtextextended('event_partitions', 0));
+      FOR event_partition IN
+        SELECT c.relname AS name,
+               (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''(-?\\d+)''\\)'))[1]::BIGINT AS upper_bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'event'::regclass
+      LOOP
+        CONTINUE WHEN event_partition.upper_bound IS NULL OR event_partition.upper_bound > extract(epoch FROM before)::BIGINT;
+        -- dropping a partition skips the triggers, the events are uncounted in bulk
+        IF to_regclass('tag_reference_count') IS NOT NULL AND to_regclass(regexp_replace(event_partition.name, '^event_', 'tag_')) IS NOT NULL THEN
+          EXECUTE format(
+            'UPDATE tag_reference_count c SET count = c.count - d.count FROM ('
+            '  SELECT t.tag_name, t.value, e.kind, count(DISTINCT t.associated_event) AS count'
+            '  FROM %I t JOIN %I e ON e.id = t.associated_event AND e.created_at = t.created_at'
+            '  WHERE t.tag_name IN (''e'', ''p'') AND t.value IS NOT NULL GROUP BY t.tag_name, t.value, e.kind'
+            ') d WHERE c.tag_name = d.tag_name AND c.value = d.value AND c.kind = d.kind',
+            regexp_replace(event_partition.name, '^event_', 'tag_'), event_partition.name
+          );
+        END IF;
+        -- the sketches cannot forget events, the days of the partition are dropped as a whole
+        IF to_regclass('event_count_sketch') IS NOT NULL THEN
+          DELETE FROM event_count_sketch WHERE day < event_partition.upper_bound / 86400;
+        END IF;
+        EXECUTE format('DROP TABLE IF EXISTS %I', regexp_replace(event_partition.name, '^event_', 'tag_'));
+        EXECUTE format('ALTER TABLE event DETACH PARTITION %I', event_partition.name);
+        EXECUTE format('DROP TABLE %I', event_partition.name);
+        dropped := dropped + 1;
+      END LOOP;
+      RETURN dropped;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+MIGRATION = Migration(
+    7,
+    "event count sketches",
+    statements=(EVENT_COUNT_SKETCH, DROP_EVENT_PARTITIONS_FUNCTION,),
+)
@@ -0,0 +1,45 @@
+"""
+The replace_event function keeps the event with the lowest id of the replaceable events with the same created_at,
+as NIP-01 asks, instead of the stored one; the relays receiving them in different orders keep the same event.
+"""
+
+from db.migrations import Migration
+from psycopg import sql
+
+
+REPLACE_EVENT_FUNCTION = sql.SQL(
+    """
+    CREATE OR REPLACE FUNCTION replace_event(
+      new_id CHAR(64),
+      new_pubkey CHAR(64),
+      new_created_at BIGINT,
+      new_kind INT,
+      new_content TEXT,
+      new_sig CHAR(128)
+    ) RETURNS BOOLEAN AS $$
+    BEGIN
+      PERFORM pg_advisory_xact_lock(hashtextextended(new_pubkey || ':' || new_kind, 0));
+      IF EXISTS (
+        SELECT 1 FROM event
+        WHERE kind = new_kind AND pubkey = new_pubkey
+          AND (created_at > new_created_at OR (created_at = new_created_at AND id <= new_id))
+      ) THEN
+        RETURN FALSE;
+      END IF;
+      -- the tags of the replaced events are deleted by cascade
+      DELETE FROM event WHERE kind = new_kind AND pubkey = new_pubkey;
+      INSERT INTO event (id, pubkey, created_at, kind, content, sig)
+      VALUES (new_id, new_pubkey, new_created_at, new_kind, new_content, new_sig)
+      ON CONFLICT DO NOTHING;
+      RETURN FOUND;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+MIGRATION = Migration(
+    8,
+    "replace_event keeps the lowest id of the same created_at",
+    statements=(REPLACE_EVENT_FUNCTION,),
+)
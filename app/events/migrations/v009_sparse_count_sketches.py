@@ -0,0 +1,101 @@
+"""
+The count sketches kept sparse: a sketch is the array of its non-empty registers, each kept as register << 6 | rank,
+instead of a rank bitmap of every register. The sketch of a day with a few events takes a few bytes, not 2^index_bits * 32 bits.
+The sketches are merged by the highest entry of each register, the ranks being in the low bits.
+The dense sketches are dropped and, if they were enabled, they are built again with the same number of registers;
+the writes wait until they are built. The counts are exact while the sketches are disabled.
+"""
+
+from db.migrations import Migration
+from psycopg import sql
+
+
+SPARSE_EVENT_COUNT_SKETCH = sql.SQL(
+    """
+    DROP FUNCTION IF EXISTS event_count_sketch_of(TEXT, BIT VARYING, INT, BIGINT);
+
+    -- the low bits of the hash select the register, the rank is the position of the first set bit of the others;
+    -- a single expression, so it is inlined into the queries
+    CREATE OR REPLACE FUNCTION event_count_sketch_of(event_id TEXT, index_bits INT, seed BIGINT) RETURNS INT AS $$
+      SELECT (hashtextextended(event_id, seed) & ((1 << index_bits) - 1))::INT << 6
+        | coalesce(nullif(position(B'1' IN substring(hashtextextended(event_id, seed)::BIT(64) FROM 1 FOR 64 - index_bits)), 0), 65 - index_bits)
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE OR REPLACE FUNCTION event_count_sketch_union(registers INT[], other_registers INT[]) RETURNS INT[] AS $$
+      SELECT array_agg(entry) FROM (SELECT max(entry) AS entry FROM unnest(registers || other_registers) entry GROUP BY entry >> 6) r
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE OR REPLACE FUNCTION sketch_inserted_events() RETURNS TRIGGER AS $$
+    DECLARE
+      config RECORD;
+    BEGIN
+      SELECT * INTO config FROM event_count_sketch_config;
+      IF NOT config.enabled THEN
+        RETURN NULL;
+      END IF;
+      INSERT INTO event_count_sketch (pubkey, kind, day, registers)
+      SELECT pubkey, kind, day, array_agg(entry)
+      FROM (
+        SELECT pubkey, kind, day, max(entry) AS entry
+        FROM (
+          SELECT pubkey, kind, floor(created_at / 86400.0)::BIGINT AS day, event_count_sketch_of(id, config.index_bits, config.seed) AS entry
+          FROM new_events
+        ) n
+        GROUP BY pubkey, kind, day, entry >> 6
+      ) r
+      GROUP BY pubkey, kind, day
+      -- the sketches are locked in the same order by the concurrent writers
+      ORDER BY pubkey, kind, day
+      ON CONFLICT (pubkey, kind, day) DO UPDATE SET registers = event_count_sketch_union(event_count_sketch.registers, excluded.registers);
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- sketches all of the events with 2^new_index_bits registers and enables the trigger, the writes wait until it is done
+    CREATE OR REPLACE FUNCTION build_event_count_sketches(new_index_bits INT) RETURNS BIGINT AS $$
+    DECLARE
+      config RECORD;
+      built BIGINT;
+    BEGIN
+      LOCK TABLE event IN SHARE MODE;
+      UPDATE event_count_sketch_config SET enabled = true, index_bits = new_index_bits RETURNING * INTO config;
+      TRUNCATE event_count_sketch;
+      INSERT INTO event_count_sketch (pubkey, kind, day, registers)
+      SELECT pubkey, kind, day, array_agg(entry)
+      FROM (
+        SELECT pubkey, kind, day, max(entry) AS entry
+        FROM (
+          SELECT pubkey, kind, floor(created_at / 86400.0)::BIGINT AS day, event_count_sketch_of(id, config.index_bits, config.seed) AS entry
+          FROM event
+        ) e
+        GROUP BY pubkey, kind, day, entry >> 6
+      ) r
+      GROUP BY pubkey, kind, day;
+      GET DIAGNOSTICS built = ROW_COUNT;
+      ANALYZE event_count_sketch;
+      RETURN built;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DO $$
+    DECLARE
+      config RECORD;
+    BEGIN
+      IF (SELECT data_type FROM information_schema.columns WHERE table_name = 'event_count_sketch' AND column_name = 'registers') = 'bit varying' THEN
+        TRUNCATE event_count_sketch;
+        ALTER TABLE event_count_sketch ALTER registers TYPE INT[] USING '{}';
+        SELECT * INTO config FROM event_count_sketch_config;
+        IF config.enabled THEN
+          PERFORM build_event_count_sketches(config.index_bits);
+        END IF;
+      END IF;
+    END $$;
+    """
+)
+
+
+MIGRATION = Migration(
+    9,
+    "sparse event count sketches",
+    statements=(SPARSE_EVENT_COUNT_SKETCH,),
+)
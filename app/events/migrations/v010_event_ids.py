@@ -0,0 +1,100 @@
+"""
+The ids of the stored events kept unique across the partitions, in the event_id table which is not partitioned.
+The key of the partitioned event table includes created_at, so it would let in an id sent again with another created_at.
+A trigger claims the id of every inserted event before the row is stored, the row is skipped if the id is claimed already;
+so the writers skipping the conflicts (write_events, replace_event, the imports) skip it the same way, without an error.
+The ids are released by a trigger when the events are deleted, drop_event_partitions releases the ids of the dropped partitions.
+The events already stored twice keep their earliest copy. The triggers lock out the writes until the existing ids are claimed.
+"""
+
+from db.migrations import Migration
+from psycopg import sql
+
+
+EVENT_ID = sql.SQL(
+    """
+    CREATE TABLE IF NOT EXISTS event_id (
+      id CHAR(64) PRIMARY KEY
+    );
+
+    CREATE OR REPLACE FUNCTION claim_inserted_event_id() RETURNS TRIGGER AS $$
+    BEGIN
+      INSERT INTO event_id (id) VALUES (NEW.id) ON CONFLICT DO NOTHING;
+      IF NOT FOUND THEN
+        RETURN NULL;
+      END IF;
+      RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION release_deleted_event_id() RETURNS TRIGGER AS $$
+    BEGIN
+      DELETE FROM event_id WHERE id = OLD.id;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS event_id_insert ON event;
+    CREATE TRIGGER event_id_insert BEFORE INSERT ON event
+      FOR EACH ROW EXECUTE FUNCTION claim_inserted_event_id();
+    DROP TRIGGER IF EXISTS event_id_delete ON event;
+    CREATE TRIGGER event_id_delete AFTER DELETE ON event
+      FOR EACH ROW EXECUTE FUNCTION release_deleted_event_id();
+
+    -- the tags of the later copies are deleted by cascade
+    DELETE FROM event later USING event earlier
+    WHERE later.id = earlier.id AND later.created_at > earlier.created_at;
+    INSERT INTO event_id (id) SELECT id FROM event ON CONFLICT DO NOTHING;
+    """
+)
+
+
+DROP_EVENT_PARTITIONS_FUNCTION = sql.SQL(
+    """
+    CREATE OR REPLACE FUNCTION drop_event_partitions(before TIMESTAMPTZ) RETURNS INT AS $$
+    DECLARE
+      event_partition RECORD;
+      dropped INT := 0;
+    BEGIN
+      PERFORM pg_advisory_xact_lock(hashtextextended('event_partitions', 0));
+      FOR event_partition IN
+        SELECT c.relname AS name,
+               (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''(-?\\d+)''\\)'))[1]::BIGINT AS upper_bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'event'::regclass
+      LOOP
+        CONTINUE WHEN event_partition.upper_bound IS NULL OR event_partition.upper_bound > extract(epoch FROM before)::BIGINT;
+        -- dropping a partition skips the triggers, the events are uncounted in bulk
+        IF to_regclass('tag_reference_count') IS NOT NULL AND to_regclass(regexp_replace(event_partition.name, '^event_', 'tag_')) IS NOT NULL THEN
+          EXECUTE format(
+            'UPDATE tag_reference_count c SET count = c.count - d.count FROM ('
+            '  SELECT t.tag_name, t.value, e.kind, count(DISTINCT t.associated_event) AS count'
+            '  FROM %I t JOIN %I e ON e.id = t.associated_event AND e.created_at = t.created_at'
+            '  WHERE t.tag_name IN (''e'', ''p'') AND t.value IS NOT NULL GROUP BY t.tag_name, t.value, e.kind'
+            ') d WHERE c.tag_name = d.tag_name AND c.value = d.value AND c.kind = d.kind',
+            regexp_replace(event_partition.name, '^event_', 'tag_'), event_partition.name
+          );
+        END IF;
+        -- the sketches cannot forget events, the days of the partition are dropped as a whole
+        IF to_regclass('event_count_sketch') IS NOT NULL THEN
+          DELETE FROM event_count_sketch WHERE day < event_partition.upper_bound / 86400;
+        END IF;
+        -- and the ids of the events are released in bulk
+        EXECUTE format('DELETE FROM event_id i USING %I e WHERE i.id = e.id', event_partition.name);
+        EXECUTE format('DROP TABLE IF EXISTS %I', regexp_replace(event_partition.name, '^event_', 'tag_'));
+        EXECUTE format('ALTER TABLE event DETACH PARTITION %I', event_partition.name);
+        EXECUTE format('DROP TABLE %I', event_partition.name);
+        dropped := dropped + 1;
+      END LOOP;
+      RETURN dropped;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+MIGRATION = Migration(
+    10,
+    "event ids unique across the partitions",
+    statements=(EVENT_ID, DROP_EVENT_PARTITIONS_FUNCTION),
+)
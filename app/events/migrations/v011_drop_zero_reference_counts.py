@@ -0,0 +1,89 @@
+"""
+The tag reference counters dropping to 0 are deleted, so the counters of the deleted and of the replaced events
+do not pile up. A missing counter counts 0; a writer counting the reference again inserts it anew.
+The counters already at 0 are deleted.
+"""
+
+from db.migrations import Migration
+from psycopg import sql
+
+
+UNCOUNT_DELETED_TAG_REFERENCES = sql.SQL(
+    """
+    CREATE OR REPLACE FUNCTION uncount_deleted_tag_references() RETURNS TRIGGER AS $$
+    BEGIN
+      UPDATE tag_reference_count c SET count = c.count - 1
+      FROM (
+        SELECT DISTINCT tag_name, value FROM tag
+        WHERE associated_event = OLD.id AND created_at = OLD.created_at AND tag_name IN ('e', 'p') AND value IS NOT NULL
+      ) t
+      WHERE c.tag_name = t.tag_name AND c.value = t.value AND c.kind = OLD.kind;
+      DELETE FROM tag_reference_count c
+      USING (
+        SELECT DISTINCT tag_name, value FROM tag
+        WHERE associated_event = OLD.id AND created_at = OLD.created_at AND tag_name IN ('e', 'p') AND value IS NOT NULL
+      ) t
+      WHERE c.tag_name = t.tag_name AND c.value = t.value AND c.kind = OLD.kind AND c.count <= 0;
+      RETURN OLD;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DELETE FROM tag_reference_count WHERE count <= 0;
+    """
+)
+
+
+DROP_EVENT_PARTITIONS_FUNCTION = sql.SQL(
+    """
+    CREATE OR REPLACE FUNCTION drop_event_partitions(before TIMESTAMPTZ) RETURNS INT AS $$
+    DECLARE
+      event_partition RECORD;
+      dropped INT := 0;
+    BEGIN
+      PERFORM pg_advisory_xact_lock(hashtextextended('event_partitions', 0));
+      FOR event_partition IN
+        SELECT c.relname AS name,
+               (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''(-?\\d+)''\\)'))[1]::BIGINT AS upper_bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'event'::regclass
+      LOOP
+        CONTINUE WHEN event_partition.upper_bound IS NULL OR event_partition.upper_bound > extract(epoch FROM before)::BIGINT;
+        -- dropping a partition skips the triggers, the events are uncounted in bulk
+        IF to_regclass('tag_reference_count') IS NOT NULL AND to_regclass(regexp_replace(event_partition.name, '^event_', 'tag_')) IS NOT NULL THEN
+          EXECUTE format(
+            'WITH dropped AS ('
+            '  SELECT t.tag_name, t.value, e.kind, count(DISTINCT t.associated_event) AS count'
+            '  FROM %I t JOIN %I e ON e.id = t.associated_event AND e.created_at = t.created_at'
+            '  WHERE t.tag_name IN (''e'', ''p'') AND t.value IS NOT NULL GROUP BY t.tag_name, t.value, e.kind'
+            '), uncounted AS ('
+            '  UPDATE tag_reference_count c SET count = c.count - d.count FROM dropped d'
+            '  WHERE c.tag_name = d.tag_name AND c.value = d.value AND c.kind = d.kind AND c.count > d.count'
+            ') '
+            'DELETE FROM tag_reference_count c USING dropped d '
+            'WHERE c.tag_name = d.tag_name AND c.value = d.value AND c.kind = d.kind AND c.count <= d.count',
+            regexp_replace(event_partition.name, '^event_', 'tag_'), event_partition.name
+          );
+        END IF;
+        -- the sketches cannot forget events, the days of the partition are dropped as a whole
+        IF to_regclass('event_count_sketch') IS NOT NULL THEN
+          DELETE FROM event_count_sketch WHERE day < event_partition.upper_bound / 86400;
+        END IF;
+        -- and the ids of the events are released in bulk
+        EXECUTE format('DELETE FROM event_id i USING %I e WHERE i.id = e.id', event_partition.name);
+        EXECUTE format('DROP TABLE IF EXISTS %I', regexp_replace(event_partition.name, '^event_', 'tag_'));
+        EXECUTE format('ALTER TABLE event DETACH PARTITION %I', event_partition.name);
+        EXECUTE format('DROP TABLE %I', event_partition.name);
+        dropped := dropped + 1;
+      END LOOP;
+      RETURN dropped;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+MIGRATION = Migration(
+    11,
+    "tag reference counters dropping to 0 are deleted",
+    statements=(UNCOUNT_DELETED_TAG_REFERENCES, DROP_EVENT_PARTITIONS_FUNCTION),
+)
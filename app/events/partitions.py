@@ -0,0 +1,69 @@
+import os
+from asyncio import sleep
+from typing import TypedDict
+
+from common import metrics
+from db.core import connect_db_pool
+from db.typings import DBConnection
+
+
+class PartitionConfig(TypedDict):
+    months_ahead: int
+    retention_months: int  # 0 keeps the events forever
+    interval: float  # seconds between the maintenance runs
+
+
+def partition_config() -> PartitionConfig:
+    return PartitionConfig(
+        months_ahead=int(os.getenv("partition_months_ahead", 3)),
+        retention_months=int(os.getenv("event_retention_months", 0)),
+        interval=float(os.getenv("partition_maintenance_interval", 6 * 60 * 60)),
+    )
+
+
+async def create_partitions(conn: DBConnection, *, months_ahead: int) -> int:
+    """
+    Creates the partitions of the current month and of the months ahead, returns the number of created months.
+    """
+    cur = await conn.execute("SELECT create_event_partitions(now(), %s)", (months_ahead + 1,))
+    row = await cur.fetchone()
+    return row[0] if row else 0
+
+
+async def drop_partitions(conn: DBConnection, *, retention_months: int) -> int:
+    """
+    Drops the partitions of the months before the retention period, with all of their events and tags.
+    Returns the number of dropped months.
+    """
+    cur = await conn.execute(
+        "SELECT drop_event_partitions(date_trunc('month', now(), 'UTC') - make_interval(months => %s))", (retention_months,)
+    )
+    row = await cur.fetchone()
+    return row[0] if row else 0
+
+
+async def maintain_partitions(*, months_ahead: int, retention_months: int) -> tuple[int, int]:
+    """
+    Returns the numbers of created and dropped months.
+    """
+    pool = connect_db_pool()
+    async with pool.connection() as conn:
+        created = await create_partitions(conn, months_ahead=months_ahead)
+        dropped = await drop_partitions(conn, retention_months=retention_months) if retention_months > 0 else 0
+    metrics.increment("partitions.created", created)
+    metrics.increment("partitions.dropped", dropped)
+    return created, dropped
+
+
+async def run_partition_maintenance(config: PartitionConfig) -> None:
+    """
+    Maintains the partitions periodically until it is cancelled, the failures are retried on the next run.
+    """
+    while True:
+        try:
+            created, dropped = await maintain_partitions(months_ahead=config["months_ahead"], retention_months=config["retention_months"])
+            if created or dropped:
+                print(f"Partitions are maintained, created months: {created} | dropped months: {dropped}")
+        except Exception as e:
+            print(f"Partition maintenance failed: {e!r}")
+        await sleep(config["interval"])
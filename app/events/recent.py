@@ -0,0 +1,325 @@
+import json
+import os
+import re
+import time
+from asyncio import sleep
+from bisect import bisect_left, bisect_right, insort
+from contextlib import aclosing
+from itertools import chain
+from typing import Any, Iterable, NamedTuple, TypedDict
+
+from common import metrics
+from subscriptions.hub import BroadcastEvent, SubscriptionHub
+from tags.data.e_tag import E_TAG_TAG_NAME
+from tags.data.p_tag import P_TAG_TAG_NAME
+
+from events.crud import stream_events
+from events.data import EVENT_DELETION_KIND, is_ephemeral_kind, is_replaceable_kind
+from events.filters import EventFilterer, Filters
+from events.typings import EventNostrDict
+
+FULL_KEY_REGEX = re.compile(r"^[0-9a-f]{64}$")
+WARM_CHUNK_SIZE = 1_000
+INDEXED_TAG_NAMES = (E_TAG_TAG_NAME, P_TAG_TAG_NAME)
+
+
+class RecentEventsConfig(TypedDict):
+    max_count: int  # 0 disables the buffer
+    max_bytes: int
+    window: int  # seconds
+    max_scan: int  # the filters testing more unmatched events are read from the db
+
+
+def recent_events_config() -> RecentEventsConfig:
+    return RecentEventsConfig(
+        max_count=int(os.getenv("recent_events_max_count", 20_000)),
+        max_bytes=int(os.getenv("recent_events_max_bytes", 32 * 1024 * 1024)),
+        window=int(os.getenv("recent_events_window", 10 * 60)),
+        max_scan=int(os.getenv("recent_events_max_scan", 2_000)),
+    )
+
+
+class RecentEvent(NamedTuple):
+    """
+    The fields of the event used by the indexes, the others are decoded from the encoded event when they are tested.
+    """
+
+    created_at: int
+    id: str
+    pubkey: str
+    kind: int
+    tag_keys: tuple[tuple[str, str], ...]  # the indexed tag names and their first values
+    encoded: str
+
+    @classmethod
+    def from_event(cls, event: EventNostrDict, encoded: str) -> "RecentEvent":
+        tag_keys = {(tag[0], tag[1]) for tag in event.get("tags") or () if len(tag) > 1 and tag[0] in INDEXED_TAG_NAMES}
+        return cls(event["created_at"], event["id"], event["pubkey"], event["kind"], tuple(tag_keys), encoded)
+
+    def decode(self, *, with_tags: bool) -> EventNostrDict:
+        if with_tags:
+            return json.loads(self.encoded)
+        return {"id": self.id, "pubkey": self.pubkey, "kind": self.kind, "created_at": self.created_at}  # type: ignore
+
+
+class RecentEvents:
+    """
+    The stored events created in the last window seconds, ordered by created_at, at most max_count and max_bytes of them.
+    It is warmed from the db, then it is kept up to date by the broadcasted events while it is attached to the hub.
+    The buffer holds all of the stored events created since covered_since: the oldest ones are evicted as a whole second,
+    and the events broadcasted while the hub reconnects are missed, so it moves forward.
+    The events written without a broadcast (i.e. bulk imports) are not known by the buffer.
+
+    Only the encoded events are kept along with their indexed fields, max_bytes bounds their encoded size.
+    The events are indexed by their ids, pubkeys, kinds and e and p tag values; a filter is tested on the events
+    of its most selective index, and it is read from the db once it tests more than max_scan unmatched events.
+    """
+
+    def __init__(self, *, max_count: int, max_bytes: int, window: int, max_scan: int) -> None:
+        self._max_count = max_count
+        self._max_bytes = max_bytes
+        self._window = window
+        self._max_scan = max_scan
+        self._events: list[RecentEvent] = []
+        self._by_id: dict[str, RecentEvent] = {}
+        # the events of the index keys, ordered by created_at
+        self._by_pubkey: dict[str, list[RecentEvent]] = {}
+        self._by_kind: dict[int, list[RecentEvent]] = {}
+        self._by_tag: dict[tuple[str, str], list[RecentEvent]] = {}
+        self._size = 0
+        self._covered_since = 0
+        self._hub: SubscriptionHub | None = None
+        self._is_ready = False
+        self._is_warming = False
+        self._stop_warming = False
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    @property
+    def size_in_bytes(self) -> int:
+        return self._size
+
+    @property
+    def is_ready(self) -> bool:
+        return self._is_ready and self._hub is not None
+
+    @property
+    def covered_since(self) -> int:
+        return self._covered_since
+
+    def attach(self, hub: SubscriptionHub) -> None:
+        """
+        Starts buffering the broadcasted events, it is warmed afterwards, so none of them are missed in between.
+        """
+        if self._max_count <= 0:
+            return
+        self._hub = hub
+        self._covered_since = int(time.time()) - self._window
+        hub.add_tap(self.add_broadcasted)
+        hub.add_reconnect_listener(self.skip_missed)
+
+    def detach(self) -> None:
+        if self._hub:
+            self._hub.remove_tap(self.add_broadcasted)
+            self._hub.remove_reconnect_listener(self.skip_missed)
+            self._hub = None
+        self._is_ready = False
+        self._evict(self._covered_since + 2**62)
+
+    async def warm(self) -> None:
+        if self._hub is None or self._is_ready or self._is_warming:
+            return
+        self._is_warming = True
+        self._stop_warming = False
+        try:
+            oldest = None
+            count = 0
+            # the newest events, up to the capacity of the buffer
+            warm_filter = Filters(since=self._covered_since, limit=self._max_count)
+            async with aclosing(stream_events(warm_filter, chunk_size=WARM_CHUNK_SIZE)) as chunks:
+                async for events in chunks:
+                    for event in events:
+                        self.add(event, json.dumps(event, separators=(",", ":")))
+                        oldest = min(oldest or event["created_at"], event["created_at"])
+                        count += 1
+                    if self._stop_warming:
+                        return
+                    await sleep(0)
+            if oldest is not None and count >= self._max_count:
+                # the limit may have cut the events of the oldest second
+                self._evict(oldest + 1)
+            self._is_ready = True
+            metrics.increment("recent_events.warmed")
+        finally:
+            self._is_warming = False
+
+    def stop_warming(self) -> None:
+        """
+        Stops the warm up after the current chunk.
+        """
+        self._stop_warming = True
+
+    def skip_missed(self) -> None:
+        """
+        The events broadcasted until now may be missed, the older part of the REQs is read from the db.
+        """
+        self._evict(int(time.time()) + 1)
+
+    def add_broadcasted(self, broadcasted: BroadcastEvent) -> None:
+        event = broadcasted.event
+        if is_ephemeral_kind(event["kind"]):
+            return
+        if event["kind"] == EVENT_DELETION_KIND:
+            for tag in event.get("tags") or ():
+                if len(tag) > 1 and tag[0] == E_TAG_TAG_NAME and (deleted := self._by_id.get(tag[1])):
+                    if deleted.pubkey == event["pubkey"]:
+                        self._remove(deleted)
+        if is_replaceable_kind(event["kind"]):
+            for replaced in tuple(self._by_pubkey.get(event["pubkey"], ())):
+                if replaced.kind == event["kind"] and replaced.id != event["id"]:
+                    self._remove(replaced)
+        self.add(event, broadcasted.encoded)
+
+    def add(self, event: EventNostrDict, encoded: str) -> None:
+        if event["created_at"] < self._covered_since or event["id"] in self._by_id:
+            return
+        recent = RecentEvent.from_event(event, encoded)
+        insort(self._events, recent, key=_sort_key)
+        self._by_id[recent.id] = recent
+        _index(self._by_pubkey, recent.pubkey, recent)
+        _index(self._by_kind, recent.kind, recent)
+        for tag_key in recent.tag_keys:
+            _index(self._by_tag, tag_key, recent)
+        self._size += len(encoded)
+        self._evict(int(time.time()) - self._window)
+
+    def split(self, filters: Iterable[Filters]) -> tuple[list[RecentEvent], list[Filters]]:
+        """
+        Returns the events of the filters created since covered_since from the newest to the oldest one,
+        and the filters of the older events to be read from the db, with their until and limit adjusted.
+        """
+        self._evict(int(time.time()) - self._window)
+        if not self.is_ready:
+            return [], list(filters)
+        matched: dict[str, RecentEvent] = {}
+        older_filters: list[Filters] = []
+        for f in filters:
+            if f.until and f.until < self._covered_since:
+                older_filters.append(f)
+                continue
+            events = self._match(f)
+            if events is None:
+                metrics.increment("recent_events.scan_limited")
+                older_filters.append(f)
+                continue
+            matched.update((event.id, event) for event in events)
+            if f.since and f.since >= self._covered_since:
+                metrics.increment("recent_events.answered")
+            elif not f.limit or len(events) < f.limit:
+                metrics.increment("recent_events.split")
+                older_filters.append(
+                    f.copy(update={"until": self._covered_since - 1, "limit": f.limit - len(events) if f.limit else None})
+                )
+            else:
+                metrics.increment("recent_events.answered")
+        return sorted(matched.values(), key=_sort_key, reverse=True), older_filters
+
+    def _match(self, f: Filters) -> list[RecentEvent] | None:
+        """
+        The matching events from the newest to the oldest one, None if more than max_scan events are tested unmatched.
+        """
+        candidates = self._candidates(f)
+        since = max(f.since or 0, self._covered_since)
+        start = bisect_left(candidates, since, key=_created_at)
+        end = bisect_right(candidates, f.until, key=_created_at) if f.until else len(candidates)
+        filterer = EventFilterer(f)
+        with_tags = bool(f.tags)
+        matched: list[RecentEvent] = []
+        unmatched = 0
+        for index in range(end - 1, start - 1, -1):
+            if filterer.test_event(candidates[index].decode(with_tags=with_tags)):
+                matched.append(candidates[index])
+                if f.limit and len(matched) >= f.limit:
+                    break
+            elif (unmatched := unmatched + 1) > self._max_scan:
+                return None
+        return matched
+
+    def _candidates(self, f: Filters) -> list[RecentEvent]:
+        """
+        The events of the most selective index of the filter: its full length ids or authors, its kinds
+        or its e and p tag values; all of the events if it cannot use any of them.
+        """
+        choices: list[list[list[RecentEvent]]] = []
+        if f.ids and all(FULL_KEY_REGEX.match(event_id) for event_id in f.ids):
+            choices.append([[event] for event_id in set(f.ids) if (event := self._by_id.get(event_id))])
+        if f.authors and all(FULL_KEY_REGEX.match(author) for author in f.authors):
+            choices.append([self._by_pubkey.get(author, []) for author in set(f.authors)])
+        if f.kinds:
+            choices.append([self._by_kind.get(kind, []) for kind in set(f.kinds)])
+        for tag_name in INDEXED_TAG_NAMES:
+            if values := f.tags.get(tag_name):
+                choices.append([self._by_tag.get((tag_name, value), []) for value in values])
+        if not choices:
+            return self._events
+        event_lists = min(choices, key=lambda lists: sum(map(len, lists)))
+        if len(event_lists) == 1:
+            return event_lists[0]
+        # an event may have more than one of the tag values
+        return sorted({event.id: event for event in chain.from_iterable(event_lists)}.values(), key=_sort_key)
+
+    def _evict(self, covered_since: int) -> None:
+        """
+        Drops the events created before covered_since, then the oldest seconds until the buffer is within its bounds.
+        """
+        self._covered_since = max(self._covered_since, covered_since)
+        end = bisect_left(self._events, self._covered_since, key=_created_at)
+        evicted_size = sum(len(event.encoded) for event in self._events[:end])
+        while end < len(self._events) and (len(self._events) - end > self._max_count or self._size - evicted_size > self._max_bytes):
+            oldest = self._events[end].created_at
+            self._covered_since = oldest + 1
+            second_end = bisect_right(self._events, oldest, key=_created_at)
+            evicted_size += sum(len(event.encoded) for event in self._events[end:second_end])
+            end = second_end
+        if not end:
+            return
+        for event in self._events[:end]:
+            self._forget(event)
+        del self._events[:end]
+        self._size -= evicted_size
+
+    def _remove(self, recent: RecentEvent) -> None:
+        index = bisect_left(self._events, _sort_key(recent), key=_sort_key)
+        if index < len(self._events) and self._events[index].id == recent.id:
+            del self._events[index]
+            self._size -= len(recent.encoded)
+            self._forget(recent)
+
+    def _forget(self, recent: RecentEvent) -> None:
+        self._by_id.pop(recent.id, None)
+        _unindex(self._by_pubkey, recent.pubkey, recent)
+        _unindex(self._by_kind, recent.kind, recent)
+        for tag_key in recent.tag_keys:
+            _unindex(self._by_tag, tag_key, recent)
+
+
+def _index(index: dict[Any, list[RecentEvent]], key: Any, recent: RecentEvent) -> None:
+    insort(index.setdefault(key, []), recent, key=_sort_key)
+
+
+def _unindex(index: dict[Any, list[RecentEvent]], key: Any, recent: RecentEvent) -> None:
+    if (events := index.get(key)) is not None:
+        position = bisect_left(events, _sort_key(recent), key=_sort_key)
+        if position < len(events) and events[position].id == recent.id:
+            del events[position]
+        if not events:
+            del index[key]
+
+
+def _sort_key(event: RecentEvent) -> tuple[int, str]:
+    return event.created_at, event.id
+
+
+def _created_at(event: RecentEvent) -> int:
+    return event.created_at
@@ -0,0 +1,399 @@
+import json
+import os
+import time
+from asyncio import AbstractEventLoop, Lock, Task, create_task, get_running_loop
+from bisect import insort
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from hashlib import sha256
+from typing import AsyncIterator, Coroutine, NamedTuple, TypedDict
+
+from cache.crud import delete_key, get_value, set_value
+from common import metrics
+from subscriptions.hub import BroadcastEvent, SubscriptionHub
+from subscriptions.index import SubscriptionIndex
+from tags.data.e_tag import E_TAG_TAG_NAME
+
+from events.data import EVENT_DELETION_KIND, is_ephemeral_kind, is_replaceable_kind
+from events.filters import Filters
+from events.typings import EventNostrDict
+
+SHARED_KEY_PREFIX = "req_cache:"
+
+
+class ResultCacheConfig(TypedDict):
+    max_bytes: int  # 0 disables the cache
+    max_entries: int
+    ttl: float  # seconds
+    max_limit: int  # the filters without a limit or with a greater one are not cached
+    shared: bool  # keeps the results in redis too, for the other processes
+
+
+def result_cache_config() -> ResultCacheConfig:
+    return ResultCacheConfig(
+        max_bytes=int(os.getenv("req_cache_max_bytes", 32 * 1024 * 1024)),
+        max_entries=int(os.getenv("req_cache_max_entries", 10_000)),
+        ttl=float(os.getenv("req_cache_ttl", 60)),
+        max_limit=int(os.getenv("req_cache_max_limit", 500)),
+        shared=os.getenv("req_cache_shared", "0") == "1",
+    )
+
+
+class CachedEvent(NamedTuple):
+    created_at: int
+    id: str
+    kind: int
+    pubkey: str
+    encoded: str
+
+    @classmethod
+    def from_encoded(cls, encoded: str, event: EventNostrDict | None = None) -> "CachedEvent":
+        event = event or json.loads(encoded)
+        return cls(event["created_at"], event["id"], event["kind"], event["pubkey"], encoded)
+
+
+class CachedResult:
+    __slots__ = ("filters", "events", "size", "expires_at")
+
+    def __init__(self, filters: tuple[Filters, ...], events: list[CachedEvent], expires_at: float) -> None:
+        self.filters = filters
+        self.events = events  # in the order they are sent
+        self.size = sum(len(event.encoded) for event in events)
+        self.expires_at = expires_at
+
+
+class ResultFill:
+    """
+    The events of a result being read, they are dropped once they exceed the byte budget of the cache.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.events: list[CachedEvent] = []
+        self.is_complete = False
+        self.is_shared = False
+        self._remaining_bytes = max_bytes
+
+    def add(self, encoded: str, event: EventNostrDict | None = None) -> None:
+        if self._remaining_bytes < 0:
+            return
+        self._remaining_bytes -= len(encoded)
+        if self._remaining_bytes < 0:
+            self.events.clear()
+            return
+        self.events.append(CachedEvent.from_encoded(encoded, event))
+
+    def complete(self, *, shared: bool = False) -> None:
+        self.is_complete = self._remaining_bytes >= 0
+        self.is_shared = shared
+
+
+def normalize_filters(filters: list[Filters]) -> str:
+    """
+    The filters in a canonical form, the REQs asking for the same events get the same key.
+    The order of the filters and of their values does not change the result, neither do the empty values.
+    """
+    normalized = sorted(
+        json.dumps(
+            {
+                "ids": sorted(set(f.ids)) if f.ids else None,
+                "authors": sorted(set(f.authors)) if f.authors else None,
+                "kinds": sorted(set(f.kinds)) if f.kinds else None,
+                "since": f.since or None,
+                "until": f.until or None,
+                "limit": f.limit or None,
+                "tags": {tag_name: sorted(values) for tag_name, values in sorted(f.tags.items()) if values},
+            },
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        for f in filters
+    )
+    return f"[{','.join(normalized)}]"
+
+
+def could_hold(filters: tuple[Filters, ...], pubkey: str, kind: int | None) -> bool:
+    """
+    Whether a result of the filters could hold an event of the pubkey (and of the kind, if it is given).
+    The other fields of the event are not known, they are not tested.
+    """
+    return any(
+        (not f.authors or any(pubkey.startswith(author) for author in f.authors)) and (kind is None or not f.kinds or kind in f.kinds)
+        for f in filters
+    )
+
+
+class ResultCache:
+    """
+    The encoded results of the REQs with a limit, kept in the memory by their normalized filters.
+    The least recently used results are evicted above max_entries or max_bytes, the results expire after the ttl.
+
+    The cache is kept up to date by the broadcasted events, so it is used only while it is attached to the hub:
+    a new event is patched into the results of a single filter and invalidates the results of multiple filters,
+    a replacing or a deletion event invalidates the results holding the replaced or the deleted events.
+    A result read while a matching event is broadcasted is not stored, it may miss that event.
+    The events written without a broadcast (i.e. bulk imports) show up once the results expire.
+
+    The shared results in redis are deleted by the processes holding them when they are removed (invalidated,
+    evicted or cleared) or patched. The process storing a shared result holds it until it is removed,
+    so every shared result is deleted once it is outdated. The redis writes of a process run in their order.
+    """
+
+    def __init__(self, *, max_bytes: int, max_entries: int, ttl: float, max_limit: int, shared: bool) -> None:
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._max_limit = max_limit
+        self._shared = shared
+        self._entries: OrderedDict[str, CachedResult] = OrderedDict()
+        self._size = 0
+        # the filters of the stored and of the pending results
+        self._index = SubscriptionIndex()
+        self._pending: dict[str, int] = {}  # key -> number of the running fills
+        self._pending_filters: dict[str, tuple[Filters, ...]] = {}
+        self._outdated: set[str] = set()  # the pending keys that matched a broadcasted event
+        self._keys_by_event_id: dict[str, set[str]] = {}
+        self._keys_by_replaceable: dict[tuple[int, str], set[str]] = {}
+        self._hub: SubscriptionHub | None = None
+        self._background_tasks: set[Task] = set()
+        self._unshared: list[str] = []  # the shared keys of the removed results, to be deleted
+        self._write_lock: tuple[AbstractEventLoop, Lock] | None = None
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_in_bytes(self) -> int:
+        return self._size
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self._hits + self._misses
+        return self._hits / lookups if lookups else 0.0
+
+    @property
+    def is_active(self) -> bool:
+        return self._hub is not None and self._max_bytes > 0
+
+    def attach(self, hub: SubscriptionHub) -> None:
+        self._hub = hub
+        hub.add_tap(self.apply_broadcasted)
+        # the events broadcasted while the hub reconnects are missed
+        hub.add_reconnect_listener(self.clear)
+
+    def detach(self) -> None:
+        if self._hub:
+            self._hub.remove_tap(self.apply_broadcasted)
+            self._hub.remove_reconnect_listener(self.clear)
+            self._hub = None
+        self.clear()
+
+    def clear(self) -> None:
+        self._outdated.update(self._pending)
+        for key in tuple(self._entries):
+            self._remove(key)
+        self._delete_unshared()
+
+    def key_of(self, filters: list[Filters]) -> str | None:
+        """
+        The key of the filters if their result can be cached, None otherwise.
+        """
+        if not self.is_active or not filters or any(not f.limit or f.limit > self._max_limit for f in filters):
+            return None
+        return normalize_filters(filters)
+
+    def get(self, key: str) -> list[str] | None:
+        """
+        Returns the encoded events of the result in the order they are sent.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self._delete_unshared()
+            entry = None
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self._hits += 1
+            metrics.increment("req_cache.hits")
+            return [event.encoded for event in entry.events]
+        self._misses += 1
+        metrics.increment("req_cache.misses")
+        return None
+
+    async def get_shared(self, key: str, filters: tuple[Filters, ...]) -> list[str] | None:
+        """
+        Returns the result stored by the other processes in redis, keeping it in the memory too.
+        """
+        if not self._shared:
+            return None
+        async with self.filling(key, filters) as fill:
+            encoded_events = await get_value(self._shared_key(key))
+            if encoded_events is None:
+                return None
+            for encoded in json.loads(encoded_events):
+                fill.add(encoded)
+            fill.complete(shared=True)
+        metrics.increment("req_cache.shared_hits")
+        return [event.encoded for event in fill.events]
+
+    @asynccontextmanager
+    async def filling(self, key: str, filters: tuple[Filters, ...]) -> AsyncIterator["ResultFill"]:
+        """
+        Collects the events of a result while it is read, it is stored if the fill is completed,
+        unless a matching event is broadcasted in the meantime.
+        """
+        self._pending[key] = self._pending.get(key, 0) + 1
+        if self._pending[key] == 1:
+            self._pending_filters[key] = filters
+            if key not in self._entries:
+                self._index.add(key, filters)
+        fill = ResultFill(self._max_bytes)
+        try:
+            yield fill
+        finally:
+            is_outdated = key in self._outdated
+            self._finish_filling(key)
+        if fill.is_complete and not is_outdated:
+            self._put(key, filters, fill.events, share=self._shared and not fill.is_shared)
+
+    def apply_broadcasted(self, broadcasted: BroadcastEvent) -> None:
+        event = broadcasted.event
+        if is_ephemeral_kind(event["kind"]) or not (self._entries or self._pending):
+            return
+        invalidated: set[str] = set()
+        if event["kind"] == EVENT_DELETION_KIND:
+            for tag in event.get("tags") or ():
+                if len(tag) > 1 and tag[0] == E_TAG_TAG_NAME:
+                    invalidated.update(self._keys_by_event_id.get(tag[1], ()))
+        if is_replaceable_kind(event["kind"]):
+            invalidated.update(self._keys_by_replaceable.get((event["kind"], event["pubkey"]), ()))
+        if is_replaceable_kind(event["kind"]) or event["kind"] == EVENT_DELETION_KIND:
+            # the pending results may hold the replaced or the deleted events of the author, they are not known yet
+            replaced_kind = None if event["kind"] == EVENT_DELETION_KIND else event["kind"]
+            self._outdated.update(
+                key for key, filters in self._pending_filters.items() if could_hold(filters, event["pubkey"], replaced_kind)
+            )
+        patched: set[str] = set()
+        for key in self._index.match(event):
+            if key in self._pending:
+                self._outdated.add(key)
+            if key in invalidated or key not in self._entries:
+                continue
+            if self._patch(key, CachedEvent.from_encoded(broadcasted.encoded, event)):
+                patched.add(key)
+            else:
+                invalidated.add(key)
+        for key in invalidated:
+            self._remove(key)
+        metrics.increment("req_cache.patched", len(patched))
+        metrics.increment("req_cache.invalidated", len(invalidated))
+        if self._shared:
+            self._unshared.extend(self._shared_key(key) for key in patched)
+        self._delete_unshared()
+
+    def _patch(self, key: str, event: CachedEvent) -> bool:
+        """
+        Inserts the event into the result of a single filter by its created_at, the oldest one above the limit is dropped.
+        The results of multiple filters cannot be patched, the limits apply to each filter separately.
+        """
+        entry = self._entries[key]
+        if len(entry.filters) != 1:
+            return False
+        if any(cached.id == event.id for cached in entry.events):
+            # the result was read after the event is stored
+            return True
+        limit = entry.filters[0].limit or 0
+        if len(entry.events) >= limit and event.created_at <= entry.events[-1].created_at:
+            return True
+        # the events are ordered by created_at descending
+        insort(entry.events, event, key=lambda cached: -cached.created_at)
+        self._index_event(key, event, add=True)
+        entry.size += len(event.encoded)
+        self._size += len(event.encoded)
+        while len(entry.events) > limit:
+            dropped = entry.events.pop()
+            self._index_event(key, dropped, add=False)
+            entry.size -= len(dropped.encoded)
+            self._size -= len(dropped.encoded)
+        self._evict()
+        return True
+
+    def _put(self, key: str, filters: tuple[Filters, ...], events: list[CachedEvent], *, share: bool) -> None:
+        entry = CachedResult(filters, events, time.monotonic() + self._ttl)
+        if entry.size > self._max_bytes:
+            return
+        # the shared result is replaced below or it is the one just read
+        self._remove(key, unshare=False)
+        self._entries[key] = entry
+        self._size += entry.size
+        self._index.add(key, filters)
+        for event in events:
+            self._index_event(key, event, add=True)
+        self._evict()
+        self._delete_unshared()
+        if share and key in self._entries:
+            encoded_events = json.dumps([event.encoded for event in events])
+            self._run_in_background(set_value(self._shared_key(key), encoded_events, ttl_ms=int(self._ttl * 1000)))
+
+    def _remove(self, key: str, *, unshare: bool = True) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        if self._shared and unshare:
+            self._unshared.append(self._shared_key(key))
+        self._size -= entry.size
+        for event in entry.events:
+            self._index_event(key, event, add=False)
+        if key not in self._pending:
+            self._index.remove(key)
+
+    def _evict(self) -> None:
+        while self._entries and (self._size > self._max_bytes or len(self._entries) > self._max_entries):
+            self._remove(next(iter(self._entries)))
+            metrics.increment("req_cache.evicted")
+
+    def _finish_filling(self, key: str) -> None:
+        if remaining := self._pending[key] - 1:
+            self._pending[key] = remaining
+            return
+        del self._pending[key]
+        del self._pending_filters[key]
+        self._outdated.discard(key)
+        if key not in self._entries:
+            self._index.remove(key)
+
+    def _index_event(self, key: str, event: CachedEvent, *, add: bool) -> None:
+        indexes: list[tuple[dict, str | tuple[int, str]]] = [(self._keys_by_event_id, event.id)]
+        if is_replaceable_kind(event.kind):
+            indexes.append((self._keys_by_replaceable, (event.kind, event.pubkey)))
+        for index, index_key in indexes:
+            if add:
+                index.setdefault(index_key, set()).add(key)
+            elif keys := index.get(index_key):
+                keys.discard(key)
+                if not keys:
+                    del index[index_key]
+
+    def _delete_unshared(self) -> None:
+        if self._unshared:
+            keys, self._unshared = self._unshared, []
+            self._run_in_background(delete_key(*keys))
+
+    def _run_in_background(self, coroutine: Coroutine) -> None:
+        # the writes run one at a time in the order they are started, so a deletion is not overtaken by an older write
+        task = create_task(self._write_in_order(coroutine))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _write_in_order(self, coroutine: Coroutine) -> None:
+        # the cache outlives the event loops (i.e. in tests), a lock is bound to its loop
+        loop = get_running_loop()
+        if self._write_lock is None or self._write_lock[0] is not loop:
+            self._write_lock = (loop, Lock())
+        async with self._write_lock[1]:
+            await coroutine
+
+    @staticmethod
+    def _shared_key(key: str) -> str:
+        return f"{SHARED_KEY_PREFIX}{sha256(key.encode()).hexdigest()}"
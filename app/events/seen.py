@@ -0,0 +1,224 @@
+import json
+import os
+import re
+from asyncio import CancelledError, Task, create_task, current_task, sleep
+from contextlib import aclosing
+from typing import Callable, TypedDict
+
+from cache.crud import listen_on_key
+from common import metrics
+from common.bloom import BloomFilter
+from common.lru import LRUCache
+from subscriptions.hub import BroadcastEvent
+
+from events.crud import stream_event_ids
+from events.filters import Filters
+
+FULL_ID_REGEX = re.compile(r"^[0-9a-f]{64}$")
+REBUILD_CHUNK_SIZE = 10_000
+# the bulk imports publish the ids of the stored events here, as a json list per chunk
+IMPORTED_IDS_KEY = "imported_event_ids"
+RECONNECT_DELAY = 1  # seconds
+
+
+class SeenEventIdsConfig(TypedDict):
+    capacity: int
+    error_rate: float
+    recent_size: int
+
+
+def seen_event_ids_config() -> SeenEventIdsConfig:
+    return SeenEventIdsConfig(
+        capacity=int(os.getenv("seen_ids_capacity", 10_000_000)),
+        error_rate=float(os.getenv("seen_ids_error_rate", 0.01)),
+        recent_size=int(os.getenv("seen_ids_recent_size", 100_000)),
+    )
+
+
+class SeenEventIds:
+    """
+    Ids of the stored events known by this process.
+    The recent ids are kept exactly in an LRU, so an event found there is certainly a duplicate.
+    All of the ids are kept in a bloom filter, so an id missing there is certainly not stored.
+    The bloom filter is trusted only after it is rebuilt from the db; it is kept up to date
+    by the events stored by this process, by the broadcasted ones of the other processes
+    and by the ids published by the bulk imports (see follow_imports).
+    A rebuild fills a new bloom filter and swaps it in, its capacity is doubled whenever it is outgrown.
+    """
+
+    def __init__(self, *, capacity: int, error_rate: float, recent_size: int) -> None:
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._building: BloomFilter | None = None
+        self._recent: LRUCache[str, bool] = LRUCache(recent_size)
+        self._is_ready = False
+        self._is_rebuilding = False
+        self._stop_rebuilding = False
+        self._rebuild_requested = False
+        self._rebuild_task: Task | None = None
+        self._import_listeners: list[Callable[[str], None]] = []
+
+    @property
+    def is_ready(self) -> bool:
+        return self._is_ready
+
+    @property
+    def bloom_count(self) -> int:
+        return self._bloom.count
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def add(self, event_id: str) -> None:
+        if event_id not in self._recent:
+            self._add_to_bloom(event_id)
+        self._recent.put(event_id, True)
+
+    def add_broadcasted(self, broadcasted: BroadcastEvent) -> None:
+        self.add(broadcasted.event["id"])
+
+    def add_import_listener(self, listener: Callable[[str], None]) -> None:
+        """
+        Registers a callback called with the ids published by the bulk imports, as they are published (a json list).
+        """
+        if listener not in self._import_listeners:
+            self._import_listeners.append(listener)
+
+    def remove_import_listener(self, listener: Callable[[str], None]) -> None:
+        if listener in self._import_listeners:
+            self._import_listeners.remove(listener)
+
+    def dispatch_imported(self, data: str) -> None:
+        """
+        Adds the imported ids and hands them to the import listeners.
+        A bad payload or a failing listener is logged, it does not stop the follower;
+        a lost subscription would cost a rebuild of the bloom filter.
+        """
+        for callback in (self.add_imported, *self._import_listeners):
+            try:
+                callback(data)
+            except Exception as exc:
+                print(f"Seen Event Ids Import Callback {callback!r} Failed: {exc!r}")
+
+    def add_imported(self, data: str) -> None:
+        for event_id in json.loads(data):
+            self._add_to_bloom(event_id)
+
+    def _add_to_bloom(self, event_id: str) -> None:
+        self._bloom.add(event_id)
+        if self._building is not None:
+            # the rebuilt one must not miss the ids stored during the rebuild
+            self._building.add(event_id)
+        elif self._bloom.count > self._capacity:
+            # the false positive rate grows past the capacity, a larger one is built
+            self._capacity *= 2
+            metrics.increment("seen_ids.resizes")
+            self.invalidate()
+
+    def discard(self, event_id: str) -> None:
+        # the bloom filter keeps it, it only causes a query to run
+        self._recent.pop(event_id)
+
+    def is_duplicate(self, event_id: str) -> bool:
+        return self._recent.get(event_id) is not None
+
+    def may_exist(self, event_id: str) -> bool:
+        if not self._is_ready or not FULL_ID_REGEX.match(event_id):
+            return True
+        return event_id in self._bloom
+
+    def may_match(self, f: Filters) -> bool:
+        """
+        False if the filter certainly matches no stored events, i.e. it requires unknown full length ids.
+        """
+        return not f.ids or any(self.may_exist(event_id) for event_id in f.ids)
+
+    def invalidate(self) -> None:
+        """
+        Stops trusting the bloom filter until it is rebuilt,
+        i.e. the ids stored while the broadcasts are not listened are missed.
+        """
+        self._is_ready = False
+        if self._rebuild_task is None or self._rebuild_task.done():
+            self._rebuild_task = create_task(self.rebuild(), name="SEEN-EVENT-IDS-REBUILD")
+        else:
+            # the running one is continued, even if it is stopped by a lost connection
+            self._rebuild_requested = True
+            self._stop_rebuilding = False
+
+    async def rebuild(self) -> None:
+        """
+        Adds the ids of the stored events to a new bloom filter, it is swapped in and trusted once it is done.
+        If it is requested again in the meantime, the ids are read once more after it is done,
+        so the ones stored before the request are not missed.
+        If more ids are stored than the capacity, it starts over with the doubled capacity.
+        """
+        self._rebuild_requested = True
+        if self._is_rebuilding:
+            return
+        self._is_rebuilding = True
+        self._stop_rebuilding = False
+        try:
+            while self._rebuild_requested:
+                self._rebuild_requested = False
+                if self._building is None:
+                    self._building = BloomFilter(self._capacity, self._error_rate)
+                building = self._building
+                async with aclosing(stream_event_ids(chunk_size=REBUILD_CHUNK_SIZE)) as chunks:
+                    async for event_ids in chunks:
+                        for event_id in event_ids:
+                            building.add(event_id)
+                        if self._stop_rebuilding:
+                            return
+                        if building.count > self._capacity:
+                            self._capacity *= 2
+                            metrics.increment("seen_ids.resizes")
+                            self._building = None
+                            self._rebuild_requested = True
+                            break
+                        # let the other tasks run in between the chunks
+                        await sleep(0)
+                metrics.increment("seen_ids.rebuilds")
+            self._bloom, self._building = building, None
+            self._is_ready = True
+        finally:
+            self._is_rebuilding = False
+            self._building = None
+
+    async def follow_imports(self) -> None:
+        """
+        Listens the ids published by the bulk imports until it is cancelled.
+        The bloom filter is rebuilt whenever the channel is listened (again),
+        and it is not trusted while the channel is not listened, so the imported ids are not missed.
+        """
+        while True:
+            try:
+                async with listen_on_key(IMPORTED_IDS_KEY) as listener:
+                    async for message in listener:
+                        if message["type"] == "message":
+                            self.dispatch_imported(message["data"])
+                        elif message["type"] == "subscribe":
+                            self.invalidate()
+            except Exception as exc:
+                if (task := current_task()) and task.cancelling():
+                    raise CancelledError() from exc
+                print(f"Seen Event Ids Follower Failed: {exc!r}")
+            # listener exits only when the connection is lost
+            self._is_ready = False
+            self._stop_rebuilding = True
+            await sleep(RECONNECT_DELAY)
+
+    def stop_rebuilding(self) -> None:
+        """
+        Stops the rebuild after the current chunk.
+        It is not cancelled, a cancelled query would leave its pool connection unusable.
+        """
+        self._stop_rebuilding = True
+
+    async def close(self) -> None:
+        self.stop_rebuilding()
+        if self._rebuild_task:
+            await self._rebuild_task
+            self._rebuild_task = None
@@ -23,18 +23,32 @@ def validate_event_id(event: Event) -> bool:
     return True
 
 
+def verify_signature(pubkey: str, event_id: str, sig: str) -> bool:
+    try:
+        public_key = secp256k1.PublicKey(bytes.fromhex("02" + pubkey), True)
+        return public_key.schnorr_verify(bytes.fromhex(event_id), bytes.fromhex(sig), "", True)
+    except Exception:
+        # malformed hex strings or invalid public keys
+        return False
+
+
+def verify_signatures(signed: list[tuple[str, str, str]]) -> list[bool]:
+    """
+    Verifies a batch of (pubkey, event id, signature)s, it is meant to run in a worker.
+    """
+    return [verify_signature(pubkey, event_id, sig) for pubkey, event_id, sig in signed]
+
+
 def validate_event_sig(event: Event) -> bool:
-    pubkey = secp256k1.PublicKey(bytes.fromhex("02" + event.pubkey), True)
-    if pubkey.schnorr_verify(bytes.fromhex(event.id), bytes.fromhex(event.sig), "", True):
+    if verify_signature(event.pubkey, event.id, event.sig):
         return True
     else:
         raise NostrValidationError("Event Signature is not valid!")
 
 
-def validate_created_at(event: Event) -> bool:
+def validate_created_at(event: Event, *, max_age: float = 24 * 60 * 60 * 7, max_future: float = 0) -> bool:
     now = datetime.datetime.now().timestamp()
-    a_week_before = now - 24 * 60 * 60 * 7
-    if event.created_at < a_week_before or event.created_at > now:
+    if event.created_at < now - max_age or event.created_at > now + max_future:
         raise NostrValidationError("Event Timestamp is too old!")
     return True
 
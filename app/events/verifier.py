@@ -0,0 +1,102 @@
+import os
+from asyncio import get_running_loop
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TypedDict
+
+from common import metrics
+from common.batching import MicroBatcher
+from common.errors import NostrValidationError
+from common.lru import LRUCache
+
+from events.data import Event
+from events.validators import validate_created_at, validate_event_id, verify_signatures
+
+SignedId = tuple[str, str, str]  # (pubkey, event id, signature)
+
+
+class EventVerifierConfig(TypedDict):
+    max_content_length: int
+    max_tags: int
+    max_age: float
+    max_future: float
+    workers: int
+    process_pool: bool
+    max_batch_size: int
+    max_delay: float
+    cache_size: int
+
+
+def event_verifier_config() -> EventVerifierConfig:
+    return EventVerifierConfig(
+        max_content_length=int(os.getenv("verify_max_content_length", 64 * 1024)),
+        max_tags=int(os.getenv("verify_max_tags", 2500)),
+        max_age=float(os.getenv("verify_max_age_seconds", 24 * 60 * 60 * 7)),
+        max_future=float(os.getenv("verify_max_future_seconds", 0)),
+        workers=int(os.getenv("verify_workers", os.cpu_count() or 1)),
+        process_pool=os.getenv("verify_pool", "thread") == "process",
+        max_batch_size=int(os.getenv("verify_batch_size", 64)),
+        max_delay=int(os.getenv("verify_batch_delay_ms", 2)) / 1000,
+        cache_size=int(os.getenv("verify_cache_size", 100_000)),
+    )
+
+
+def verification_enabled() -> bool:
+    return os.getenv("verify_events", "0") == "1"
+
+
+class EventVerifier:
+    """
+    Runs the checks of an event from the cheapest to the most expensive one:
+    size, timestamp, id hash and signature.
+    Signatures are verified in batches on a worker pool (secp256k1 releases the GIL, so threads run in parallel),
+    and the verified (id, signature) pairs are remembered so rebroadcasts skip the signature check.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_content_length: int,
+        max_tags: int,
+        max_age: float,
+        max_future: float,
+        workers: int,
+        process_pool: bool,
+        max_batch_size: int,
+        max_delay: float,
+        cache_size: int,
+    ) -> None:
+        self._max_content_length = max_content_length
+        self._max_tags = max_tags
+        self._max_age = max_age
+        self._max_future = max_future
+        self._executor: Executor = ProcessPoolExecutor(workers) if process_pool else ThreadPoolExecutor(workers, "event-verifier")
+        self._signatures: MicroBatcher[SignedId, bool] = MicroBatcher(
+            self._verify_signatures, max_batch_size=max_batch_size, max_delay=max_delay, name="SIGNATURE-VERIFIER"
+        )
+        self._verified: LRUCache[tuple[str, str], bool] = LRUCache(cache_size)
+
+    async def verify(self, event: Event) -> None:
+        """
+        Raises NostrValidationError if the event is not valid.
+        """
+        if len(event.content) > self._max_content_length or len(event.tags) > self._max_tags:
+            raise NostrValidationError("Event is too large!")
+        validate_created_at(event, max_age=self._max_age, max_future=self._max_future)
+        # the hash binds the content to the id, so the cached (id, sig) pairs cannot be reused for another content
+        validate_event_id(event)
+        if self._verified.get((event.id, event.sig)):
+            metrics.increment("verifier.cache_hits")
+            return
+        if not await self._signatures.submit((event.pubkey, event.id, event.sig)):
+            metrics.increment("verifier.invalid_signatures")
+            raise NostrValidationError("Event Signature is not valid!")
+        self._verified.put((event.id, event.sig), True)
+
+    async def close(self) -> None:
+        await self._signatures.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _verify_signatures(self, signed: list[SignedId]) -> list[bool]:
+        metrics.increment("verifier.batches")
+        metrics.increment("verifier.signatures", len(signed))
+        return await get_running_loop().run_in_executor(self._executor, verify_signatures, signed)
@@ -1,16 +1,29 @@
+import os
+
 from common.typings import SenderAsyncWebsocket
-from events.crud import count_events
+from events.crud import approximate_count_events, count_events
 from events.enums import MessageTypes
 
 from events.filters import Filters
 
 
+def approximate_count_enabled() -> bool:
+    """
+    The broad filters are counted from the sketches when it is enabled, see events.crud.approximate_count_events.
+    """
+    return os.getenv("count_approximate", "0") == "1"
+
+
 async def handle_received_count(ws: SenderAsyncWebsocket, subs_id: str, filters: list[Filters]) -> None:
-    count = await count_events(*filters)
+    count_data: dict[str, int | bool] = {}
+    if approximate_count_enabled() and (approximate_count := await approximate_count_events(*filters)) is not None:
+        count_data = {"count": approximate_count, "approximate": True}
+    else:
+        count_data = {"count": await count_events(*filters)}
     await ws.send_json(
         [
             MessageTypes.Count.value,
             subs_id,
-            {"count": count},
+            count_data,
         ]
     )
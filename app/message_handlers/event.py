@@ -1,42 +1,86 @@
 import json
-from cache.crud import broadcast
-from common.tools import surpress_exc_coroutine
-from events.crud import delete_event_by_kind_pubkey, delete_events, fetch_event_by_kind_pubkey, write_event
-from events.data import CONTACT_LIST_KIND, METADATA_KIND, Event
-from pydantic import ValidationError
-from common.errors import InvalidMessageError, ErrorTypes
+from functools import cache
+
+from events.crud import delete_events, replace_event, write_events
+from events.codec import get_codec
+from common import metrics
+from events.hot import HotEvents, hot_events_config
+from events.ingest import BroadcastBatcher, IngestBatcher, broadcast_batcher_config, ingest_batcher_config
+from events.seen import SeenEventIds, seen_event_ids_config
+from events.verifier import EventVerifier, event_verifier_config, verification_enabled
 from events.typings import EventNostrDict
-from psycopg.errors import UniqueViolation
 
 from tags.data.e_tag import E_Tag
 
 NEW_EVENT_KEY = "events"
 
 
+@cache
+def get_ingest_batcher() -> IngestBatcher:
+    """
+    Returns the ingest batcher of this process, the events are stored through it in batches.
+    """
+    return IngestBatcher(write_events, **ingest_batcher_config())
+
+
+@cache
+def get_broadcast_batcher() -> BroadcastBatcher:
+    """
+    Returns the broadcast batcher of this process, the new events are published through it in batches.
+    """
+    return BroadcastBatcher(**broadcast_batcher_config())
+
+
+@cache
+def get_event_verifier() -> EventVerifier:
+    """
+    Returns the event verifier of this process, so its worker pool and its cache are shared.
+    """
+    return EventVerifier(**event_verifier_config())
+
+
+@cache
+def get_seen_event_ids() -> SeenEventIds:
+    """
+    Returns the known event ids of this process.
+    """
+    return SeenEventIds(**seen_event_ids_config())
+
+
+@cache
+def get_hot_events() -> HotEvents:
+    """
+    Returns the hot event caches of this process, they are used once they are attached to the subscription hub.
+    """
+    return HotEvents(**hot_events_config())
+
+
 async def handle_received_event(event_dict: EventNostrDict) -> None:
-    try:
-        event = Event(**event_dict)  # type: ignore
-    except ValidationError as exc:
-        raise InvalidMessageError("Validation Error", error_type=ErrorTypes.validation_error, encapsulated_exc=exc)
+    event = get_codec().decode_event(event_dict)  # type: ignore
+    seen_event_ids = get_seen_event_ids()
+    if seen_event_ids.is_duplicate(event.id):
+        # already stored and broadcasted
+        metrics.increment("seen_ids.dropped_duplicates")
+        return
+    if verification_enabled():
+        await get_event_verifier().verify(event)
     if event.is_event_deletion:
-        await delete_events(event.pubkey, [t.event_id for t in event.tags if isinstance(t, E_Tag)])
-    elif event.is_metadata:
-        # It will try to delete old metadata entries
-        existing_event = await fetch_event_by_kind_pubkey(METADATA_KIND, event.pubkey)
-        if existing_event and existing_event["created_at"] >= event.created_at:
-            return
-        await delete_event_by_kind_pubkey(METADATA_KIND, event.pubkey)
-    elif event.is_contact_list:
-        existing_event = await fetch_event_by_kind_pubkey(CONTACT_LIST_KIND, event.pubkey)
-        if existing_event and existing_event["created_at"] >= event.created_at:
+        deleted_ids = [t.event_id for t in event.tags if isinstance(t, E_Tag)]
+        # the events of the other pubkeys are kept, so they are still seen
+        for deleted_id in await delete_events(event.pubkey, deleted_ids):
+            seen_event_ids.discard(deleted_id)
+        await get_hot_events().apply_deleted(event.pubkey, deleted_ids)
+    if event.is_replaced_by_kind_pubkey:
+        if not await replace_event(event):
+            # a newer one is stored
             return
-        await delete_event_by_kind_pubkey(CONTACT_LIST_KIND, event.pubkey)
-    elif event.is_replaceable_event:
-        existing_event = await fetch_event_by_kind_pubkey(event.kind, event.pubkey)
-        if existing_event and existing_event["created_at"] >= event.created_at:
+        seen_event_ids.add(event.id)
+        await get_hot_events().apply_replaced(event.nostr_dict)
+    elif event.should_store_event:
+        is_new = await get_ingest_batcher().submit(event)
+        seen_event_ids.add(event.id)
+        if not is_new:
+            # already stored and broadcasted
             return
-        await delete_event_by_kind_pubkey(event.kind, event.pubkey)
-    if event.should_store_event:
-        await surpress_exc_coroutine(write_event(event=event), UniqueViolation)
-    await broadcast(NEW_EVENT_KEY, json.dumps(event.nostr_dict))
+    await get_broadcast_batcher().submit((NEW_EVENT_KEY, json.dumps(event.nostr_dict)))
     return None
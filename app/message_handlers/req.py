@@ -1,43 +1,124 @@
 import json
+import os
 from asyncio import CancelledError
+from contextlib import aclosing
+from functools import cache
+from typing import AsyncIterator
 
-from cache.core import get_redis_connection
-from cache.crud import listen_on_key
+from common import metrics
+from common.outbound import OutboundQueue
+from common.singleflight import SingleFlight
 from common.typings import SenderAsyncWebsocket
-from events.crud import query_events
+from events.crud import stream_events
 from events.enums import MessageTypes
-from events.filters import EventFilterer, Filters
+from events.filters import Filters
+from events.messages import encode_event_message, event_message_prefix
+from events.recent import RecentEvents, recent_events_config
+from events.result_cache import ResultCache, normalize_filters, result_cache_config
 from events.typings import EventNostrDict
 from pydantic import ValidationError
 from common.errors import ErrorTypes, InvalidMessageError
+from subscriptions.hub import BroadcastEvent, SubscriptionHub
+from subscriptions.index import SubscriptionKey
 
-NEW_EVENT_KEY = "events"
+from message_handlers.event import NEW_EVENT_KEY, get_hot_events, get_seen_event_ids
 
 
-async def create_listener(*filters: Filters, ws: SenderAsyncWebsocket, subscription_id: str) -> None:
-    event_filterer = EventFilterer(*filters)
-    r_conn = get_redis_connection()
-    async with listen_on_key(NEW_EVENT_KEY, r_conn=r_conn) as listener:
-        async for event_str in listener:
-            if event_str["type"] == "message":
-                event: EventNostrDict = json.loads(event_str["data"])
-                if event_filterer.test_event(event):
-                    await ws.send_json([MessageTypes.Event.value, subscription_id, event])
-    await r_conn.close()
+@cache
+def get_subscription_hub() -> SubscriptionHub:
+    """
+    Returns the subscription hub of this process.
+    All of the listeners share its single pub/sub connection.
+    """
+    return SubscriptionHub(NEW_EVENT_KEY)
+
+
+@cache
+def get_result_cache() -> ResultCache:
+    """
+    Returns the REQ result cache of this process, it is used once it is attached to the subscription hub.
+    """
+    return ResultCache(**result_cache_config())
+
+
+@cache
+def get_recent_events() -> RecentEvents:
+    """
+    Returns the recent events of this process, they are used once they are warmed.
+    """
+    return RecentEvents(**recent_events_config())
+
+
+@cache
+def get_req_flights() -> SingleFlight[str, list[str]]:
+    """
+    Returns the in-flight reads of the REQ results of this process, by their normalized filters.
+    """
+    return SingleFlight("req_flights")
+
+
+def req_chunk_size() -> int:
+    return int(os.getenv("req_chunk_size", 500))
+
+
+def req_max_bounded_limit() -> int:
+    return int(os.getenv("req_max_bounded_limit", 500))
+
+
+async def subscribe_to_new_events(
+    key: SubscriptionKey, filters: list[Filters], outbound: OutboundQueue, subscription_id: str
+) -> None:
+    """
+    Forwards the matching new events to the outbound queue of the connection.
+    Returns once the subscription is live, so no event is missed after the stored ones are sent.
+    """
+    message_prefix = event_message_prefix(subscription_id)
+
+    def deliver(matched: BroadcastEvent) -> None:
+        outbound.push(encode_event_message(message_prefix, matched.encoded))
+
+    await get_subscription_hub().subscribe(key, tuple(filters), deliver)
+
+
+def unsubscribe_from_new_events(key: SubscriptionKey) -> None:
+    get_subscription_hub().unsubscribe(key)
 
 
 async def handle_received_req(ws: SenderAsyncWebsocket, subs_id: str, filters: list[Filters]) -> None:
     try:
         # filters = [Filters(**filters_dict) for filters_dict in filters_dicts]
-        events = await query_events(*filters)
-        for event in events:
-            await ws.send_json(
-                [
-                    MessageTypes.Event.value,
-                    subs_id,
-                    event,
-                ]
-            )
+        seen_event_ids = get_seen_event_ids()
+        # filters asking for unknown ids cannot match any stored event
+        filters = [f for f in filters if seen_event_ids.may_match(f)]
+        if not filters:
+            metrics.increment("seen_ids.skipped_queries")
+        message_prefix = event_message_prefix(subs_id)
+        # the exact ids and the latest replaceable events are served by the hot caches
+        hot_events, filters = await get_hot_events().split(filters)
+        # the filters of the parts may match the same events, each event is sent once
+        sent_ids: set[str] = set()
+        for served_event in hot_events:
+            if served_event.id not in sent_ids:
+                sent_ids.add(served_event.id)
+                await ws.send_text(encode_event_message(message_prefix, served_event.encoded))
+        if filters and is_bounded(filters):
+            for encoded_event in await read_bounded_events(filters):
+                # the ids are decoded only if some of the events are already sent
+                if not sent_ids or json.loads(encoded_event)["id"] not in sent_ids:
+                    await ws.send_text(encode_event_message(message_prefix, encoded_event))
+        elif filters:
+            # the recent events are sent from the memory, only the older ones are read from the db
+            recent_events, filters = get_recent_events().split(filters)
+            for served_event in recent_events:
+                if served_event.id not in sent_ids:
+                    sent_ids.add(served_event.id)
+                    await ws.send_text(encode_event_message(message_prefix, served_event.encoded))
+            if filters:
+                # sent as they are read, the first event is sent before the rest is read
+                async with aclosing(stream_encoded_events(filters)) as encoded_events:
+                    async for encoded_event, event in encoded_events:
+                        if event["id"] not in sent_ids:
+                            await ws.send_text(encode_event_message(message_prefix, encoded_event))
         await ws.send_json([MessageTypes.Eose.value, subs_id])
 
         # return events, filters
@@ -51,3 +132,77 @@ async def handle_received_req(ws: SenderAsyncWebsocket, subs_id: str, filters: l
         print(cancel)
         print("AAAAAAAAAAAAAAAAAAAAAAAAAA" * 100)
         pass
+
+
+def is_bounded(filters: list[Filters]) -> bool:
+    """
+    All of the filters have a limit small enough to keep their result in the memory.
+    """
+    max_limit = req_max_bounded_limit()
+    return all(f.limit and f.limit <= max_limit for f in filters)
+
+
+async def read_bounded_events(filters: list[Filters]) -> list[str]:
+    """
+    Returns the encoded events from the result cache, or from the recent events and the db.
+    The concurrent REQs of the same filters share a single query; a cancelled REQ does not cancel it for the others.
+    The cache and the queries are keyed by the filters as they are sent, they are split by the recent events afterwards;
+    the older part of a split filter changes with the recent events, it would get a new key every second.
+    """
+    result_cache = get_result_cache()
+    cache_key = result_cache.key_of(filters)
+    if cache_key is not None:
+        cached = result_cache.get(cache_key)
+        if cached is None:
+            cached = await result_cache.get_shared(cache_key, tuple(filters))
+        if cached is not None:
+            return cached
+    return await get_req_flights().run(normalize_filters(filters), lambda: read_stored_events(filters, cache_key))
+
+
+async def read_stored_events(filters: list[Filters], cache_key: str | None) -> list[str]:
+    """
+    Reads the encoded events of the filters, the result cache is filled if the key is given.
+    """
+    encoded_events: list[str] = []
+    if cache_key is None:
+        async with aclosing(stream_recent_and_stored_events(filters)) as read_events:
+            encoded_events.extend([encoded_event async for encoded_event, _ in read_events])
+        return encoded_events
+    # the recent events are split inside the fill, the events broadcasted since then outdate it
+    async with get_result_cache().filling(cache_key, tuple(filters)) as fill:
+        async with aclosing(stream_recent_and_stored_events(filters)) as read_events:
+            async for encoded_event, event in read_events:
+                encoded_events.append(encoded_event)
+                fill.add(encoded_event, event)
+        fill.complete()
+    return encoded_events
+
+
+async def stream_recent_and_stored_events(filters: list[Filters]) -> AsyncIterator[tuple[str, EventNostrDict | None]]:
+    """
+    Yields the recent events of the filters from the memory, then the older ones from the db, each event once.
+    The recent events are yielded without their decoded events.
+    Use it with contextlib.aclosing, so the cursor is closed as soon as the consumer stops.
+    """
+    recent_events, older_filters = get_recent_events().split(filters)
+    recent_ids = {recent_event.id for recent_event in recent_events}
+    for recent_event in recent_events:
+        yield recent_event.encoded, None
+    if not older_filters:
+        return
+    async with aclosing(stream_encoded_events(older_filters)) as stored_events:
+        async for encoded_event, event in stored_events:
+            if event["id"] not in recent_ids:
+                yield encoded_event, event
+
+
+async def stream_encoded_events(filters: list[Filters]) -> AsyncIterator[tuple[str, EventNostrDict]]:
+    """
+    Yields the stored events with their encodings, each event is encoded once.
+    Use it with contextlib.aclosing, so the cursor is closed as soon as the consumer stops.
+    """
+    async with aclosing(stream_events(*filters, chunk_size=req_chunk_size())) as chunks:
+        async for events in chunks:
+            for event in events:
+                yield json.dumps(event, separators=(",", ":")), event
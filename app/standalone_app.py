@@ -1,10 +1,15 @@
-from asyncio import sleep
+from asyncio import CancelledError, create_task, sleep
 from contextlib import asynccontextmanager
-from cache.core import get_redis_connection
+from cache.core import close_redis_pool, connect_redis_pool
+from common import metrics
+from common.tools import surpress_exc_coroutine
 
 from db.core import connect_db_pool
 from dotenv import load_dotenv
+from events.partitions import partition_config, run_partition_maintenance
 from fastapi import FastAPI
+from message_handlers.event import get_broadcast_batcher, get_event_verifier, get_hot_events, get_ingest_batcher, get_seen_event_ids
+from message_handlers.req import get_recent_events, get_result_cache, get_subscription_hub
 from ws import nostr_server
 
 
@@ -15,9 +20,53 @@ async def fastapi_lifespan(app: FastAPI):
     load_dotenv("cache/.env")
     # cache does not guarantee the race condition will not occur
     connect_db_pool()  # call it once to populate the cache
-    get_redis_connection()
+    connect_redis_pool()
     #  so all of the calls will be fetching same pool connection
+    hub = get_subscription_hub()
+    seen_event_ids = get_seen_event_ids()
+    # learn the events stored by the other processes
+    hub.add_tap(seen_event_ids.add_broadcasted)
+    hub.add_reconnect_listener(seen_event_ids.invalidate)
+    result_cache = get_result_cache()
+    # keep the cached REQ results up to date with the events of all of the processes
+    result_cache.attach(hub)
+    recent_events = get_recent_events()
+    recent_events.attach(hub)
+    hot_events = get_hot_events()
+    hot_events.attach(hub)
+    # the imported events are not broadcasted
+    seen_event_ids.add_import_listener(hot_events.apply_imported)
+    await hub.start()
+    # the seen ids are rebuilt once the imported ids are listened
+    follow_imports_task = create_task(seen_event_ids.follow_imports(), name="SEEN-EVENT-IDS-FOLLOW-IMPORTS")
+    warm_task = create_task(recent_events.warm(), name="RECENT-EVENTS-WARM")
+    partitions_task = create_task(run_partition_maintenance(partition_config()), name="PARTITION-MAINTENANCE")
+    metrics.register_gauge("subscriptions.active", lambda: hub.subscription_count)
+    metrics.register_gauge("seen_ids.bloom_count", lambda: seen_event_ids.bloom_count)
+    metrics.register_gauge("req_cache.entries", lambda: len(result_cache))
+    metrics.register_gauge("req_cache.bytes", lambda: result_cache.size_in_bytes)
+    metrics.register_gauge("req_cache.hit_rate", lambda: result_cache.hit_rate)
+    metrics.register_gauge("recent_events.count", lambda: len(recent_events))
+    metrics.register_gauge("recent_events.bytes", lambda: recent_events.size_in_bytes)
+    metrics.register_gauge("hot_events.entries", lambda: len(hot_events))
     yield
+    result_cache.detach()
+    hot_events.detach()
+    seen_event_ids.remove_import_listener(hot_events.apply_imported)
+    follow_imports_task.cancel()
+    await surpress_exc_coroutine(follow_imports_task, CancelledError)
+    await seen_event_ids.close()
+    recent_events.stop_warming()
+    await warm_task
+    recent_events.detach()
+    partitions_task.cancel()
+    await surpress_exc_coroutine(partitions_task, CancelledError)
+    # store the events waiting for their batch
+    await get_ingest_batcher().close()
+    # publish the stored events waiting for their batch
+    await get_broadcast_batcher().close()
+    await get_event_verifier().close()
+    get_event_verifier.cache_clear()
     # close the pool of connections
     # print("WHAT!")
     # pool = connect_db_pool()
@@ -25,8 +74,11 @@ async def fastapi_lifespan(app: FastAPI):
     # before FastApi websocket endpoint to clean up
     await sleep(2)
     # await pool.close()
+    await hub.close()
+    await close_redis_pool()
 
 
 app = FastAPI(lifespan=fastapi_lifespan)
 app.add_websocket_route("/", nostr_server)
+app.add_api_route("/metrics", metrics.snapshot, methods=["GET"])
 # app.include_router(nostr)
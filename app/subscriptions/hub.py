@@ -0,0 +1,166 @@
+import json
+from asyncio import CancelledError, Event as AsyncEvent, Task, create_task, current_task, get_running_loop, sleep, wait_for
+from typing import Callable, NamedTuple
+
+from cache.crud import listen_on_key
+from common.tools import surpress_exc_coroutine
+from events.filters import Filters
+from events.typings import EventNostrDict
+
+from subscriptions.index import SubscriptionIndex, SubscriptionKey
+
+RECONNECT_DELAY = 1  # seconds
+SUBSCRIBE_TIMEOUT = 5  # seconds
+
+
+class SubscriptionUnavailableError(Exception):
+    """
+    The channel is not listened (i.e. redis is down), so the new events cannot be delivered.
+    """
+
+
+class BroadcastEvent(NamedTuple):
+    """
+    A broadcasted event, decoded once per process and shared read-only
+    by every matching subscription along with its wire encoding.
+    """
+
+    event: EventNostrDict
+    encoded: str
+
+
+EventDeliverer = Callable[[BroadcastEvent], None]
+
+
+class SubscriptionHub:
+    """
+    Process-wide fan-out point of the broadcasted events.
+    A single pub/sub connection reads the channel once and hands every event
+    to the locally registered subscriptions, so the redis connection count
+    grows with the worker count, not with the subscription count.
+    """
+
+    def __init__(self, channel: str, *, subscribe_timeout: float = SUBSCRIBE_TIMEOUT) -> None:
+        self._channel = channel
+        self._subscribe_timeout = subscribe_timeout
+        self._deliverers: dict[SubscriptionKey, EventDeliverer] = {}
+        self._taps: list[EventDeliverer] = []
+        self._reconnect_listeners: list[Callable[[], None]] = []
+        self._has_listened = False
+        self._index = SubscriptionIndex()
+        self._reader_task: Task | None = None
+        self._ready = AsyncEvent()
+
+    @property
+    def subscription_count(self) -> int:
+        return len(self._deliverers)
+
+    async def subscribe(self, key: SubscriptionKey, filters: tuple[Filters, ...], deliver: EventDeliverer) -> None:
+        """
+        Registers (or replaces) the subscription with the given key.
+        deliver is called synchronously from the reader, it must not block.
+        Raises SubscriptionUnavailableError if the channel is not listened within the subscribe timeout.
+        """
+        self._index.add(key, filters)
+        self._deliverers[key] = deliver
+        self._ensure_reader()
+        # Make sure the channel is being listened before returning,
+        # otherwise the events published in between would be missed.
+        try:
+            await wait_for(self._ready.wait(), self._subscribe_timeout)
+        except TimeoutError:
+            self.unsubscribe(key)
+            raise SubscriptionUnavailableError(f"The channel {self._channel} is not listened")
+
+    def add_tap(self, tap: EventDeliverer) -> None:
+        """
+        Registers a callback receiving every broadcasted event, regardless of the subscriptions.
+        """
+        if tap not in self._taps:
+            self._taps.append(tap)
+
+    def remove_tap(self, tap: EventDeliverer) -> None:
+        if tap in self._taps:
+            self._taps.remove(tap)
+
+    def add_reconnect_listener(self, listener: Callable[[], None]) -> None:
+        """
+        Registers a callback called when the channel is listened again after the connection is lost,
+        the events broadcasted in between are missed by the taps.
+        """
+        if listener not in self._reconnect_listeners:
+            self._reconnect_listeners.append(listener)
+
+    def remove_reconnect_listener(self, listener: Callable[[], None]) -> None:
+        if listener in self._reconnect_listeners:
+            self._reconnect_listeners.remove(listener)
+
+    async def start(self) -> None:
+        """
+        Starts listening the channel without any subscription, i.e. for the taps.
+        """
+        self._ensure_reader()
+        await self._ready.wait()
+
+    def unsubscribe(self, key: SubscriptionKey) -> None:
+        self._index.remove(key)
+        self._deliverers.pop(key, None)
+
+    async def close(self) -> None:
+        for key in tuple(self._deliverers):
+            self.unsubscribe(key)
+        if self._reader_task:
+            self._reader_task.cancel("Hub Closed")
+            await surpress_exc_coroutine(self._reader_task, CancelledError)
+            self._reader_task = None
+
+    def _ensure_reader(self) -> None:
+        task = self._reader_task
+        # the hub outlives the event loops (i.e. in tests),
+        # a reader of a closed loop has to be replaced as well.
+        if task is None or task.done() or task.get_loop() is not get_running_loop():
+            self._ready = AsyncEvent()
+            self._reader_task = create_task(self._read(), name=f"SUBSCRIPTION-HUB-[{self._channel}]")
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                async with listen_on_key(self._channel) as listener:
+                    async for message in listener:
+                        if message["type"] == "message":
+                            self.dispatch(message["data"])
+                        elif message["type"] == "subscribe":
+                            # subscribe() does not wait for the server,
+                            # the channel is listened once it is confirmed
+                            if self._has_listened:
+                                for reconnect_listener in tuple(self._reconnect_listeners):
+                                    _run_callback(reconnect_listener)
+                            self._has_listened = True
+                            self._ready.set()
+            except Exception as exc:
+                if (task := current_task()) and task.cancelling():
+                    # the cleanup of the listener failed while the reader is being cancelled
+                    raise CancelledError() from exc
+                print(f"Subscription Hub Reader Failed: {exc!r}")
+            # listener exits only when the connection is lost
+            self._ready.clear()
+            await sleep(RECONNECT_DELAY)
+
+    def dispatch(self, data: str) -> None:
+        """
+        Hands the event to the taps and to the matching subscriptions.
+        A failing callback is logged, it does not stop the reader or the other callbacks.
+        """
+        broadcasted = BroadcastEvent(json.loads(data), data)
+        for tap in self._taps:
+            _run_callback(tap, broadcasted)
+        for key in self._index.match(broadcasted.event):
+            if deliver := self._deliverers.get(key):
+                _run_callback(deliver, broadcasted)
+
+
+def _run_callback(callback: Callable[..., None], *args: BroadcastEvent) -> None:
+    try:
+        callback(*args)
+    except Exception as exc:
+        print(f"Subscription Hub Callback {callback!r} Failed: {exc!r}")
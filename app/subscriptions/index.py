@@ -0,0 +1,126 @@
+from typing import Hashable, Iterable
+
+from events.filters import EventFilterer, Filters
+from events.typings import EventNostrDict
+from tags.data.e_tag import E_TAG_TAG_NAME
+from tags.data.p_tag import P_TAG_TAG_NAME
+
+SubscriptionKey = Hashable
+FilterKey = tuple[SubscriptionKey, int]  # (subscription key, position of the filter)
+
+INDEXED_TAGS = (E_TAG_TAG_NAME, P_TAG_TAG_NAME)
+
+
+class PrefixIndex:
+    """
+    Maps prefixes to the filters requiring them.
+    Lookups probe only the prefix lengths that are in use.
+    """
+
+    def __init__(self) -> None:
+        self._buckets: dict[str, set[FilterKey]] = {}
+        self._lengths: dict[int, int] = {}  # prefix length -> bucket count
+
+    def add(self, prefix: str, filter_key: FilterKey) -> None:
+        bucket = self._buckets.get(prefix)
+        if bucket is None:
+            bucket = self._buckets[prefix] = set()
+            self._lengths[len(prefix)] = self._lengths.get(len(prefix), 0) + 1
+        bucket.add(filter_key)
+
+    def discard(self, prefix: str, filter_key: FilterKey) -> None:
+        bucket = self._buckets.get(prefix)
+        if bucket is None:
+            return
+        bucket.discard(filter_key)
+        if not bucket:
+            del self._buckets[prefix]
+            if remaining := self._lengths[len(prefix)] - 1:
+                self._lengths[len(prefix)] = remaining
+            else:
+                del self._lengths[len(prefix)]
+
+    def lookup(self, value: str) -> Iterable[FilterKey]:
+        for length in self._lengths:
+            if bucket := self._buckets.get(value[:length]):
+                yield from bucket
+
+
+class SubscriptionIndex:
+    """
+    Inverted index of the subscription filters.
+    Every filter is indexed on a single field it requires, picked by selectivity
+    (ids > authors > #e/#p > kinds); filters without any of them are kept in a residual set.
+    An event is tested against the candidate filters only, instead of all of them.
+    """
+
+    def __init__(self) -> None:
+        self._ids = PrefixIndex()
+        self._authors = PrefixIndex()
+        self._tags = {tag_name: PrefixIndex() for tag_name in INDEXED_TAGS}
+        self._kinds: dict[int, set[FilterKey]] = {}
+        self._residual: set[FilterKey] = set()
+        self._filters: dict[FilterKey, tuple[Filters, EventFilterer]] = {}
+        self._filter_keys: dict[SubscriptionKey, list[FilterKey]] = {}
+
+    def __len__(self) -> int:
+        return len(self._filter_keys)
+
+    def add(self, key: SubscriptionKey, filters: Iterable[Filters]) -> None:
+        self.remove(key)
+        filter_keys: list[FilterKey] = []
+        for position, f in enumerate(filters):
+            filter_key = (key, position)
+            self._filters[filter_key] = (f, EventFilterer(f))
+            self._index_filter(filter_key, f, add=True)
+            filter_keys.append(filter_key)
+        self._filter_keys[key] = filter_keys
+
+    def remove(self, key: SubscriptionKey) -> None:
+        for filter_key in self._filter_keys.pop(key, []):
+            f, _ = self._filters.pop(filter_key)
+            self._index_filter(filter_key, f, add=False)
+
+    def match(self, event: EventNostrDict) -> set[SubscriptionKey]:
+        candidates: set[FilterKey] = set(self._residual)
+        candidates.update(self._ids.lookup(event["id"]))
+        candidates.update(self._authors.lookup(event["pubkey"]))
+        candidates.update(self._kinds.get(event["kind"], ()))
+        for tag in event.get("tags") or ():
+            if len(tag) > 1 and (tag_index := self._tags.get(tag[0])):
+                candidates.update(tag_index.lookup(tag[1]))
+
+        matched: set[SubscriptionKey] = set()
+        for filter_key in candidates:
+            key = filter_key[0]
+            if key not in matched and self._filters[filter_key][1].test_event(event):
+                matched.add(key)
+        return matched
+
+    def _index_filter(self, filter_key: FilterKey, f: Filters, *, add: bool) -> None:
+        if f.ids:
+            self._index_prefixes(self._ids, f.ids, filter_key, add=add)
+        elif f.authors:
+            self._index_prefixes(self._authors, f.authors, filter_key, add=add)
+        elif tag_name := next((t for t in INDEXED_TAGS if f.tags.get(t)), None):
+            self._index_prefixes(self._tags[tag_name], f.tags[tag_name], filter_key, add=add)
+        elif f.kinds:
+            for kind in f.kinds:
+                if add:
+                    self._kinds.setdefault(kind, set()).add(filter_key)
+                elif bucket := self._kinds.get(kind):
+                    bucket.discard(filter_key)
+                    if not bucket:
+                        del self._kinds[kind]
+        elif add:
+            self._residual.add(filter_key)
+        else:
+            self._residual.discard(filter_key)
+
+    @staticmethod
+    def _index_prefixes(index: PrefixIndex, prefixes: Iterable[str], filter_key: FilterKey, *, add: bool) -> None:
+        for prefix in prefixes:
+            if add:
+                index.add(prefix, filter_key)
+            else:
+                index.discard(prefix, filter_key)
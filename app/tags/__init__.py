@@ -1,8 +1,9 @@
 from typing import TypeAlias
 
 from .data.e_tag import E_Tag
+from .data.generic_tag import GenericTag
 from .data.p_tag import P_Tag
 
-TagTypes: TypeAlias = E_Tag | P_Tag
+TagTypes: TypeAlias = E_Tag | P_Tag | GenericTag
 
-__all__ = ("E_Tag", "P_Tag", "TagTypes")
+__all__ = ("E_Tag", "GenericTag", "P_Tag", "TagTypes")
@@ -1,5 +1,15 @@
 from common.models import NostrModel
+from pydantic import PrivateAttr
 
 
 class BaseTag(NostrModel):
     tag: str
+    # the models drop the parts of the row they do not use (i.e. empty relay urls, extra fields)
+    _row: tuple[str, ...] | None = PrivateAttr(default=None)
+
+    @property
+    def row(self) -> tuple[str, ...]:
+        """
+        The tag as it is published, the event id is hashed over it.
+        """
+        return self._row if self._row is not None else tuple(self.nostr_dict)
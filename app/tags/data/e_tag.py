@@ -30,5 +30,5 @@ class E_Tag(BaseTag):
 
 def row_to_e_tag(row: ETagRow) -> E_Tag:
     return E_Tag(
-        tag="e", event_id=row[1], recommended_relay_url=row[2] if e_tag_has_relay(row) else None, marker=row[3] if len(row) == 4 else None
+        tag="e", event_id=row[1], recommended_relay_url=row[2] if e_tag_has_relay(row) else None, marker=(row[3] or None) if len(row) >= 4 else None
     )
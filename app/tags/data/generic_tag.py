@@ -0,0 +1,20 @@
+from functools import cached_property
+
+from tags.data.base import BaseTag
+from tags.typings.generic_tag import GenericTagRow
+
+
+class GenericTag(BaseTag):
+    """
+    Any tag without a model of its own, it is kept as it is published.
+    """
+
+    values: tuple[str, ...] = ()
+
+    @cached_property
+    def nostr_dict(self) -> GenericTagRow:
+        return (self.tag, *self.values)
+
+
+def row_to_generic_tag(row: GenericTagRow) -> GenericTag:
+    return GenericTag(tag=row[0], values=tuple(row[1:]))
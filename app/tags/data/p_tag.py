@@ -19,7 +19,9 @@ class P_Tag(BaseTag):
 
     @cached_property
     def nostr_dict(self) -> PTagRow:
-        if self.recommended_relay_url:
+        if self.pet_name:
+            return (self.tag, self.pubkey, self.recommended_relay_url or "", self.pet_name)
+        elif self.recommended_relay_url:
             return (self.tag, self.pubkey, self.recommended_relay_url)
         else:
             return (self.tag, self.pubkey)
@@ -1,131 +1,137 @@
-from collections import deque
-import itertools
-from typing import Callable, Protocol, Sequence
-from db.core import connect_db_pool
+from typing import Iterable, Sequence
 
+from common.tools import chunked, flat_tuple
+from db.core import connect_db_pool
 from db.query import run_queries
-from db.query_utils import union_queries
+from db.query_utils import (
+    create_runnable_query,
+    max_rows_per_query,
+    prepare_any_clause,
+    prepare_equal_clause,
+    prepare_gte_lte_clause,
+    prepare_insert_into,
+    prepare_select_statement,
+)
 from db.typings import DBConnection, RunnableQuery
+from psycopg import sql
+from psycopg.adapt import PyFormat
 from tags.data import Tag
 
-from tags.data.e_tag import E_TAG_TAG_NAME
-from tags.data.p_tag import P_TAG_TAG_NAME
-from tags.typings import TagRow
-
-from .e_tag import (
-    E_TAG_DB_FIELDS,
-    E_TAG_FIELDS,
-    E_TAG_ORDERING,
-    E_TAG_TABLE_NAME,
-    db_to_e_tag,
-    get_query_e_tags,
-    prepare_delete_e_tags_q,
-    prepare_e_tag_db_write_query,
-    e_tag_filterer_query,
-)
-from .p_tag import (
-    P_TAG_DB_FIELDS,
-    P_TAG_FIELDS,
-    P_TAG_ORDERING,
-    P_TAG_TABLE_NAME,
-    db_to_p_tag,
-    get_query_p_tags,
-    prepare_delete_p_tags_q,
-    prepare_p_tag_db_write_query,
-    prepare_p_tag_query,
-)
-
 __all__ = (
-    "E_TAG_TABLE_NAME",
-    "E_TAG_FIELDS",
-    "E_TAG_DB_FIELDS",
-    "E_TAG_ORDERING",
-    "P_TAG_TABLE_NAME",
-    "P_TAG_FIELDS",
-    "P_TAG_DB_FIELDS",
-    "P_TAG_ORDERING",
+    "TAG_TABLE_NAME",
+    "TAG_DB_FIELDS",
+    "tag_to_db_row",
     "write_tags",
-    "query_tags",
+    "write_tags_of_events",
+    "prepare_tags_aggregation",
     "prepare_tag_filters",
-    "prepare_delete_tags_query",
+    "prepare_tag_filter_values",
+    "TAG_REFERENCE_COUNT_TABLE_NAME",
+    "COUNTED_TAG_NAMES",
+    "prepare_reference_count_query",
 )
 
-__wr_query_builder_map: dict[str, Callable[..., tuple[RunnableQuery, Sequence]]] = {
-    "e": prepare_e_tag_db_write_query,
-    "p": prepare_p_tag_db_write_query,
-}
+TAG_TABLE_NAME = "tag"
+# position: the index of the tag in its event, value: the indexed first value of the single-letter tags
+# created_at: of the associated event, fields: the tag as it is published
+TAG_DB_FIELDS = ["associated_event", "position", "tag_name", "value", "created_at", "fields"]
 
-__del_query_builder_map: dict[str, Callable[..., tuple[RunnableQuery, Sequence]]] = {
-    "e": prepare_delete_e_tags_q,
-    "p": prepare_delete_p_tags_q,
-}
+# the references to the events and pubkeys are counted by the db, for every kind of the referencing events
+TAG_REFERENCE_COUNT_TABLE_NAME = "tag_reference_count"
+COUNTED_TAG_NAMES = ("e", "p")
 
+__wr_rows_per_query = max_rows_per_query(len(TAG_DB_FIELDS))
 
-class __Q_BUILDERS(Protocol):
-    def __call__(self, associated_event_ids: Sequence[str]) -> tuple[RunnableQuery, Sequence[str]]:
-        ...
 
+def tag_to_db_row(associated_event_id: str, created_at: int, position: int, tag: Tag) -> tuple[str, int, str, str | None, int, list[str]]:
+    fields = list(tag.row)
+    value = fields[1] if len(tag.tag) == 1 and len(fields) > 1 else None
+    return (associated_event_id, position, tag.tag, value, created_at, fields)
 
-__query_builders: dict[str, __Q_BUILDERS] = {"e": get_query_e_tags, "p": get_query_p_tags}
-__db_to_nostr: dict[str, Callable[[tuple], TagRow]] = {"e": db_to_e_tag, "p": db_to_p_tag}
 
+async def write_tags(associated_event_id: str, created_at: int, tags: Sequence[Tag], *, conn: DBConnection | None = None):
+    await write_tags_of_events(((associated_event_id, created_at, tags),), conn=conn)
 
-async def write_tags(associated_event_id: str, tags: list[Tag], *, conn: DBConnection | None = None):
-    try:
-        grouped_tags: dict[str, list[Tag]] = {
-            key: list(vals) for key, vals in itertools.groupby(sorted(tags, key=lambda tag: tag.tag), lambda tag: tag.tag)
-        }
-        queries = tuple(
-            q_builder(associated_event_id, _tags) for tname, _tags in grouped_tags.items() if (q_builder := __wr_query_builder_map[tname])
-        )
 
-        if conn:
-            await run_queries(no_return_queries=queries, conn=conn)
-        else:
-            pool = connect_db_pool()
-            async with pool.connection() as conn:
-                await run_queries(no_return_queries=queries, conn=conn)
-    except KeyError as e:
-        print(f"{e!r} | {e!s}")
-        raise e
-
-
-async def query_tags(associated_event_ids: Sequence[str], *, conn: DBConnection | None = None) -> dict[str, tuple[TagRow, ...]]:
-    qs = {tag_name: q_builder(associated_event_ids=associated_event_ids) for tag_name, q_builder in __query_builders.items()}
+async def write_tags_of_events(tags_of_events: Iterable[tuple[str, int, Sequence[Tag]]], *, conn: DBConnection | None = None):
+    """
+    Writes the tags of many events with multi-row inserts,
+    the position of each tag in its event is kept to return them in the published order
+    """
+    rows = [
+        tag_to_db_row(associated_event_id, created_at, position, tag)
+        for associated_event_id, created_at, tags in tags_of_events
+        for position, tag in enumerate(tags)
+    ]
+    queries = tuple(
+        (prepare_insert_into(TAG_TABLE_NAME, TAG_DB_FIELDS, len(chunk)), flat_tuple(chunk)) for chunk in chunked(rows, __wr_rows_per_query)
+    )
     if conn:
-        q_results = await run_queries(return_queries=qs, data_converters=__db_to_nostr, conn=conn)
+        await run_queries(no_return_queries=queries, conn=conn)
     else:
         pool = connect_db_pool()
         async with pool.connection() as conn:
-            q_results = await run_queries(return_queries=qs, data_converters=__db_to_nostr, conn=conn)
-
-    return q_results
-
-
-def prepare_tag_filters(tags: dict[str, set[str]]) -> tuple[RunnableQuery | None, Sequence[str]]:
-    qs: deque[RunnableQuery] = deque()
-    vals: deque[str] = deque()
-    if e_tags := tags.get(E_TAG_TAG_NAME):
-        e_tag_filters, e_tag_vals = e_tag_filterer_query(event_ids=e_tags)
-        qs.append(e_tag_filters)
-        vals.extend(e_tag_vals)
-    if p_tags := tags.get(P_TAG_TAG_NAME):
-        p_tag_filters, p_tag_vals = prepare_p_tag_query(pubkeys=p_tags)
-        qs.append(p_tag_filters)
-        vals.extend(p_tag_vals)
-    if qs:
-        q = union_queries(*qs)
-        return q, vals
-    return None, vals
-
-
-def prepare_delete_tags_query(
-    associated_event_id: str | RunnableQuery, *, selective_tags: set[str] | None = None
-) -> dict[str, tuple[RunnableQuery, Sequence]]:
-    if selective_tags is None:
-        selective_tags = {t for t in __del_query_builder_map.keys()}
-    return {
-        tag_name: q_builder(associated_event_id=associated_event_id)
-        for tag_name, q_builder in __del_query_builder_map.items()
-        if tag_name in selective_tags
-    }
+            await run_queries(no_return_queries=queries, conn=conn)
+
+
+def prepare_tags_aggregation(associated_event_field: tuple[str, ...], created_at_field: tuple[str, ...]) -> RunnableQuery:
+    """
+    Aggregates the tags of the event in the given fields into a json array named tags, in the order they were published.
+    Use it in a LATERAL join, so the tags of each event are read through the primary key,
+    of the single partition the created_at of the event points to.
+    """
+    return sql.SQL(
+        "SELECT coalesce(json_agg({fields} ORDER BY {position}), '[]') AS tags FROM {table_name} "
+        "WHERE {associated_event} = {associated_event_field} and {created_at} = {created_at_field}"
+    ).format(
+        fields=sql.Identifier(TAG_TABLE_NAME, "fields"),
+        position=sql.Identifier(TAG_TABLE_NAME, "position"),
+        table_name=sql.Identifier(TAG_TABLE_NAME),
+        associated_event=sql.Identifier(TAG_TABLE_NAME, "associated_event"),
+        associated_event_field=sql.Identifier(*associated_event_field),
+        created_at=sql.Identifier(TAG_TABLE_NAME, "created_at"),
+        created_at_field=sql.Identifier(*created_at_field),
+    )
+
+
+def prepare_tag_filters(tag_count: int, *, since: bool = False, until: bool = False) -> list[RunnableQuery]:
+    """
+    A query per filtered tag name, selecting the events having any of its values given as a single array parameter.
+    The tag name is bound as a parameter too, so the query depends only on the number of the filtered tag names.
+    The since and until bounds of the filter are repeated in them, so each is a single range scan of the
+    (tag_name, value, created_at) index. The values come from prepare_tag_filter_values.
+    """
+    select = prepare_select_statement([(TAG_TABLE_NAME, "associated_event")])
+    queries: list[RunnableQuery] = []
+    for _ in range(tag_count):
+        clauses = [
+            prepare_equal_clause((TAG_TABLE_NAME, "tag_name")),
+            prepare_any_clause((TAG_TABLE_NAME, "value"), array_type="text"),
+        ]
+        if since or until:
+            clauses.append(prepare_gte_lte_clause((TAG_TABLE_NAME, "created_at"), gte=since, lte=until, value_format=PyFormat.BINARY))
+        queries.append(create_runnable_query(select, TAG_TABLE_NAME, clauses))
+    return queries
+
+
+def prepare_tag_filter_values(tags: dict[str, set[str]], *, since: int | None = None, until: int | None = None) -> list[str | list[str] | int]:
+    values: list[str | list[str] | int] = []
+    for tag_name in sorted(tag_name for tag_name, tag_values in tags.items() if tag_values):
+        values.append(tag_name)
+        values.append(list(tags[tag_name]))
+        if since:
+            values.append(since)
+        if until:
+            values.append(until)
+    return values
+
+
+def prepare_reference_count_query(*, kinds: bool) -> RunnableQuery:
+    """
+    Sums the counters of a tag name and value, of the kinds given as a single array parameter if kinds is set.
+    """
+    clauses = [prepare_equal_clause("tag_name"), prepare_equal_clause("value")]
+    if kinds:
+        clauses.append(prepare_any_clause("kind", array_type="int"))
+    select = sql.SQL("SELECT coalesce(sum({count}), 0)::BIGINT").format(count=sql.Identifier("count"))
+    return create_runnable_query(select, TAG_REFERENCE_COUNT_TABLE_NAME, clauses)
@@ -7,6 +7,7 @@ from common.tools import group_by
 from tags.typings import TagRow
 
 from .e_tag import prepare_e_tag_tests
+from .generic_tag import prepare_generic_tag_tests
 from .p_tag import prepare_p_tag_tests
 
 tag_test_mapper: dict[str, Callable[[set[str]], Callable[..., bool]]] = {
@@ -20,7 +21,7 @@ def prepare_tag_tests(tag_filters: dict[str, set[str]]) -> Callable[[list[TagRow
 
     def test(tags: list[TagRow]) -> bool:
         grouped_tags = group_by(tags, lambda t: t[0])
-        tests = {tname: tester(tsets) for tname, tsets in tag_filters.items() if (tester := tag_test_mapper.get(tname))}
+        tests = {tname: tag_test_mapper.get(tname, prepare_generic_tag_tests)(tsets) for tname, tsets in tag_filters.items()}
 
         return all(test(grouped_tags.get(tname, [])) for tname, test in tests.items())
 
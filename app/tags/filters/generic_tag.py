@@ -0,0 +1,14 @@
+from typing import Callable, Sequence
+
+from tags.typings import GenericTagRow
+
+
+def prepare_generic_tag_tests(values: set[str]) -> Callable[..., bool]:
+    """
+    Matches the tags whose first value is one of the given values exactly (NIP-12)
+    """
+
+    def test(tags: Sequence[GenericTagRow]) -> bool:
+        return any(len(t) > 1 and t[1] in values for t in tags)
+
+    return test
@@ -1,7 +1,8 @@
 from typing import TypeAlias
 from .e_tag import ETagRow
+from .generic_tag import GenericTagRow
 from .p_tag import PTagRow
 
 
-TagRow: TypeAlias = ETagRow | PTagRow
-__all__ = ("ETagRow", "PTagRow", "TagRow")
+TagRow: TypeAlias = ETagRow | PTagRow | GenericTagRow
+__all__ = ("ETagRow", "GenericTagRow", "PTagRow", "TagRow")
@@ -7,7 +7,9 @@ MarkerType: TypeAlias = Literal["reply", "root", "mention"]
 ETagRowBase = tuple[Literal["e"], str]
 EtagRowWithRelay = tuple[*ETagRowBase, str]
 MarkedETagRow = tuple[*EtagRowWithRelay, MarkerType]
-ETagRow: TypeAlias = ETagRowBase | EtagRowWithRelay | MarkedETagRow
+# NIP-10 rows may carry the pubkey of the referenced event after the marker
+MarkedETagRowWithPubkey = tuple[*MarkedETagRow, str]
+ETagRow: TypeAlias = ETagRowBase | EtagRowWithRelay | MarkedETagRow | MarkedETagRowWithPubkey
 
 def e_tag_has_relay(e_tag: ETagRow) -> TypeGuard[EtagRowWithRelay | MarkedETagRow]:
     # Unfortunately, linters and type checker does not recognize
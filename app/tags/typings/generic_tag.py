@@ -0,0 +1,4 @@
+from typing import TypeAlias
+
+# tag name, values..
+GenericTagRow: TypeAlias = tuple[str, ...]
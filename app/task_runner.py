@@ -4,12 +4,14 @@ from dotenv import load_dotenv
 import tasks
 
 load_dotenv('db/.env')
+load_dotenv('cache/.env')
 # print(tasks.__all__)
 parser = argparse.ArgumentParser("Task Runner")
 parser.add_argument("--task", choices=tasks.__all__)
 
 if __name__ == "__main__":
-    args = parser.parse_args()
+    # the remaining arguments are passed to the task
+    args, task_args = parser.parse_known_args()
     task_to_run = args.task
     try:
         task = getattr(tasks, task_to_run)
@@ -19,4 +21,4 @@ if __name__ == "__main__":
         print(e)
         exit(0)
 
-    asyncio.run(task())
+    asyncio.run(task(*task_args))
@@ -1,5 +1,12 @@
+from .benchmark_codec import benchmark_codec
+from .benchmark_prefix_queries import benchmark_prefix_queries
+from .build_count_sketches import build_count_sketches
+from .export_events import export_events
+from .import_events import import_events
 from .initialize_db import initialize_db_task
+from .maintain_partitions import maintain_partitions
+from .migrate import migrate
 from .query_tags import run_query_tags
 from .test import test
 
-__all__ = ["initialize_db_task", "run_query_tags", "test"]
+__all__ = ["benchmark_codec", "benchmark_prefix_queries", "build_count_sketches", "export_events", "import_events", "initialize_db_task", "maintain_partitions", "migrate", "run_query_tags", "test"]
@@ -0,0 +1,51 @@
+import json
+import os
+import timeit
+from hashlib import sha256
+
+from events.codec import Codec, FastCodec, PydanticCodec
+
+
+def _sample_frames() -> tuple[str, str]:
+    """
+    A text note with a few tags and a REQ with two filters, ids and signatures are not verified by the codecs.
+    """
+    pubkey = sha256(b"pubkey").hexdigest()
+    event = {
+        "id": sha256(b"id").hexdigest(),
+        "pubkey": pubkey,
+        "created_at": 1683000000,
+        "kind": 1,
+        "tags": [
+            ["e", sha256(b"root").hexdigest(), "wss://relay.example.com", "root"],
+            ["e", sha256(b"reply").hexdigest()],
+            ["p", pubkey, "wss://relay.example.com"],
+        ],
+        "content": "Today is a good day for benchmarking!" * 4,
+        "sig": sha256(b"sig").hexdigest() * 2,
+    }
+    filters = [
+        {"authors": [pubkey[:16]], "kinds": [0, 1, 3], "since": 1682000000, "limit": 100},
+        {"#e": [sha256(b"root").hexdigest()], "#p": [pubkey], "until": 1684000000},
+    ]
+    return json.dumps(["EVENT", event]), json.dumps(["REQ", "benchmark", *filters])
+
+
+def _decode_event_frame(codec: Codec, frame: str) -> None:
+    _, event_dict = codec.decode_frame(frame)
+    codec.decode_event(event_dict)
+
+
+def _decode_req_frame(codec: Codec, frame: str) -> None:
+    _, _, *f_dicts = codec.decode_frame(frame)
+    for filters_dict in f_dicts:
+        codec.decode_filters(filters_dict)
+
+
+async def benchmark_codec():
+    number = int(os.getenv("benchmark_iterations", 20000))
+    event_frame, req_frame = _sample_frames()
+    for name, codec in (("pydantic", PydanticCodec()), ("fast", FastCodec())):
+        event_t = timeit.timeit(lambda: _decode_event_frame(codec, event_frame), number=number)
+        req_t = timeit.timeit(lambda: _decode_req_frame(codec, req_frame), number=number)
+        print(f"{name:>8} | EVENT: {event_t / number * 1e6:7.2f}us/frame | REQ: {req_t / number * 1e6:7.2f}us/frame")
@@ -0,0 +1,95 @@
+import argparse
+import time
+
+from common.tools import merge_hex_prefixes
+from db.core import _get_async_connection
+from db.query_utils import create_runnable_query, prepare_prefix_clause, prepare_prefix_ranges_clause, prepare_select_statement
+from db.typings import DBConnection, QueryComponents
+from psycopg import sql
+
+BENCH_TABLE_NAME = "bench_event"
+AUTHOR_COUNT = 100_000
+
+
+async def _create_bench_table(conn: DBConnection, rows: int) -> None:
+    """
+    An unlogged copy of the event table with the same indexes, filled with generated ids and pubkeys.
+    It is kept between the runs, since filling millions of rows takes a while.
+    """
+    existing = await (await conn.execute("SELECT to_regclass(%s) IS NOT NULL", (BENCH_TABLE_NAME,))).fetchone()
+    if existing and existing[0]:
+        count = await (await conn.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(BENCH_TABLE_NAME)))).fetchone()
+        if count and count[0] == rows:
+            return
+        await conn.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(BENCH_TABLE_NAME)))
+    print(f"Filling {BENCH_TABLE_NAME} with {rows} rows..")
+    started = time.perf_counter()
+    await conn.execute(
+        sql.SQL(
+            """
+        CREATE UNLOGGED TABLE {table} (LIKE event);
+        INSERT INTO {table} (id, pubkey, created_at, kind, content, sig)
+        SELECT md5(i::text) || md5((-i)::text), md5((i % {authors})::text) || md5((-(i % {authors}))::text),
+               1683000000 + i, i % 4, '', ''
+        FROM generate_series(1, {rows}) i;
+        ALTER TABLE {table} ADD PRIMARY KEY (id);
+        CREATE INDEX ON {table} (created_at DESC);
+        CREATE INDEX ON {table} (kind, created_at DESC);
+        CREATE INDEX ON {table} (pubkey, kind, created_at DESC);
+        ANALYZE {table};
+        """
+        ).format(table=sql.Identifier(BENCH_TABLE_NAME), authors=AUTHOR_COUNT, rows=rows)
+    )
+    await conn.commit()
+    print(f"Filled in {time.perf_counter() - started:.1f}s")
+
+
+def _bench_query(clause: QueryComponents) -> sql.Composed:
+    select = prepare_select_statement([(BENCH_TABLE_NAME, "id")])
+    query = create_runnable_query(select, BENCH_TABLE_NAME, clause, order_by=[((BENCH_TABLE_NAME, "created_at"), "DESC")], limit=100)
+    return sql.SQL("EXPLAIN (ANALYZE, BUFFERS) ") + query
+
+
+async def _explain(conn: DBConnection, name: str, clause: QueryComponents, values: list) -> None:
+    plan = [row[0] for row in await (await conn.execute(_bench_query(clause), values)).fetchall()]
+    scans = [line.strip() for line in plan if "Scan" in line]
+    print(f"{name:>24} | {plan[-1]} | {scans[-1] if scans else plan[0]}")
+
+
+async def benchmark_prefix_queries(*args: str):
+    """
+    Compares the plans of the SIMILAR TO prefix matching with the range predicates on a generated table.
+    """
+    parser = argparse.ArgumentParser("benchmark_prefix_queries")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--drop", action="store_true", help="drops the generated table at the end")
+    options = parser.parse_args(args)
+
+    conn = await _get_async_connection()
+    async with conn:
+        await _create_bench_table(conn, options.rows)
+        rows = await (
+            await conn.execute(
+                sql.SQL("SELECT id, pubkey FROM {} TABLESAMPLE SYSTEM (1) LIMIT 5").format(sql.Identifier(BENCH_TABLE_NAME))
+            )
+        ).fetchall()
+        ids = [row[0] for row in rows]
+        pubkeys = [row[1] for row in rows]
+        cases = {
+            "full ids": ids,
+            "id prefixes": [event_id[:10] for event_id in ids],
+            "author prefixes": [pubkey[:8] for pubkey in pubkeys],
+            "full authors": pubkeys,
+        }
+        for name, prefixes in cases.items():
+            field = "pubkey" if "author" in name else "id"
+            await _explain(conn, f"{name} SIMILAR TO", prepare_prefix_clause((BENCH_TABLE_NAME, field), prefixes=prefixes), [])
+            full_values, ranges = merge_hex_prefixes(prefixes, 64)
+            await _explain(
+                conn,
+                f"{name} ranges",
+                prepare_prefix_ranges_clause((BENCH_TABLE_NAME, field), len(ranges)),
+                [full_values, *(bound for prefix_range in ranges for bound in prefix_range)],
+            )
+        if options.drop:
+            await conn.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(BENCH_TABLE_NAME)))
@@ -0,0 +1,21 @@
+import argparse
+import os
+
+from common.hll import precision_for_error, standard_error
+from events.crud import build_count_sketches as _build_count_sketches, disable_count_sketches
+
+parser = argparse.ArgumentParser("build_count_sketches", description="Builds the sketches of the approximate event counts")
+parser.add_argument("--error-rate", type=float, default=None, help="the standard error of the counts, defaults to count_sketch_error_rate")
+parser.add_argument("--disable", action="store_true", help="drops the sketches and stops maintaining them")
+
+
+async def build_count_sketches(*argv: str):
+    args = parser.parse_args(argv)
+    if args.disable:
+        await disable_count_sketches()
+        print("Count sketches are disabled")
+        return
+    error_rate = float(os.getenv("count_sketch_error_rate", 0.02)) if args.error_rate is None else args.error_rate
+    precision = precision_for_error(error_rate)
+    built = await _build_count_sketches(precision)
+    print(f"Built sketches: {built} | registers: {1 << precision} | standard error: {standard_error(precision):.4f}")
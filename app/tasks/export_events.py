@@ -0,0 +1,44 @@
+import argparse
+import gzip
+import json
+import sys
+import time
+from typing import IO
+
+from events.codec import fast_loads, get_codec
+from events.crud import stream_events
+
+parser = argparse.ArgumentParser("export_events", description="Exports the events to a JSONL file")
+parser.add_argument("path", help="output file, - for stdout. The output is gzipped if it ends with .gz")
+parser.add_argument(
+    "--filter",
+    dest="filters",
+    action="append",
+    default=[],
+    help='a REQ filter as json, i.e. \'{"kinds": [1], "#p": ["<pubkey>"]}\'. Can be repeated, exports everything by default',
+)
+parser.add_argument("--chunk-size", type=int, default=1000, help="events fetched from the db at a time")
+
+
+def _open_output(path: str) -> IO[bytes]:
+    if path == "-":
+        return sys.stdout.buffer
+    return gzip.open(path, "wb") if path.endswith(".gz") else open(path, "wb")
+
+
+async def export_events(*argv: str):
+    args = parser.parse_args(argv)
+    codec = get_codec()
+    filters = [codec.decode_filters(fast_loads(f)) for f in args.filters or ["{}"]]
+    exported = 0
+    started_at = time.monotonic()
+    output = _open_output(args.path)
+    try:
+        async for events in stream_events(*filters, chunk_size=args.chunk_size):
+            output.write(b"".join(json.dumps(event, separators=(",", ":"), ensure_ascii=False).encode() + b"\n" for event in events))
+            exported += len(events)
+            print(f"exported: {exported} | {exported / (time.monotonic() - started_at) * 60:.0f} events/min", file=sys.stderr, flush=True)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+    print(f"Done! exported: {exported}", file=sys.stderr)
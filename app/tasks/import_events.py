@@ -0,0 +1,236 @@
+import argparse
+import gzip
+import json
+import os
+import time
+from asyncio import Future, get_running_loop
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Any, NamedTuple
+
+from cache.crud import broadcast
+from db.core import _get_async_connection
+from db.typings import DBConnection
+from events.codec import FastCodec, fast_loads
+from events.data import CONTACT_LIST_KIND, METADATA_KIND, is_replaceable_kind
+from events.db import EVENT_FIELDS, EVENT_TABLE_NAME
+from events.hot import forget_shared_latest
+from events.seen import IMPORTED_IDS_KEY
+from events.validators import validate_event_id, validate_event_sig
+from psycopg import sql
+from tags.db import TAG_DB_FIELDS, TAG_TABLE_NAME, tag_to_db_row
+
+STAGING_PREFIX = "import_"
+NEW_IDS_TABLE_NAME = "import_new_ids"
+
+
+class CheckedChunk(NamedTuple):
+    events: list[tuple[Any, ...]]
+    tags: list[tuple[Any, ...]]
+    rejected: int
+    skipped: int  # valid events that are not stored (ephemeral or repeated in the chunk)
+
+
+def check_lines(lines: list[bytes], verify_sig: bool) -> CheckedChunk:
+    """
+    Runs in the worker processes. Decodes and validates the events, returns the rows to be copied.
+    """
+    codec = FastCodec()
+    events: list[tuple[Any, ...]] = []
+    tags: list[tuple[Any, ...]] = []
+    seen_ids: set[str] = set()
+    rejected = skipped = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            event = codec.decode_event(fast_loads(line))
+            validate_event_id(event)
+            if verify_sig:
+                validate_event_sig(event)
+            tag_rows = [tag_to_db_row(event.id, event.created_at, position, tag) for position, tag in enumerate(event.tags)]
+        except Exception:
+            rejected += 1
+            continue
+        if not event.should_store_event or event.id in seen_ids:
+            skipped += 1
+            continue
+        seen_ids.add(event.id)
+        events.append((event.id, event.pubkey, event.created_at, event.kind, event.content, event.sig))
+        tags.extend(tag_rows)
+    return CheckedChunk(events, tags, rejected, skipped)
+
+
+def _staging(table_name: str) -> sql.Identifier:
+    return sql.Identifier(f"{STAGING_PREFIX}{table_name}")
+
+
+def _field_list(fields: list[str]) -> sql.Composable:
+    return sql.SQL(",").join(map(sql.Identifier, fields))
+
+
+async def create_staging_tables(conn: DBConnection) -> None:
+    """
+    Staging tables have the column types of the real tables but none of the constraints,
+    so the rows are copied without failing on duplicates.
+    """
+    for table_name, fields in ((EVENT_TABLE_NAME, EVENT_FIELDS), (TAG_TABLE_NAME, TAG_DB_FIELDS)):
+        await conn.execute(
+            sql.SQL("CREATE TEMP TABLE {staging} ON COMMIT DELETE ROWS AS SELECT {fields} FROM {table_name} WITH NO DATA").format(
+                staging=_staging(table_name), fields=_field_list(fields), table_name=sql.Identifier(table_name)
+            )
+        )
+    await conn.execute(
+        sql.SQL("CREATE TEMP TABLE {new_ids} (id CHAR(64)) ON COMMIT DELETE ROWS").format(new_ids=sql.Identifier(NEW_IDS_TABLE_NAME))
+    )
+    await conn.commit()
+
+
+async def copy_chunk(conn: DBConnection, checked: CheckedChunk) -> list[str]:
+    """
+    Copies the rows into the staging tables and moves the new ones to the real tables in one transaction.
+    Returns the ids of the newly stored events.
+    """
+    async with conn.transaction():
+        cur = conn.cursor()
+        for table_name, fields, rows in (
+            (EVENT_TABLE_NAME, EVENT_FIELDS, checked.events),
+            (TAG_TABLE_NAME, TAG_DB_FIELDS, checked.tags),
+        ):
+            copy_q = sql.SQL("COPY {staging} ({fields}) FROM STDIN").format(staging=_staging(table_name), fields=_field_list(fields))
+            async with cur.copy(copy_q) as copy:
+                for row in rows:
+                    await copy.write_row(row)
+
+        await cur.execute(
+            sql.SQL(
+                "WITH inserted AS ("
+                "INSERT INTO {table_name} ({fields}) SELECT DISTINCT ON (id) {fields} FROM {staging} "
+                "ON CONFLICT DO NOTHING RETURNING id"
+                ") INSERT INTO {new_ids} SELECT id FROM inserted RETURNING id"
+            ).format(
+                table_name=sql.Identifier(EVENT_TABLE_NAME),
+                fields=_field_list(EVENT_FIELDS),
+                staging=_staging(EVENT_TABLE_NAME),
+                new_ids=sql.Identifier(NEW_IDS_TABLE_NAME),
+            )
+        )
+        inserted_ids = [row[0] for row in await cur.fetchall()]
+        # tags of the already stored events are skipped along with their events
+        await cur.execute(
+            sql.SQL(
+                "INSERT INTO {table_name} ({fields}) SELECT {staged_fields} FROM {staging} s "
+                "JOIN {new_ids} n ON n.id = s.associated_event"
+            ).format(
+                table_name=sql.Identifier(TAG_TABLE_NAME),
+                fields=_field_list(TAG_DB_FIELDS),
+                staged_fields=sql.SQL(",").join(sql.Identifier("s", f) for f in TAG_DB_FIELDS),
+                staging=_staging(TAG_TABLE_NAME),
+                new_ids=sql.Identifier(NEW_IDS_TABLE_NAME),
+            )
+        )
+    return inserted_ids
+
+
+async def apply_replaceable_rules(conn: DBConnection) -> int:
+    """
+    Keeps only the latest event of every (kind, pubkey) for the replaceable kinds, the lowest id wins the ties.
+    Returns the number of deleted events, their tags are deleted by the db.
+    """
+    cur = await conn.execute(
+        sql.SQL(
+            "DELETE FROM {table_name} older USING {table_name} newer "
+            "WHERE older.kind = newer.kind AND older.pubkey = newer.pubkey "
+            "AND (older.kind IN ({metadata}, {contact_list}) OR older.kind BETWEEN 10000 AND 19999) "
+            "AND (newer.created_at > older.created_at OR (newer.created_at = older.created_at AND newer.id < older.id))"
+        ).format(
+            table_name=sql.Identifier(EVENT_TABLE_NAME),
+            metadata=sql.Literal(METADATA_KIND),
+            contact_list=sql.Literal(CONTACT_LIST_KIND),
+        )
+    )
+    await conn.commit()
+    return cur.rowcount
+
+
+def _open_dump(path: str) -> IO[bytes]:
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def _checkpoint_path(path: str) -> str:
+    return f"{path}.offset"
+
+
+def _read_checkpoint(path: str) -> int:
+    try:
+        with open(_checkpoint_path(path)) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def _write_checkpoint(path: str, offset: int) -> None:
+    tmp_path = f"{_checkpoint_path(path)}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(offset))
+    os.replace(tmp_path, _checkpoint_path(path))
+
+
+parser = argparse.ArgumentParser("import_events", description="Imports a JSONL (or .jsonl.gz) dump of events")
+parser.add_argument("path")
+parser.add_argument("--batch-size", type=int, default=5000, help="events per COPY transaction")
+parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="validating processes")
+parser.add_argument("--skip-sig", action="store_true", help="do not verify the signatures")
+parser.add_argument("--restart", action="store_true", help="ignore the saved offset and start from the beginning")
+
+
+async def import_events(*argv: str):
+    args = parser.parse_args(argv)
+    offset = 0 if args.restart else _read_checkpoint(args.path)
+    if offset:
+        print(f"Resuming from byte {offset}")
+    loop = get_running_loop()
+    conn = await _get_async_connection()
+    stored = duplicates = rejected = skipped = 0
+    started_at = time.monotonic()
+    async with conn:
+        await create_staging_tables(conn)
+        with ProcessPoolExecutor(max_workers=args.workers) as executor, _open_dump(args.path) as dump:
+            dump.seek(offset)
+            # (checks of the chunk, offset of the end of the chunk), in the order of the file
+            in_flight: deque[tuple[Future[CheckedChunk], int]] = deque()
+            eof = False
+            while in_flight or not eof:
+                while not eof and len(in_flight) < args.workers * 2:
+                    lines = [line for _, line in zip(range(args.batch_size), dump)]
+                    eof = len(lines) < args.batch_size
+                    if lines:
+                        checking = loop.run_in_executor(executor, check_lines, lines, not args.skip_sig)
+                        in_flight.append((checking, dump.tell()))
+                if not in_flight:
+                    break
+                checking, chunk_end = in_flight.popleft()
+                checked = await checking
+                inserted_ids = await copy_chunk(conn, checked)
+                if inserted_ids:
+                    inserted = set(inserted_ids)
+                    # the shared latest events may be replaced by the imported ones, they are dropped before the relays read them again
+                    await forget_shared_latest(row[1] for row in checked.events if row[0] in inserted and is_replaceable_kind(row[3]))
+                    # the imported events are not broadcasted, the relays learn their ids from here
+                    await broadcast(IMPORTED_IDS_KEY, json.dumps(inserted_ids))
+                stored += len(inserted_ids)
+                duplicates += len(checked.events) - len(inserted_ids)
+                rejected += checked.rejected
+                skipped += checked.skipped
+                _write_checkpoint(args.path, chunk_end)
+                elapsed = time.monotonic() - started_at
+                processed = stored + duplicates + rejected + skipped
+                print(
+                    f"offset: {chunk_end} | stored: {stored} | duplicates: {duplicates} | rejected: {rejected} | skipped: {skipped} | "
+                    f"{processed / elapsed * 60:.0f} events/min",
+                    flush=True,
+                )
+
+        print("Applying the replaceable event rules...")
+        replaced = await apply_replaceable_rules(conn)
+    print(f"Done! stored: {stored} | replaced: {replaced} | duplicates: {duplicates} | rejected: {rejected} | skipped: {skipped}")
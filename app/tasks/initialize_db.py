@@ -1,15 +1,15 @@
 from db.core import _get_async_connection
-from events.db import (generate_sql_schema_e_tag, generate_sql_schema_event,
-                       generate_sql_schem_p_tag, clean_out_db)
+from db.migrations import run_migrations
+from events.db import clean_out_db
+from events.migrations import MIGRATIONS
 
 
 async def initialize_db_task():
+    """
+    Drops all of the tables, the ones of the baseline schema too, and creates them again by running the migrations
+    """
     conn = await _get_async_connection()
     async with conn:
-        try:
-            await conn.execute(clean_out_db())
-        except:
-            pass
-        await conn.execute(generate_sql_schema_event())
-        await conn.execute(generate_sql_schema_e_tag())
-        await conn.execute(generate_sql_schem_p_tag())
+        await conn.execute(clean_out_db())
+        await conn.commit()
+        await run_migrations(conn, MIGRATIONS)
@@ -0,0 +1,17 @@
+import argparse
+
+from events.partitions import maintain_partitions as _maintain_partitions, partition_config
+
+parser = argparse.ArgumentParser("maintain_partitions", description="Creates the monthly partitions ahead and drops the expired ones")
+parser.add_argument("--months-ahead", type=int, default=None, help="defaults to partition_months_ahead")
+parser.add_argument("--retention-months", type=int, default=None, help="defaults to event_retention_months, 0 keeps the events")
+
+
+async def maintain_partitions(*argv: str):
+    args = parser.parse_args(argv)
+    config = partition_config()
+    created, dropped = await _maintain_partitions(
+        months_ahead=config["months_ahead"] if args.months_ahead is None else args.months_ahead,
+        retention_months=config["retention_months"] if args.retention_months is None else args.retention_months,
+    )
+    print(f"Created months: {created} | dropped months: {dropped}")
@@ -0,0 +1,16 @@
+import argparse
+
+from db.core import _get_async_connection
+from db.migrations import run_migrations
+from events.migrations import MIGRATIONS
+
+parser = argparse.ArgumentParser("migrate", description="Applies the schema migrations that are not applied yet")
+parser.add_argument("--target", type=int, default=None, help="the last version to apply")
+
+
+async def migrate(*argv: str):
+    args = parser.parse_args(argv)
+    conn = await _get_async_connection()
+    async with conn:
+        applied = await run_migrations(conn, MIGRATIONS, target=args.target)
+    print(f"Applied migrations: {applied}" if applied else "The schema is up to date")
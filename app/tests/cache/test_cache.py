@@ -3,9 +3,9 @@ from typing import Iterable
 
 import pytest
 import pytest_asyncio
-from cache.core import get_redis_connection
+from cache.core import close_redis_pool, connect_redis_pool, get_pubsub_connection, get_redis_connection
 from common.tools import flat_list
-from cache.crud import add_vals_to_set, broadcast, delete_key, fetch_vals, listen_on_key
+from cache.crud import add_vals_to_set, add_vals_to_sets, broadcast, broadcast_many, delete_key, fetch_vals, listen_on_key
 from asyncio.locks import Barrier
 
 
@@ -19,6 +19,32 @@ async def test_caching() -> None:
     assert not vals.difference(ret_vals), "Returned Values Are Different!"
 
 
+@pytest.mark.asyncio
+async def test_pooled_batches() -> None:
+    assert get_redis_connection().connection_pool is get_redis_connection().connection_pool, "The clients share the pool"
+    keys = [f"batch-set-{i}" for i in range(3)]
+    await delete_key(*keys)
+    await add_vals_to_sets({key: [f"{key}-{i}" for i in range(2500)] for key in keys})
+    for key in keys:
+        assert len(await fetch_vals(key)) == 2500
+
+    channel = "batch-channel"
+    async with listen_on_key(channel) as listener:
+        values = [f"batch-{i}" for i in range(100)]
+        await broadcast_many([(channel, value) for value in values])
+        received: list[str] = []
+        async for message in listener:
+            if message["type"] == "message":
+                received.append(message["data"])
+            if len(received) == len(values):
+                break
+    assert received == values, "The pipelined messages are published in their order"
+
+    pool = connect_redis_pool()
+    await close_redis_pool()
+    assert connect_redis_pool() is not pool, "A new pool is created once it is closed"
+
+
 @pytest_asyncio.fixture
 async def cacher_connector():
     r = get_redis_connection()
@@ -46,7 +72,7 @@ async def test_pubsub(cacher_connector) -> None:
         return vals
 
     async def listener_task(key: str) -> set[str]:
-        r_conn = get_redis_connection()
+        r_conn = get_pubsub_connection()
         async with listen_on_key(key, r_conn=r_conn) as listener:
             catched_vals: set[str] = set()
             async with listener_barrier:
@@ -0,0 +1,36 @@
+import random
+
+from common.hll import estimate_cardinality, precision_for_error, registers_from_entries, standard_error
+
+
+def _sketch(cardinality: int, index_bits: int) -> list[int]:
+    """
+    The registers of random 64 bit hashes, the same way as the sketches of the db
+    """
+    registers = [0] * (1 << index_bits)
+    for _ in range(cardinality):
+        hash_value = random.getrandbits(64)
+        rest = hash_value >> index_bits
+        rank = 64 - index_bits - rest.bit_length() + 1
+        index = hash_value & ((1 << index_bits) - 1)
+        registers[index] = max(registers[index], rank)
+    return registers
+
+
+def test_precision_for_error() -> None:
+    assert precision_for_error(0.02) == 12
+    assert standard_error(precision_for_error(0.02)) <= 0.02
+    assert precision_for_error(0.5) == 4
+    assert precision_for_error(0.0001) == 14
+
+
+def test_estimate_cardinality() -> None:
+    index_bits = 10
+    for cardinality in (0, 10, 1_000, 100_000):
+        estimate = estimate_cardinality(_sketch(cardinality, index_bits))
+        assert abs(estimate - cardinality) <= max(1, 5 * standard_error(index_bits) * cardinality), (cardinality, estimate)
+
+
+def test_registers_from_entries() -> None:
+    entries = [0 << 6 | 2, 2 << 6 | 1, 2 << 6 | 4]
+    assert registers_from_entries(entries, 2, 6) == [2, 0, 4, 0]
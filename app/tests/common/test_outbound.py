@@ -0,0 +1,134 @@
+from asyncio import Event as AsyncEvent, create_task, sleep, wait_for
+
+import pytest
+from common.outbound import SLOW_CONSUMER_CLOSE_CODE, OutboundQueue, OverflowPolicy
+
+from tests.handlers.utils import MockAsyncSenderWebsocket
+
+
+class BlockedWebsocket(MockAsyncSenderWebsocket):
+    """
+    A client that does not read until it is released
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.released = AsyncEvent()
+
+    async def send_text(self, data: str) -> None:
+        await self.released.wait()
+        await super().send_text(data)
+
+
+def frame(i: int) -> str:
+    return f'["EVENT","sub",{{"n":{i}}}]'
+
+
+@pytest.mark.asyncio
+async def test_outbound_drop_oldest() -> None:
+    ws = MockAsyncSenderWebsocket()
+    outbound = OutboundQueue(ws, max_messages=3, max_bytes=1024, high_water_bytes=512, policy=OverflowPolicy.drop_oldest)
+    for i in range(5):
+        outbound.push(frame(i))
+    assert outbound.queued_messages == 3
+    assert outbound.dropped_messages == 2
+
+    writer = create_task(outbound.run())
+    await outbound.flush(1)
+    outbound.stop()
+    await wait_for(writer, 1)
+    assert [msg[2]["n"] for msg in ws.get_data()] == [2, 3, 4], "Newest events must be kept!"
+
+
+@pytest.mark.asyncio
+async def test_outbound_drop_newest_keeps_responses() -> None:
+    ws = MockAsyncSenderWebsocket()
+    outbound = OutboundQueue(ws, max_messages=2, max_bytes=1024, high_water_bytes=1024, policy=OverflowPolicy.drop_newest)
+    await outbound.send_json(["EOSE", "sub"])
+    outbound.push(frame(0))
+    outbound.push(frame(1))
+    assert outbound.queued_messages == 2
+    assert outbound.dropped_messages == 1
+
+    writer = create_task(outbound.run())
+    await outbound.flush(1)
+    outbound.stop()
+    await wait_for(writer, 1)
+    assert ws.get_data() == [["EOSE", "sub"], ["EVENT", "sub", {"n": 0}]]
+
+
+@pytest.mark.asyncio
+async def test_outbound_evicts_slow_consumer() -> None:
+    ws = BlockedWebsocket()
+    outbound = OutboundQueue(ws, max_messages=10, max_bytes=100, high_water_bytes=50, policy=OverflowPolicy.disconnect)
+    writer = create_task(outbound.run())
+    for i in range(10):
+        outbound.push(frame(i))
+    # the queue exceeded its byte budget while the client was not reading
+    assert outbound.evicted and outbound.is_closed
+    ws.released.set()
+    await wait_for(writer, 1)
+    assert ws.close_code == SLOW_CONSUMER_CLOSE_CODE
+    assert outbound.queued_bytes <= 100
+
+
+@pytest.mark.asyncio
+async def test_outbound_evicts_stuck_consumer() -> None:
+    ws = BlockedWebsocket()
+    outbound = OutboundQueue(ws, max_messages=10, max_bytes=100, high_water_bytes=50, policy=OverflowPolicy.disconnect)
+    writer = create_task(outbound.run())
+    await sleep(0)
+    for i in range(10):
+        outbound.push(frame(i))
+    assert outbound.evicted
+    # the client never reads, the writer stuck in its send is cancelled
+    await wait_for(writer, 1)
+    assert ws.close_code == SLOW_CONSUMER_CLOSE_CODE
+    assert not ws.get_data()
+
+
+@pytest.mark.asyncio
+async def test_outbound_senders_wait_for_high_water() -> None:
+    ws = BlockedWebsocket()
+    outbound = OutboundQueue(ws, max_messages=100, max_bytes=1024, high_water_bytes=40, policy=OverflowPolicy.drop_oldest)
+    writer = create_task(outbound.run())
+    await outbound.send_text(frame(0))
+    await outbound.send_text(frame(1))
+    await outbound.send_text(frame(2))
+    # high water mark is reached, next sender has to wait for the client
+    pending = create_task(outbound.send_text(frame(3)))
+    await sleep(0.1)
+    assert not pending.done()
+
+    ws.released.set()
+    await wait_for(pending, 1)
+    await outbound.flush(1)
+    outbound.stop()
+    await wait_for(writer, 1)
+    assert [msg[2]["n"] for msg in ws.get_data()] == [0, 1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_outbound_senders_wait_for_message_high_water() -> None:
+    ws = BlockedWebsocket()
+    outbound = OutboundQueue(ws, max_messages=4, max_bytes=1024, high_water_bytes=512, policy=OverflowPolicy.disconnect)
+    # small frames stay below the high water mark of the bytes, the senders wait for the one of the messages
+    sending = create_task(_send_frames(outbound, 10))
+    await sleep(0.1)
+    assert not sending.done()
+    assert outbound.queued_messages == 2
+    outbound.push(frame(100))
+    assert not outbound.evicted, "The live events must have room while a query is sending!"
+
+    writer = create_task(outbound.run())
+    ws.released.set()
+    await wait_for(sending, 1)
+    await outbound.flush(1)
+    outbound.stop()
+    await wait_for(writer, 1)
+    assert len(ws.get_data()) == 11
+
+
+async def _send_frames(outbound: OutboundQueue, count: int) -> None:
+    for i in range(count):
+        await outbound.send_text(frame(i))
@@ -0,0 +1,57 @@
+from asyncio import Event as AsyncEvent, create_task, gather, sleep
+
+import pytest
+from common.singleflight import SingleFlight
+
+
+class BlockedCall:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.cancelled = False
+        self.released = AsyncEvent()
+
+    async def __call__(self) -> int:
+        self.calls += 1
+        try:
+            await self.released.wait()
+        except BaseException:
+            self.cancelled = True
+            raise
+        return self.calls
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_the_call() -> None:
+    flights: SingleFlight[str, int] = SingleFlight("test_flights")
+    call = BlockedCall()
+    waiters = [create_task(flights.run("key", call)) for _ in range(5)]
+    await sleep(0)
+    # cancelling a waiter does not cancel the call of the others
+    waiters[0].cancel()
+    await sleep(0)
+    assert not call.cancelled
+    call.released.set()
+    results = await gather(*waiters[1:])
+    assert results == [1] * 4 and call.calls == 1
+    assert len(flights) == 0
+    # a finished call is not shared anymore
+    assert await flights.run("key", call) == 2
+
+
+@pytest.mark.asyncio
+async def test_call_is_cancelled_without_waiters() -> None:
+    flights: SingleFlight[str, int] = SingleFlight("test_flights")
+    call = BlockedCall()
+    waiters = [create_task(flights.run("key", call)) for _ in range(2)]
+    await sleep(0)
+    for waiter in waiters:
+        waiter.cancel()
+    await gather(*waiters, return_exceptions=True)
+    await sleep(0)
+    assert call.cancelled and len(flights) == 0
+
+    async def failing_call() -> int:
+        raise ValueError("failed")
+
+    results = await gather(*(flights.run("failing", failing_call) for _ in range(2)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
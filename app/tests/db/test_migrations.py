@@ -0,0 +1,100 @@
+import pytest
+from db.core import _get_async_connection
+from db.migrations import ConcurrentIndex, Migration, build_index_concurrently, run_migrations
+from psycopg import errors, sql
+
+MIGRATIONS_TABLE_NAME = "test_schema_migrations"
+TABLE_NAME = "test_migrated"
+
+MIGRATIONS = (
+    Migration(1, "table", statements=(sql.SQL(f"CREATE TABLE {TABLE_NAME} (id INT, created_at BIGINT)"),)),
+    Migration(2, "index", indexes=(ConcurrentIndex(f"{TABLE_NAME}_created_at_index", TABLE_NAME, "(created_at DESC)"),)),
+    Migration(3, "drop index", dropped_indexes=(f"{TABLE_NAME}_created_at_index",)),
+)
+
+
+async def index_validity(conn, index_name: str) -> bool | None:
+    cur = await conn.execute("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s", (index_name,))
+    row = await cur.fetchone()
+    return row[0] if row else None
+
+
+@pytest.mark.asyncio
+async def test_run_migrations() -> None:
+    conn = await _get_async_connection()
+    async with conn:
+        await conn.set_autocommit(True)
+        await conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}, {MIGRATIONS_TABLE_NAME}")
+        index_name = MIGRATIONS[1].indexes[0].name
+
+        assert await run_migrations(conn, MIGRATIONS, target=2, table_name=MIGRATIONS_TABLE_NAME) == [1, 2]
+        assert await index_validity(conn, index_name)
+        assert await run_migrations(conn, MIGRATIONS, target=2, table_name=MIGRATIONS_TABLE_NAME) == []
+        assert await run_migrations(conn, MIGRATIONS, table_name=MIGRATIONS_TABLE_NAME) == [3]
+        assert await index_validity(conn, index_name) is None
+
+        # a failed concurrent build leaves an invalid index, it is built again
+        await conn.execute(f"INSERT INTO {TABLE_NAME} VALUES (1, 1), (1, 2)")
+        with pytest.raises(errors.UniqueViolation):
+            await conn.execute(f"CREATE UNIQUE INDEX CONCURRENTLY {index_name} ON {TABLE_NAME} (id)")
+        assert await index_validity(conn, index_name) is False
+        await build_index_concurrently(conn, MIGRATIONS[1].indexes[0])
+        assert await index_validity(conn, index_name)
+        await conn.execute(f"DROP TABLE {TABLE_NAME}, {MIGRATIONS_TABLE_NAME}")
+
+
+@pytest.mark.asyncio
+async def test_build_partitioned_index_concurrently() -> None:
+    conn = await _get_async_connection()
+    async with conn:
+        await conn.set_autocommit(True)
+        await conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+        await conn.execute(f"CREATE TABLE {TABLE_NAME} (id INT, created_at BIGINT) PARTITION BY RANGE (created_at)")
+        await conn.execute(f"CREATE TABLE {TABLE_NAME}_1 PARTITION OF {TABLE_NAME} FOR VALUES FROM (0) TO (10)")
+        await conn.execute(f"CREATE TABLE {TABLE_NAME}_2 PARTITION OF {TABLE_NAME} FOR VALUES FROM (10) TO (20)")
+        index = ConcurrentIndex(f"{TABLE_NAME}_created_at_index", TABLE_NAME, "(created_at DESC)")
+        await build_index_concurrently(conn, index)
+        assert await index_validity(conn, index.name)
+        # the partitions created later have it already
+        await conn.execute(f"CREATE TABLE {TABLE_NAME}_3 PARTITION OF {TABLE_NAME} FOR VALUES FROM (20) TO (30)")
+        await build_index_concurrently(conn, index)
+        cur = await conn.execute(f"SELECT count(*) FROM pg_indexes WHERE tablename LIKE '{TABLE_NAME}_%%'")
+        assert await cur.fetchone() == (3,)
+        await conn.execute(f"DROP TABLE {TABLE_NAME}")
+
+
+@pytest.mark.asyncio
+async def test_prepared_migration_attaches_table() -> None:
+    key = ConcurrentIndex(f"{TABLE_NAME}_archive_pkey", TABLE_NAME, "(id, created_at)", unique=True)
+    migration = Migration(
+        1,
+        "attach the table as a partition",
+        prepared_indexes=(key,),
+        preparations=(
+            sql.SQL(f"ALTER TABLE {TABLE_NAME} ADD CONSTRAINT {TABLE_NAME}_range CHECK (created_at IS NOT NULL AND created_at < 10) NOT VALID"),
+            sql.SQL(f"ALTER TABLE {TABLE_NAME} VALIDATE CONSTRAINT {TABLE_NAME}_range"),
+        ),
+        statements=(
+            sql.SQL(f"ALTER TABLE {TABLE_NAME} ALTER created_at SET NOT NULL"),
+            sql.SQL(f"ALTER TABLE {TABLE_NAME} ADD CONSTRAINT {key.name} PRIMARY KEY USING INDEX {key.name}"),
+            sql.SQL(f"ALTER TABLE {TABLE_NAME} RENAME TO {TABLE_NAME}_archive"),
+            sql.SQL(f"CREATE TABLE {TABLE_NAME} (id INT, created_at BIGINT, PRIMARY KEY (id, created_at)) PARTITION BY RANGE (created_at)"),
+            sql.SQL(f"ALTER TABLE {TABLE_NAME} ATTACH PARTITION {TABLE_NAME}_archive FOR VALUES FROM (MINVALUE) TO (10)"),
+        ),
+    )
+    conn = await _get_async_connection()
+    async with conn:
+        await conn.set_autocommit(True)
+        await conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}, {MIGRATIONS_TABLE_NAME}")
+        await conn.execute(f"CREATE TABLE {TABLE_NAME} (id INT, created_at BIGINT)")
+        await conn.execute(f"INSERT INTO {TABLE_NAME} VALUES (1, 1), (2, 2)")
+
+        assert await run_migrations(conn, (migration,), table_name=MIGRATIONS_TABLE_NAME) == [1]
+        cur = await conn.execute(f"SELECT tableoid::regclass::text, count(*) FROM {TABLE_NAME} GROUP BY 1")
+        assert await cur.fetchall() == [(f"{TABLE_NAME}_archive", 2)]
+        # the prepared key is kept by its name after its table is renamed
+        await build_index_concurrently(conn, key)
+        assert await index_validity(conn, key.name)
+        with pytest.raises(errors.UniqueViolation):
+            await conn.execute(f"INSERT INTO {TABLE_NAME} VALUES (1, 1)")
+        await conn.execute(f"DROP TABLE {TABLE_NAME}, {MIGRATIONS_TABLE_NAME}")
@@ -1,6 +1,9 @@
 import pytest
+from common.tools import merge_hex_prefixes
 from db.core import _get_async_connection
 from db.query_utils import (
+    prepare_any_clause,
+    prepare_prefix_ranges_clause,
     prepare_delete_q,
     prepare_equal_clause,
     prepare_in_clause,
@@ -83,6 +86,15 @@ async def test_where_claus_utils():
     in_caluse = prepare_in_clause(field_name=field_name, value_count=len(in_values))
     clause_str = in_caluse.as_string(conn)
     assert clause_str == '"field_name" IN (%s,%s,%s,%s,%s)'
+    any_clause = prepare_any_clause(field_name=("t", field_name), array_type="bpchar")
+    assert any_clause.as_string(conn) == '"t"."field_name" = ANY(%b::bpchar[])'
+    like_any_clause = prepare_any_clause(field_name=field_name, array_type="text", operator="LIKE")
+    assert like_any_clause.as_string(conn) == '"field_name" LIKE ANY(%b::text[])'
+    ranges_clause = prepare_prefix_ranges_clause(field_name=field_name, range_count=2)
+    assert ranges_clause.as_string(conn) == (
+        '("field_name" = ANY(%b::bpchar[]) or ("field_name" >= %b::bpchar and "field_name" < %b::bpchar)'
+        ' or ("field_name" >= %b::bpchar and "field_name" < %b::bpchar))'
+    )
     lte_clause = prepare_gte_lte_clause(field_name=field_name, lte=True)
     clause_str = lte_clause.as_string(conn)
     assert clause_str == '"field_name" <= %s'
@@ -137,3 +149,12 @@ async def test_insert_statements() -> None:
     insert_stmnt = prepare_insert_into(table_name=table_name, field_names=fields, value_tuple_count=2)
     insert_stm = insert_stmnt.as_string(conn)
     assert insert_stm == 'INSERT INTO "Table1" ("f1","f2","f3","f4","f5") VALUES ' "(%s,%s,%s,%s,%s)," "(%s,%s,%s,%s,%s)"
+
+
+def test_merge_hex_prefixes() -> None:
+    full_id = "ab" + "0" * 62
+    prefixes = ["ab", "abc", full_id, "ac", "af", "ff", "fff", "NOT-HEX", "1" * 64, "1" * 64]
+    full_values, ranges = merge_hex_prefixes(prefixes, 64)
+    assert full_values == ["1" * 64], "Covered and duplicate full values should be dropped!"
+    assert ranges == [("ab", "ad"), ("af", "b"), ("ff", "g")]
+    assert merge_hex_prefixes(["", "ab", full_id], 64) == ([], [("", "g")]), "The empty prefix covers every value!"
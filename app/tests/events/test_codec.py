@@ -0,0 +1,61 @@
+import pytest
+from common.errors import NostrValidationError
+from events.codec import FastCodec, PydanticCodec
+
+from tests.events.utils import generate_event
+
+E_TAG_ROW = ["e", "a" * 64, "wss://relay.example.com", "reply"]
+P_TAG_ROW = ["p", "b" * 64]
+
+
+def test_codecs_decode_same_event() -> None:
+    event_dict = {**generate_event().nostr_dict, "tags": [E_TAG_ROW, P_TAG_ROW, ["t", "unknown tag"]]}
+    fast_event = FastCodec().decode_event(event_dict)
+    pydantic_event = PydanticCodec().decode_event(event_dict)
+    assert fast_event.nostr_dict == pydantic_event.nostr_dict
+    assert fast_event.serializeable == pydantic_event.serializeable
+    assert [type(tag) for tag in fast_event.tags] == [type(tag) for tag in pydantic_event.tags]
+
+
+def test_codecs_decode_same_filters() -> None:
+    filters_dict = {"ids": ["abc"], "authors": ["def"], "kinds": [0, 1], "since": 10, "limit": 5, "#e": ["a", "b"], "#p": ["c"]}
+    assert FastCodec().decode_filters(filters_dict) == PydanticCodec().decode_filters(filters_dict)
+    assert FastCodec().decode_filters({}) == PydanticCodec().decode_filters({})
+
+
+@pytest.mark.parametrize(
+    "override",
+    [
+        {"kind": 4},  # not implemented kind
+        {"kind": 30000},
+        {"kind": "1"},
+        {"created_at": None},
+        {"tags": [["e", "a" * 64, "wss://relay.example.com", "not a marker"]]},
+        {"tags": [[]]},
+        {"content": 5},
+        {"content": "a\x00b"},
+        {"tags": [["p", "b" * 64, "wss://relay\x00.example.com"]]},
+    ],
+)
+def test_codecs_reject_invalid_event(override: dict) -> None:
+    event_dict = {**generate_event().nostr_dict, **override}
+    with pytest.raises(NostrValidationError):
+        FastCodec().decode_event(event_dict)
+
+
+def test_pydantic_codec_rejects_nul() -> None:
+    with pytest.raises(NostrValidationError):
+        PydanticCodec().decode_event({**generate_event().nostr_dict, "content": "a\x00b"})
+
+
+def test_codecs_reject_invalid_filters() -> None:
+    for filters_dict in ({"kinds": ["1"]}, {"ids": "abc"}, {"#e": [1]}, {"limit": 1.5}):
+        with pytest.raises(NostrValidationError):
+            FastCodec().decode_filters(filters_dict)
+
+
+@pytest.mark.parametrize("key", ["#a%", "#%s", "#ab", "#"])
+def test_codecs_reject_multi_letter_tag_filters(key: str) -> None:
+    for codec in (FastCodec(), PydanticCodec()):
+        with pytest.raises(NostrValidationError):
+            codec.decode_filters({key: ["a"]})
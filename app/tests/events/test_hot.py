@@ -0,0 +1,199 @@
+import json
+import time
+from asyncio import gather, sleep
+
+import pytest
+from events.codec import FastCodec
+from events.crud import delete_events, replace_event, write_events
+from events.data import Event
+from events.filters import Filters
+from events.hot import HotEvent, HotEvents, forget_shared_latest
+from message_handlers.event import get_hot_events, handle_received_event
+from message_handlers.req import handle_received_req
+from subscriptions.hub import BroadcastEvent, SubscriptionHub
+
+from tests.events.utils import generate_event
+from tests.handlers.utils import MockAsyncSenderWebsocket
+
+
+def _attached(**config) -> HotEvents:
+    hot_events = HotEvents(**{"max_entries": 100, "ttl": 60, "shared": True, **config})
+    hot_events.attach(SubscriptionHub("hot-test"))
+    return hot_events
+
+
+def _ids(events: list[HotEvent]) -> list[str]:
+    return [event.id for event in events]
+
+
+def _metadata(author: Event, event_id: str, created_at: int) -> Event:
+    return FastCodec().decode_event({**author.nostr_dict, "id": event_id, "kind": 0, "created_at": created_at})
+
+
+@pytest.mark.asyncio
+async def test_hot_events_are_served_without_the_db() -> None:
+    author = generate_event()
+    note = author.copy(update={"id": generate_event().id})
+    metadata = _metadata(author, generate_event().id, author.created_at)
+    await write_events([note])
+    assert await replace_event(metadata)
+    hot_events, other_process = _attached(), _attached()
+    try:
+        by_id = Filters(ids=[note.id, metadata.id])
+        latest = Filters(authors=[author.pubkey], kinds=[0, 3])
+        served, rest = await hot_events.split([by_id, latest, Filters(authors=[author.pubkey])])
+        assert sorted(_ids(served)) == sorted([note.id, metadata.id]) and rest == [Filters(authors=[author.pubkey])]
+
+        # the cached events are served after they are gone from the db
+        await delete_events(author.pubkey, [note.id, metadata.id])
+        assert sorted(_ids((await hot_events.split([by_id]))[0])) == sorted([note.id, metadata.id])
+        assert _ids((await hot_events.split([latest]))[0]) == [metadata.id]
+        # from redis by the other processes
+        await gather(*hot_events._background_tasks)
+        assert _ids((await other_process.split([Filters(ids=[note.id])]))[0]) == [note.id]
+        assert _ids((await other_process.split([latest]))[0]) == [metadata.id]
+
+        # the prefixes, the regular kinds and the cutting limits are not served
+        for f in (Filters(ids=[note.id[:10]]), Filters(authors=[author.pubkey], kinds=[1]), Filters(ids=[note.id, metadata.id], limit=1)):
+            assert not hot_events.can_serve(f)
+    finally:
+        hot_events.detach()
+        other_process.detach()
+
+
+@pytest.mark.asyncio
+async def test_hot_events_are_updated_on_replace_and_delete() -> None:
+    author = generate_event()
+    note = author.copy(update={"id": generate_event().id})
+    metadata = _metadata(author, generate_event().id, author.created_at)
+    await write_events([note])
+    assert await replace_event(metadata)
+    hot_events, other_process = _attached(), _attached()
+    try:
+        latest = Filters(authors=[author.pubkey], kinds=[0])
+        assert _ids((await hot_events.split([latest, Filters(ids=[note.id])]))[0])
+        assert _ids((await other_process.split([latest, Filters(ids=[note.id])]))[0])
+
+        newer = _metadata(author, generate_event().id, author.created_at + 1)
+        assert await replace_event(newer)
+        await hot_events.apply_replaced(newer.nostr_dict)
+        assert _ids((await hot_events.split([latest]))[0]) == [newer.id]
+        assert _ids((await hot_events.split([Filters(ids=[metadata.id])]))[0]) == [], "The replaced event is not served"
+        await hot_events.apply_replaced(metadata.nostr_dict)
+        assert _ids((await hot_events.split([latest]))[0]) == [newer.id], "The older event does not replace the newer one"
+        # the other processes learn it from the broadcast
+        other_process.apply_broadcasted(BroadcastEvent(newer.nostr_dict, json.dumps(newer.nostr_dict)))
+        assert _ids((await other_process.split([latest]))[0]) == [newer.id]
+
+        await delete_events(author.pubkey, [note.id, newer.id])
+        await hot_events.apply_deleted(author.pubkey, [note.id, newer.id])
+        assert (await hot_events.split([latest, Filters(ids=[note.id])]))[0] == []
+        deletion = FastCodec().decode_event({**author.nostr_dict, "id": generate_event().id, "kind": 5, "tags": [["e", note.id], ["e", newer.id]]})
+        other_process.apply_broadcasted(BroadcastEvent(deletion.nostr_dict, json.dumps(deletion.nostr_dict)))
+        assert (await other_process.split([latest, Filters(ids=[note.id])]))[0] == []
+    finally:
+        hot_events.detach()
+        other_process.detach()
+
+
+@pytest.mark.asyncio
+async def test_event_handler_updates_hot_events(monkeypatch) -> None:
+    # the generated events are altered, they are not signed
+    monkeypatch.setenv("verify_events", "0")
+    author = generate_event()
+    metadata = _metadata(author, generate_event().id, author.created_at)
+    hot_events = get_hot_events()
+    hot_events.attach(SubscriptionHub("hot-test"))
+    try:
+        await handle_received_event(metadata.nostr_dict)
+        latest = Filters(authors=[author.pubkey], kinds=[0])
+        assert _ids((await hot_events.split([latest]))[0]) == [metadata.id]
+        newer = _metadata(author, generate_event().id, author.created_at + 1)
+        await handle_received_event(newer.nostr_dict)
+        assert _ids((await hot_events.split([latest]))[0]) == [newer.id]
+    finally:
+        hot_events.detach()
+
+
+@pytest.mark.asyncio
+async def test_deleted_events_are_not_shared_again() -> None:
+    author = generate_event()
+    note = author.copy(update={"id": generate_event().id})
+    metadata = _metadata(author, generate_event().id, author.created_at)
+    await write_events([note])
+    assert await replace_event(metadata)
+    hot_events, other_process, new_process = _attached(), _attached(), _attached()
+    try:
+        # read by the other process before the deletion, shared after it
+        read = [HotEvent.from_encoded(json.dumps(event.nostr_dict)) for event in (note, metadata)]
+        await delete_events(author.pubkey, [note.id, metadata.id])
+        await hot_events.apply_deleted(author.pubkey, [note.id, metadata.id])
+        await other_process._share(read)
+        latest = Filters(authors=[author.pubkey], kinds=[0])
+        assert (await new_process.split([latest, Filters(ids=[note.id])]))[0] == []
+    finally:
+        for process in (hot_events, other_process, new_process):
+            process.detach()
+
+
+@pytest.mark.asyncio
+async def test_req_handler_sends_events_once() -> None:
+    author = generate_event()
+    old = author.copy(update={"id": generate_event().id, "created_at": int(time.time()) - 3600})
+    await write_events([old])
+    hot_events = get_hot_events()
+    hot_events.attach(SubscriptionHub("hot-test"))
+    try:
+        ws = MockAsyncSenderWebsocket()
+        # the hot cache serves the id, the db serves the author
+        await handle_received_req(ws, "once", [Filters(ids=[old.id]), Filters(authors=[author.pubkey])])
+        assert ws.get_data() == [["EVENT", "once", json.loads(json.dumps(old.nostr_dict))], ["EOSE", "once"]]
+    finally:
+        hot_events.detach()
+
+
+@pytest.mark.asyncio
+async def test_hot_events_expire_in_the_memory() -> None:
+    note = generate_event()
+    await write_events([note])
+    hot_events = _attached(ttl=0.05, shared=False)
+    try:
+        by_id = Filters(ids=[note.id])
+        assert _ids((await hot_events.split([by_id]))[0]) == [note.id]
+        # gone from the db without a deletion the cache learns
+        await delete_events(note.pubkey, [note.id])
+        assert _ids((await hot_events.split([by_id]))[0]) == [note.id]
+        await sleep(0.1)
+        assert (await hot_events.split([by_id]))[0] == []
+    finally:
+        hot_events.detach()
+
+
+@pytest.mark.asyncio
+async def test_hot_latest_events_are_dropped_on_imports() -> None:
+    author = generate_event()
+    metadata = _metadata(author, generate_event().id, author.created_at)
+    assert await replace_event(metadata)
+    hot_events, other_process = _attached(), _attached()
+    try:
+        latest = Filters(authors=[author.pubkey], kinds=[0])
+        assert _ids((await hot_events.split([latest]))[0]) == [metadata.id]
+        await gather(*hot_events._background_tasks)
+        assert _ids((await other_process.split([latest]))[0]) == [metadata.id]
+
+        # stored the way the imports store them, without replacing the older one or broadcasting it
+        imported = _metadata(author, generate_event().id, author.created_at + 1)
+        await write_events([imported])
+        await forget_shared_latest([author.pubkey])
+        for process in (hot_events, other_process):
+            process.apply_imported(json.dumps([imported.id]))
+            assert _ids((await process.split([latest]))[0]) == [imported.id]
+
+        # the lowest id of the same created_at is kept, as replace_event keeps it
+        tied = sorted([imported, _metadata(author, generate_event().id, imported.created_at)], key=lambda event: event.id)
+        await hot_events.apply_replaced(tied[1].nostr_dict)
+        await hot_events.apply_replaced(tied[0].nostr_dict)
+        assert _ids((await hot_events.split([latest]))[0]) == [tied[0].id]
+    finally:
+        hot_events.detach()
+        other_process.detach()
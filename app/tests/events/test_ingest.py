@@ -0,0 +1,82 @@
+from asyncio import gather
+
+import pytest
+from common import metrics
+from events.codec import FastCodec
+from events.crud import fetch_event, write_event, write_events
+from cache.crud import listen_on_key
+from events.ingest import BroadcastBatcher, IngestBatcher
+
+from tests.events.utils import generate_event
+
+E_TAG_ROW = ["e", "a" * 64, "wss://relay.example.com", "root"]
+P_TAG_ROW = ["p", "b" * 64, "wss://relay.example.com", "bob"]
+
+
+@pytest.mark.asyncio
+async def test_write_events_skips_duplicates() -> None:
+    stored = generate_event()
+    await write_event(stored)
+    tagged = FastCodec().decode_event({**generate_event().nostr_dict, "tags": [E_TAG_ROW, P_TAG_ROW]})
+    new = generate_event()
+
+    inserted_ids = await write_events([stored, tagged, new, tagged])
+    assert inserted_ids == {tagged.id, new.id}
+    stored_tagged = await fetch_event(tagged.id)
+    assert stored_tagged
+    assert sorted(map(list, stored_tagged["tags"] or [])) == sorted([E_TAG_ROW, P_TAG_ROW])
+
+
+@pytest.mark.asyncio
+async def test_ingest_batcher() -> None:
+    batches: list[int] = []
+
+    async def writer(events) -> set[str]:
+        batches.append(len(events))
+        return await write_events(events)
+
+    batcher = IngestBatcher(writer, max_batch_size=3, max_delay=0.01)
+    events = [generate_event() for _ in range(4)]
+    results = await gather(*(batcher.submit(event) for event in [*events, events[0]]))
+    # the first batch is written once it is full, the rest after the delay
+    assert batches == [3, 2]
+    assert results == [True, True, True, True, False]
+    for event in events:
+        assert await fetch_event(event.id)
+
+    # an event submitted twice in a batch is new only once
+    event = generate_event()
+    assert sorted(await gather(batcher.submit(event), batcher.submit(event))) == [False, True]
+    await batcher.close()
+
+
+@pytest.mark.asyncio
+async def test_ingest_batcher_isolates_failing_event() -> None:
+    batcher = IngestBatcher(write_events, max_batch_size=3, max_delay=0.01)
+    good = generate_event()
+    # skips the codec, which rejects the NUL characters
+    bad = generate_event().copy(update={"content": "a\x00b"})
+    results = await gather(*(batcher.submit(event) for event in (good, bad)), return_exceptions=True)
+    assert results[0] is True
+    assert isinstance(results[1], Exception)
+    assert await fetch_event(good.id)
+    await batcher.close()
+
+
+@pytest.mark.asyncio
+async def test_broadcast_batcher() -> None:
+    channel = "broadcast-batch-test"
+    batcher = BroadcastBatcher(max_batch_size=3, max_delay=0.01)
+    async with listen_on_key(channel) as listener:
+        values = [str(i) for i in range(5)]
+        batches = metrics.snapshot().get("broadcast.batches", 0)
+        await gather(*(batcher.submit((channel, value)) for value in values))
+        assert metrics.snapshot()["broadcast.batches"] - batches == 2
+        received: list[str] = []
+        async for message in listener:
+            if message["type"] == "message":
+                received.append(message["data"])
+            if len(received) == len(values):
+                break
+    assert received == values
+    await batcher.close()
@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+from hashlib import sha256
+
+import pytest
+from db.core import connect_db_pool
+from events.crud import fetch_event, query_events, write_events
+from events.filters import Filters
+from events.partitions import create_partitions
+from tags.data import parse_tags
+
+from tests.events.utils import generate_event
+
+# a month no other test writes events into
+MONTH_START = int(datetime(2100, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+@pytest.mark.asyncio
+async def test_events_stored_in_monthly_partitions() -> None:
+    pool = connect_db_pool()
+    async with pool.connection() as conn:
+        await conn.execute("SELECT create_event_partitions(to_timestamp(%s), 1)", (MONTH_START,))
+        assert await create_partitions(conn, months_ahead=0) == 0, "The current month is covered by the archive partition!"
+
+    template = generate_event()
+    events = [
+        template.copy(update={"id": sha256(f"{template.id}{i}".encode()).hexdigest(), "created_at": MONTH_START + i})
+        for i in range(3)
+    ]
+    events[0].tags = parse_tags([["t", "partitioned"]])
+    await write_events(events)
+    try:
+        async with pool.connection() as conn:
+            cur = await conn.execute(
+                "SELECT DISTINCT tableoid::regclass::text FROM event WHERE id = ANY(%s)", ([event.id for event in events],)
+            )
+            assert [row[0] for row in await cur.fetchall()] == ["event_2100_01"]
+        fetched = await fetch_event(events[0].id)
+        assert fetched and fetched["tags"] == [["t", "partitioned"]]
+        queried = await query_events(Filters(**{"#t": ["partitioned"], "since": MONTH_START, "until": MONTH_START + 10}))
+        assert [e["id"] for e in queried] == [events[0].id]
+    finally:
+        async with pool.connection() as conn:
+            # dropping the partition would keep their ids claimed
+            await conn.execute("DELETE FROM event WHERE id = ANY(%s)", ([event.id for event in events],))
+            await conn.execute("DROP TABLE tag_2100_01")
+            await conn.execute("ALTER TABLE event DETACH PARTITION event_2100_01")
+            await conn.execute("DROP TABLE event_2100_01")
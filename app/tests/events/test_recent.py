@@ -0,0 +1,187 @@
+import json
+import time
+
+import pytest
+from events.codec import FastCodec
+from events.crud import write_events
+from events.data import Event
+from events.filters import Filters
+from events.recent import RecentEvent, RecentEvents
+from common import metrics
+from message_handlers.req import get_recent_events, get_result_cache, handle_received_req
+from subscriptions.hub import BroadcastEvent, SubscriptionHub
+
+from tests.events.utils import generate_event
+from tests.handlers.utils import MockAsyncSenderWebsocket
+
+
+def _broadcasted(event: Event) -> BroadcastEvent:
+    encoded = json.dumps(event.nostr_dict, separators=(",", ":"))
+    return BroadcastEvent(json.loads(encoded), encoded)
+
+
+def _ids(events: list[RecentEvent]) -> list[str]:
+    return [event.id for event in events]
+
+
+async def _warmed(**config) -> RecentEvents:
+    recent_events = RecentEvents(**{"max_count": 100_000, "max_bytes": 64 * 1024 * 1024, "window": 600, "max_scan": 1_000, **config})
+    recent_events.attach(SubscriptionHub("recent-test"))
+    await recent_events.warm()
+    assert recent_events.is_ready
+    return recent_events
+
+
+@pytest.mark.asyncio
+async def test_recent_events_split() -> None:
+    now = int(time.time())
+    author = generate_event()
+    stored = [author.copy(update={"id": f"{i:064x}", "created_at": now - 60 - i}) for i in range(3)]
+    await write_events(stored)
+    recent_events = await _warmed()
+    try:
+        # warmed from the db
+        recent = Filters(authors=[author.pubkey], since=now - 120)
+        served, older = recent_events.split([recent])
+        assert _ids(served) == [event.id for event in stored] and older == []
+
+        # the broadcasted events are added, the older part is read from the db
+        newer = author.copy(update={"id": "f" * 64, "created_at": now})
+        recent_events.add_broadcasted(_broadcasted(newer))
+        served, older = recent_events.split([Filters(authors=[author.pubkey], limit=10)])
+        assert _ids(served) == [newer.id, *(event.id for event in stored)]
+        assert len(older) == 1 and older[0].until == recent_events.covered_since - 1 and older[0].limit == 6
+        served, older = recent_events.split([Filters(authors=[author.pubkey], limit=2)])
+        assert _ids(served) == [newer.id, stored[0].id] and older == [], "The limit is reached within the buffer"
+        old = Filters(authors=[author.pubkey], until=recent_events.covered_since - 10)
+        assert recent_events.split([old]) == ([], [old])
+
+        # deleting and replacing the buffered events
+        deletion = FastCodec().decode_event({**generate_event(kind=5).nostr_dict, "tags": [["e", stored[0].id]]})
+        recent_events.add_broadcasted(_broadcasted(deletion))
+        assert stored[0].id in _ids(recent_events.split([recent])[0]), "Only the author can delete its events"
+        own_deletion = {**author.nostr_dict, "id": "e" * 64, "kind": 5, "tags": [["e", stored[0].id]]}
+        recent_events.add_broadcasted(_broadcasted(FastCodec().decode_event(own_deletion)))
+        assert stored[0].id not in _ids(recent_events.split([recent])[0])
+        metadata = {**author.nostr_dict, "id": "d" * 64, "kind": 0}
+        recent_events.add_broadcasted(_broadcasted(FastCodec().decode_event(metadata)))
+        replacing = {**metadata, "id": "c" * 64, "created_at": now + 1}
+        recent_events.add_broadcasted(_broadcasted(FastCodec().decode_event(replacing)))
+        assert _ids(recent_events.split([Filters(authors=[author.pubkey], kinds=[0])])[0]) == ["c" * 64]
+    finally:
+        recent_events.detach()
+    assert len(recent_events) == 0 and recent_events.size_in_bytes == 0
+    assert recent_events.split([recent]) == ([], [recent]), "The detached buffer is not used"
+
+
+@pytest.mark.asyncio
+async def test_recent_events_are_bounded() -> None:
+    now = int(time.time())
+    author = generate_event()
+    events = [author.copy(update={"id": f"{i:064x}", "created_at": now - 10 + i}) for i in range(10)]
+    recent_events = RecentEvents(max_count=5, max_bytes=64 * 1024 * 1024, window=600, max_scan=1_000)
+    recent_events.attach(SubscriptionHub("recent-test"))
+    # ready without the warm up
+    recent_events._is_ready = True
+    try:
+        for event in events:
+            recent_events.add_broadcasted(_broadcasted(event))
+        assert len(recent_events) == 5 and recent_events.covered_since == events[5].created_at
+        served, older = recent_events.split([Filters(authors=[author.pubkey])])
+        assert _ids(served) == [event.id for event in reversed(events[5:])]
+        assert older[0].until == events[4].created_at
+
+        event_size = recent_events.size_in_bytes // len(recent_events)
+        recent_events._max_bytes = event_size * 2
+        recent_events.add({**author.nostr_dict, "id": "f" * 64, "created_at": now}, "x" * event_size)
+        assert len(recent_events) == 2 and recent_events.size_in_bytes <= event_size * 2
+
+        recent_events.skip_missed()
+        assert len(recent_events) == 0 and recent_events.covered_since >= now
+        recent_events.add(events[0].nostr_dict, "x")
+        assert len(recent_events) == 0, "The events before covered_since are not added"
+    finally:
+        recent_events.detach()
+
+
+@pytest.mark.asyncio
+async def test_req_handler_uses_recent_events() -> None:
+    now = int(time.time())
+    author = generate_event()
+    old = author.copy(update={"id": "1" * 64, "created_at": now - 3600})
+    await write_events([old])
+    recent_events = get_recent_events()
+    recent_events.attach(SubscriptionHub("recent-test"))
+    try:
+        await recent_events.warm()
+        new = author.copy(update={"id": "2" * 64, "created_at": now})
+        # only broadcasted, so it can only be sent from the buffer
+        recent_events.add_broadcasted(_broadcasted(new))
+        ws = MockAsyncSenderWebsocket()
+        await handle_received_req(ws, "recent", [Filters(authors=[author.pubkey])])
+        sent = ws.get_data()
+        assert [message[2]["id"] for message in sent[:-1]] == [new.id, old.id]
+        assert sent[-1] == ["EOSE", "recent"]
+    finally:
+        recent_events.detach()
+
+
+@pytest.mark.asyncio
+async def test_split_req_results_cached_by_their_filters() -> None:
+    now = int(time.time())
+    author = generate_event()
+    old = author.copy(update={"id": "3" * 64, "created_at": now - 3600})
+    await write_events([old])
+    recent_events, result_cache = get_recent_events(), get_result_cache()
+    hub = SubscriptionHub("recent-test")
+    recent_events.attach(hub)
+    result_cache.attach(hub)
+    try:
+        await recent_events.warm()
+        recent_events.add_broadcasted(_broadcasted(author.copy(update={"id": "4" * 64, "created_at": now})))
+        filters = [Filters(authors=[author.pubkey], limit=5)]
+        hits = metrics.snapshot().get("req_cache.hits", 0)
+        first, second = MockAsyncSenderWebsocket(), MockAsyncSenderWebsocket()
+        await handle_received_req(first, "split", filters)
+        # the older part of the split filter changes as the buffer moves forward, the result is kept by the sent filters
+        recent_events._evict(recent_events.covered_since + 1)
+        await handle_received_req(second, "split", filters)
+        assert metrics.snapshot()["req_cache.hits"] - hits == 1
+        assert [message[2]["id"] for message in second.get_data()[:-1]] == ["4" * 64, old.id]
+        assert first.get_data() == second.get_data()
+    finally:
+        result_cache.detach()
+        recent_events.detach()
+
+
+@pytest.mark.asyncio
+async def test_recent_events_indexes() -> None:
+    now = int(time.time())
+    author = generate_event()
+    mentioned = generate_event().pubkey
+    recent_events = RecentEvents(max_count=100, max_bytes=64 * 1024 * 1024, window=600, max_scan=2)
+    recent_events.attach(SubscriptionHub("recent-test"))
+    recent_events._is_ready = True
+    try:
+        notes = [{**author.nostr_dict, "id": f"{i:064x}", "created_at": now - i, "tags": []} for i in range(5)]
+        mention = {**author.nostr_dict, "id": "a" * 64, "created_at": now - 10, "kind": 3, "tags": [["p", mentioned], ["p", mentioned]]}
+        for event in [*notes, mention]:
+            recent_events.add(event, json.dumps(event))
+
+        by_tag = Filters(**{"#p": [mentioned]}, since=now - 60)
+        assert recent_events._candidates(by_tag) == [recent_events._by_id[mention["id"]]]
+        assert recent_events.split([by_tag]) == ([recent_events._by_id[mention["id"]]], [])
+        by_kind = Filters(kinds=[3], since=now - 60)
+        assert len(recent_events._candidates(by_kind)) == 1
+        assert _ids(recent_events.split([by_kind])[0]) == [mention["id"]]
+
+        # the filters testing too many unmatched events are read from the db
+        scanned = Filters(ids=["a"], since=now - 60)
+        assert recent_events.split([scanned]) == ([], [scanned])
+        assert _ids(recent_events.split([Filters(ids=["0"], since=now - 60, limit=2)])[0]) == [notes[0]["id"], notes[1]["id"]]
+
+        recent_events.add_broadcasted(_broadcasted(FastCodec().decode_event({**mention, "id": "b" * 64, "created_at": now, "tags": []})))
+        assert recent_events.split([by_tag]) == ([], []), "The replaced event is unindexed"
+    finally:
+        recent_events.detach()
+    assert not (recent_events._by_pubkey or recent_events._by_kind or recent_events._by_tag)
@@ -0,0 +1,179 @@
+import json
+import time
+from asyncio import gather, sleep
+
+import pytest
+from common import metrics
+from events.codec import FastCodec
+from events.crud import write_events
+from events.data import Event
+from events.filters import Filters
+from events.result_cache import ResultCache, normalize_filters
+from message_handlers.req import get_result_cache, handle_received_req
+from subscriptions.hub import BroadcastEvent, SubscriptionHub
+
+from tests.events.utils import generate_event
+from tests.handlers.utils import MockAsyncSenderWebsocket
+
+
+def _encoded(event: Event) -> str:
+    return json.dumps(event.nostr_dict, separators=(",", ":"))
+
+
+def _broadcasted(event: Event) -> BroadcastEvent:
+    return BroadcastEvent(json.loads(_encoded(event)), _encoded(event))
+
+
+def _attached_cache(**config) -> ResultCache:
+    result_cache = ResultCache(**{"max_bytes": 1024 * 1024, "max_entries": 100, "ttl": 60, "max_limit": 100, "shared": False, **config})
+    result_cache.attach(SubscriptionHub("result-cache-test"))
+    return result_cache
+
+
+async def _fill(result_cache: ResultCache, filters: list[Filters], events: list[Event]) -> str:
+    key = result_cache.key_of(filters)
+    assert key is not None
+    async with result_cache.filling(key, tuple(filters)) as fill:
+        for event in events:
+            fill.add(_encoded(event))
+        fill.complete()
+    return key
+
+
+def _ids(encoded_events: list[str] | None) -> list[str]:
+    assert encoded_events is not None
+    return [json.loads(encoded)["id"] for encoded in encoded_events]
+
+
+def test_normalize_filters() -> None:
+    f1 = Filters(**{"kinds": [1, 0, 1], "authors": ["b", "a"], "#e": ["y", "x"], "limit": 50})
+    f2 = Filters(**{"kinds": [0, 1], "authors": ["a", "b"], "#e": ["x", "y"], "ids": [], "limit": 50})
+    f3 = Filters(kinds=[1], limit=10)
+    assert normalize_filters([f1, f3]) == normalize_filters([f3, f2])
+    assert normalize_filters([f1]) != normalize_filters([f3])
+
+
+@pytest.mark.asyncio
+async def test_result_cache_patches_and_invalidates() -> None:
+    result_cache = _attached_cache()
+    author = generate_event()
+    notes = [author.copy(update={"id": f"{i:064x}", "created_at": author.created_at - i}) for i in range(3)]
+    feed = [Filters(authors=[author.pubkey], kinds=[1], limit=3)]
+    assert result_cache.key_of([Filters(authors=[author.pubkey])]) is None, "The results without a limit are not cached"
+    feed_key = await _fill(result_cache, feed, notes)
+    assert _ids(result_cache.get(feed_key)) == [note.id for note in notes]
+
+    # a new event is patched in, the oldest one is dropped above the limit
+    newer = author.copy(update={"id": "f" * 64, "created_at": author.created_at + 1})
+    result_cache.apply_broadcasted(_broadcasted(newer))
+    assert _ids(result_cache.get(feed_key)) == [newer.id, notes[0].id, notes[1].id]
+    older = author.copy(update={"id": "e" * 64, "created_at": author.created_at - 10})
+    result_cache.apply_broadcasted(_broadcasted(older))
+    assert _ids(result_cache.get(feed_key)) == [newer.id, notes[0].id, notes[1].id]
+
+    # the limits of multiple filters apply separately, they are invalidated
+    both_key = await _fill(result_cache, [*feed, Filters(kinds=[2], limit=1)], notes[:1])
+    result_cache.apply_broadcasted(_broadcasted(newer.copy(update={"id": "d" * 64})))
+    assert result_cache.get(both_key) is None
+
+    # deleting a cached event
+    deletion = FastCodec().decode_event({**generate_event(kind=5).nostr_dict, "tags": [["e", notes[0].id]]})
+    result_cache.apply_broadcasted(_broadcasted(deletion))
+    assert result_cache.get(feed_key) is None
+
+    # replacing a cached event
+    metadata = generate_event().copy(update={"kind": 0})
+    profile_key = await _fill(result_cache, [Filters(ids=[metadata.id], limit=1)], [metadata])
+    result_cache.apply_broadcasted(_broadcasted(metadata.copy(update={"id": "c" * 64, "created_at": metadata.created_at + 1})))
+    assert result_cache.get(profile_key) is None
+    assert len(result_cache) == 0 and result_cache.size_in_bytes == 0
+
+
+@pytest.mark.asyncio
+async def test_result_cache_skips_outdated_fills_and_evicts() -> None:
+    result_cache = _attached_cache()
+    event = generate_event()
+    filters = [Filters(authors=[event.pubkey], limit=10)]
+    key = result_cache.key_of(filters)
+    assert key is not None
+    async with result_cache.filling(key, tuple(filters)) as fill:
+        # broadcasted while the result is being read
+        result_cache.apply_broadcasted(_broadcasted(event))
+        fill.complete()
+    assert result_cache.get(key) is None, "The result may miss the broadcasted event"
+    # only the results that could hold the replaced or the deleted events of the author are outdated
+    notes_filters = (Filters(authors=[event.pubkey], kinds=[1], limit=10),)
+    notes_key = normalize_filters(list(notes_filters))
+    other_metadata = FastCodec().decode_event({**generate_event().nostr_dict, "kind": 0})
+    deletion = FastCodec().decode_event({**event.nostr_dict, "id": "e" * 64, "kind": 5, "tags": [["e", "f" * 64]]})
+    for broadcasted, is_outdated in ((other_metadata, False), (deletion, True)):
+        notes_cache = _attached_cache()
+        async with notes_cache.filling(notes_key, notes_filters) as fill:
+            notes_cache.apply_broadcasted(_broadcasted(broadcasted))
+            fill.complete()
+        assert (notes_cache.get(notes_key) is None) is is_outdated
+    await _fill(result_cache, filters, [])
+    assert result_cache.get(key) == [], "The empty results are cached too"
+
+    small_cache = _attached_cache(max_bytes=len(_encoded(event)) * 2)
+    keys = [await _fill(small_cache, [Filters(ids=[str(i)], limit=1)], [event]) for i in range(3)]
+    assert small_cache.get(keys[0]) is None and small_cache.get(keys[2]) is not None
+    assert small_cache.size_in_bytes <= len(_encoded(event)) * 2
+    too_large = await _fill(small_cache, [Filters(ids=["x"], limit=3)], [event] * 3)
+    assert small_cache.get(too_large) is None
+
+    expiring_cache = _attached_cache(ttl=0.01)
+    expiring_key = await _fill(expiring_cache, filters, [event])
+    time.sleep(0.02)
+    assert expiring_cache.get(expiring_key) is None
+
+
+@pytest.mark.asyncio
+async def test_shared_results() -> None:
+    writer, reader = _attached_cache(shared=True), _attached_cache(shared=True)
+    event = generate_event()
+    filters = [Filters(authors=[event.pubkey], limit=5)]
+    key = await _fill(writer, filters, [event])
+    assert reader.get(key) is None
+    for _ in range(50):
+        if (shared := await reader.get_shared(key, tuple(filters))) is not None:
+            break
+        await sleep(0.01)
+    assert _ids(shared) == [event.id]
+    assert _ids(reader.get(key)) == [event.id], "The shared result is kept in the memory too"
+
+    # the patched result is deleted from redis
+    writer.apply_broadcasted(_broadcasted(event.copy(update={"id": "f" * 64, "created_at": event.created_at + 1})))
+    for _ in range(50):
+        if await _attached_cache(shared=True).get_shared(key, tuple(filters)) is None:
+            break
+        await sleep(0.01)
+    else:
+        assert False, "The shared result is not deleted"
+
+    # the shared result is deleted once the writer does not hold it anymore, it would not be patched
+    small_writer = _attached_cache(shared=True, max_entries=1)
+    key = await _fill(small_writer, filters, [event])
+    await _fill(small_writer, [Filters(ids=[event.id], limit=1)], [event])
+    await gather(*small_writer._background_tasks)
+    assert small_writer.get(key) is None
+    assert await _attached_cache(shared=True).get_shared(key, tuple(filters)) is None
+
+
+@pytest.mark.asyncio
+async def test_req_handler_uses_result_cache() -> None:
+    events = [generate_event() for _ in range(3)]
+    await write_events(events)
+    filters = [Filters(authors=[event.pubkey for event in events], limit=5)]
+    result_cache = get_result_cache()
+    result_cache.attach(SubscriptionHub("result-cache-test"))
+    try:
+        hits = metrics.snapshot().get("req_cache.hits", 0)
+        first, second = MockAsyncSenderWebsocket(), MockAsyncSenderWebsocket()
+        await handle_received_req(first, "cached", filters)
+        await handle_received_req(second, "cached", filters)
+        assert metrics.snapshot()["req_cache.hits"] - hits == 1
+        assert first.get_data() == second.get_data()
+        assert len(second.get_data()) == len(events) + 1
+    finally:
+        result_cache.detach()
@@ -0,0 +1,127 @@
+import json
+from asyncio import CancelledError, create_task, sleep
+from hashlib import sha256
+
+import pytest
+from cache.crud import broadcast
+from common import metrics
+from common.bloom import BloomFilter
+from common.tools import surpress_exc_coroutine
+from events.crud import write_event
+from events.filters import Filters
+from events.seen import IMPORTED_IDS_KEY, SeenEventIds
+
+from tests.events.utils import generate_event
+
+
+def test_bloom_filter() -> None:
+    bloom = BloomFilter(10_000, 0.01)
+    ids = [sha256(str(i).encode()).hexdigest() for i in range(20_000)]
+    for event_id in ids[:10_000]:
+        bloom.add(event_id)
+    assert all(event_id in bloom for event_id in ids[:10_000]), "Bloom filter cannot have false negatives!"
+    false_positives = sum(event_id in bloom for event_id in ids[10_000:])
+    assert false_positives < 300
+
+
+@pytest.mark.asyncio
+async def test_seen_event_ids() -> None:
+    stored = generate_event()
+    await write_event(stored)
+    seen = SeenEventIds(capacity=100_000, error_rate=0.001, recent_size=10)
+    unknown_id = sha256(b"unknown").hexdigest()
+    # nothing is certain until it is rebuilt
+    assert seen.may_exist(unknown_id)
+    await seen.rebuild()
+    assert seen.is_ready
+    assert seen.may_exist(stored.id)
+    assert not seen.may_exist(unknown_id)
+    # the stored events are not known to be duplicates, they are not in the recent ids
+    assert not seen.is_duplicate(stored.id)
+
+    new = generate_event()
+    seen.add(new.id)
+    assert seen.is_duplicate(new.id) and seen.may_exist(new.id)
+    seen.discard(new.id)
+    assert not seen.is_duplicate(new.id)
+
+    assert not seen.may_match(Filters(ids=[unknown_id]))
+    assert seen.may_match(Filters(ids=[unknown_id, stored.id]))
+    assert seen.may_match(Filters(ids=[unknown_id[:10]])), "Prefixes cannot be tested!"
+    assert seen.may_match(Filters(kinds=[1]))
+
+
+@pytest.mark.asyncio
+async def test_seen_event_ids_follow_imports() -> None:
+    seen = SeenEventIds(capacity=100_000, error_rate=0.001, recent_size=10)
+    follower = create_task(seen.follow_imports())
+    try:
+        # rebuilt once the imported ids are listened
+        while not seen.is_ready:
+            await sleep(0.01)
+        imported_ids = [sha256(f"imported-{i}".encode()).hexdigest() for i in range(3)]
+        assert not any(seen.may_exist(event_id) for event_id in imported_ids)
+        await broadcast(IMPORTED_IDS_KEY, json.dumps(imported_ids))
+        while not seen.may_exist(imported_ids[-1]):
+            await sleep(0.01)
+        assert all(seen.may_exist(event_id) for event_id in imported_ids)
+
+        # the ids stored while the broadcasts are missed are read from the db
+        stored = generate_event()
+        await write_event(stored)
+        seen.invalidate()
+        assert seen.may_exist(stored.id), "Not trusted until it is rebuilt"
+        while not seen.is_ready:
+            await sleep(0.01)
+        assert seen.may_exist(stored.id)
+    finally:
+        follower.cancel()
+        await surpress_exc_coroutine(follower, CancelledError)
+        await seen.close()
+
+
+def test_seen_event_ids_survive_failing_imports() -> None:
+    seen = SeenEventIds(capacity=1_000, error_rate=0.01, recent_size=10)
+    imported_id = sha256(b"imported").hexdigest()
+    received: list[str] = []
+
+    def fail(_: str) -> None:
+        raise RuntimeError("broken listener")
+
+    seen.add_import_listener(fail)
+    seen.add_import_listener(received.append)
+    seen.dispatch_imported("not json")
+    seen.dispatch_imported(json.dumps([imported_id]))
+    assert received == ["not json", json.dumps([imported_id])]
+    assert seen.bloom_count == 1
+
+
+@pytest.mark.asyncio
+async def test_seen_event_ids_resized() -> None:
+    stored = generate_event()
+    await write_event(stored)
+    seen = SeenEventIds(capacity=2, error_rate=0.01, recent_size=10)
+    resizes = metrics.snapshot().get("seen_ids.resizes", 0)
+    # the db keeps the events of the previous runs, more than the capacity
+    await seen.rebuild()
+    assert seen.is_ready and seen.may_exist(stored.id)
+    assert metrics.snapshot()["seen_ids.resizes"] > resizes
+    # the ids are added to a new filter, not once more to the old one
+    assert seen.bloom_count <= seen.capacity
+    await seen.rebuild()
+    assert seen.bloom_count <= seen.capacity
+
+    # outgrown by the new ids, it is not trusted until it is rebuilt with the doubled capacity
+    capacity = seen.capacity
+    for i in range(capacity - seen.bloom_count + 1):
+        seen.add(sha256(f"new-{i}".encode()).hexdigest())
+    assert not seen.is_ready and seen.capacity == 2 * capacity
+    # let the rebuild start
+    await sleep(0)
+    added_id = sha256(b"added during the rebuild").hexdigest()
+    seen.add(added_id)
+    while not seen.is_ready:
+        await sleep(0.01)
+    assert seen.may_exist(added_id), "The ids added during the rebuild are kept"
+    assert seen.may_exist(stored.id)
+    await seen.close()
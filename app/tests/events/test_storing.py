@@ -1,6 +1,23 @@
+from asyncio import gather
+from hashlib import sha256
+
 import pytest
-from events.crud import delete_event_by_kind_pubkey, fetch_event, fetch_event_by_kind_pubkey, write_event
+from events.codec import FastCodec
+from events.crud import (
+    delete_event_by_kind_pubkey,
+    fetch_event,
+    fetch_event_by_kind_pubkey,
+    query_events,
+    replace_event,
+    stream_events,
+    write_event,
+    write_events,
+)
+from common import metrics
 from events.data import Event
+from events.filters import EventFilterer, Filters
+from events.validators import validate_event_id, validate_event_sig
+from subscriptions.index import SubscriptionIndex
 
 from tests.events.utils import assert_two_events_same, generate_event
 
@@ -40,3 +57,134 @@ async def test_event_storing() -> None:
     assert stored_event_dict
     stored_event = Event(**stored_event_dict)  # type: ignore
     assert_two_events_same(event, stored_event)
+
+
+@pytest.mark.asyncio
+async def test_events_queried_with_tags() -> None:
+    # the e and p tags are interleaved, they should be returned in the published order
+    tag_rows = [["e", "a" * 64, "wss://relay.example.com", "root"], ["p", "b" * 64, "", "bob"], ["e", "c" * 64], ["p", "d" * 64, "wss://r.co"]]
+    events = [FastCodec().decode_event({**generate_event().nostr_dict, "tags": tag_rows}) for _ in range(3)]
+    await write_events(events)
+    ids = [event.id for event in events]
+
+    queried = await query_events(Filters(ids=ids))
+    assert {e["id"]: e["tags"] for e in queried} == {id: tag_rows for id in ids}
+    queried = await query_events(Filters(**{"authors": [events[0].pubkey[:12]], "#e": ["c" * 64], "#p": ["b" * 64], "limit": 5}))
+    assert [e["id"] for e in queried] == [events[0].id]
+
+    chunks = [chunk async for chunk in stream_events(Filters(ids=ids), chunk_size=2)]
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert chunks[0][0]["tags"] == tag_rows
+    fetched = await fetch_event(ids[0])
+    assert fetched and fetched["tags"] == tag_rows
+
+
+@pytest.mark.asyncio
+async def test_replace_event() -> None:
+    latest = generate_event(kind=10002)
+    # older versions of the same kind and pubkey, their signatures are not checked while storing
+    versions = [
+        latest.copy(update={"id": sha256(f"{latest.id}{i}".encode()).hexdigest(), "created_at": latest.created_at - i}) for i in range(1, 6)
+    ]
+    assert await replace_event(versions[-1])
+    assert await replace_event(latest)
+    assert not await replace_event(versions[0]), "An older event cannot replace a newer one!"
+    assert not await replace_event(latest)
+    kp_event_dict = await fetch_event_by_kind_pubkey(latest.kind, latest.pubkey)
+    assert kp_event_dict and kp_event_dict["id"] == latest.id
+
+    await delete_event_by_kind_pubkey(latest.kind, latest.pubkey)
+    # the concurrent replacements are serialized, only the latest one is kept
+    await gather(*(replace_event(event) for event in versions))
+    assert len(await query_events(Filters(kinds=[latest.kind], authors=[latest.pubkey]))) == 1
+    kp_event_dict = await fetch_event_by_kind_pubkey(latest.kind, latest.pubkey)
+    assert kp_event_dict and kp_event_dict["id"] == versions[0].id
+
+
+@pytest.mark.asyncio
+async def test_replace_event_keeps_lowest_id_of_same_created_at() -> None:
+    template = generate_event(kind=10002)
+    lower, higher = sorted(
+        (template.copy(update={"id": sha256(f"{template.id}{i}".encode()).hexdigest()}) for i in range(2)), key=lambda e: e.id
+    )
+    assert await replace_event(higher)
+    assert await replace_event(lower), "The lower id replaces the event of the same created_at!"
+    assert not await replace_event(higher), "The higher id cannot replace the event of the same created_at!"
+    kp_event_dict = await fetch_event_by_kind_pubkey(template.kind, template.pubkey)
+    assert kp_event_dict and kp_event_dict["id"] == lower.id
+    await delete_event_by_kind_pubkey(template.kind, template.pubkey)
+
+
+@pytest.mark.asyncio
+async def test_queries_compiled_by_shape() -> None:
+    events = [generate_event() for _ in range(3)]
+    await write_events(events)
+    misses = metrics.snapshot().get("query_cache.misses", 0)
+    hits = metrics.snapshot().get("query_cache.hits", 0)
+    for event in events:
+        # the same shape with different values and value counts
+        queried = await query_events(Filters(ids=[event.id, "f" * 10], kinds=[1, event.kind], since=event.created_at - 1, limit=10))
+        assert [e["id"] for e in queried] == [event.id]
+    assert metrics.snapshot()["query_cache.misses"] - misses <= 1
+    assert metrics.snapshot()["query_cache.hits"] - hits >= 2
+
+
+@pytest.mark.asyncio
+async def test_generic_tags_stored_and_filtered() -> None:
+    topic = generate_event().id[:16]  # unique per run, the db keeps the events of the previous runs
+    tag_rows = [["t", topic], ["e", "a" * 64], ["subject", "hello", "world"], ["r", "wss://r.co"]]
+    tagged = FastCodec().decode_event({**generate_event().nostr_dict, "tags": tag_rows})
+    untagged = generate_event()
+    await write_events([tagged, untagged])
+    fetched = await fetch_event(tagged.id)
+    assert fetched and fetched["tags"] == tag_rows
+
+    queried = await query_events(Filters(**{"#t": [topic, "other"], "since": tagged.created_at - 1}))
+    assert [e["id"] for e in queried] == [tagged.id]
+    assert EventFilterer(Filters(**{"#t": [topic]})).test_event(fetched)
+    # the tag names are ANDed
+    assert not await query_events(Filters(**{"#t": [topic], "#r": ["wss://other.co"]}))
+    assert not EventFilterer(Filters(**{"#t": [topic], "#r": ["wss://other.co"]})).test_event(fetched)
+    queried = await query_events(Filters(**{"#t": [topic], "#r": ["wss://r.co"], "#e": ["a" * 64]}))
+    assert [e["id"] for e in queried] == [tagged.id]
+
+
+@pytest.mark.asyncio
+async def test_published_tag_rows_stored_as_they_are() -> None:
+    tag_rows = [
+        ["p", "b" * 64, ""],
+        ["e", "a" * 64, ""],
+        ["e", "a" * 64, "wss://relay.example.com", "root", "b" * 64],
+    ]
+    event = generate_event(tags=tag_rows)
+    await write_events([FastCodec().decode_event({**event.nostr_dict, "tags": tag_rows})])
+    fetched = await fetch_event(event.id)
+    assert fetched and [list(row) for row in fetched["tags"] or []] == tag_rows
+    # the served event keeps its id and signature
+    served = FastCodec().decode_event(fetched)  # type: ignore
+    assert served.nostr_dict["tags"] == tag_rows
+    assert validate_event_id(served) and validate_event_sig(served)
+
+
+@pytest.mark.asyncio
+async def test_event_id_stored_once_across_created_at() -> None:
+    event = generate_event()
+    # the ids are not verified by default, the same id may come again with another created_at
+    resent = event.copy(update={"created_at": event.created_at - 60 * 60 * 24 * 40})
+    assert await write_events([event]) == {event.id}
+    assert await write_events([resent]) == set()
+    assert not await replace_event(resent.copy(update={"kind": 10002}))
+    queried = await query_events(Filters(ids=[event.id]))
+    assert [e["created_at"] for e in queried] == [event.created_at]
+
+
+@pytest.mark.asyncio
+async def test_empty_prefixes_match_every_event() -> None:
+    event = generate_event()
+    await write_events([event])
+    for f in (Filters(ids=[""], authors=[event.pubkey]), Filters(ids=[event.id], authors=["", "ff"])):
+        # the stored and the live events are matched alike
+        assert [e["id"] for e in await query_events(f)] == [event.id]
+        index = SubscriptionIndex()
+        index.add("empty-prefix", [f])
+        assert list(index.match(event.nostr_dict)) == ["empty-prefix"]
@@ -1,3 +1,4 @@
+from events.codec import FastCodec
 from events.validators import validate_created_at, validate_event_id, validate_event_sig
 from tests.events.utils import generate_event
 
@@ -8,3 +9,20 @@ def test_verify_event() -> None:
     assert validate_event_id(event=event)
     assert validate_event_sig(event=event)
     assert validate_created_at(event=event)
+
+
+# the shapes the tag models would rebuild differently
+PUBLISHED_TAG_ROWS = [
+    ["p", "b" * 64, ""],
+    ["e", "a" * 64, ""],
+    ["e", "a" * 64, "wss://relay.example.com", "root", "b" * 64],
+    ["e", "a" * 64, "", "", "b" * 64],
+]
+
+
+def test_verify_event_hashes_published_tags() -> None:
+    event = generate_event(tags=PUBLISHED_TAG_ROWS)
+    assert validate_event_id(event=event)
+    decoded = FastCodec().decode_event({**event.nostr_dict, "tags": PUBLISHED_TAG_ROWS})
+    assert validate_event_id(event=decoded)
+    assert validate_event_sig(event=decoded)
@@ -0,0 +1,53 @@
+import pytest
+from common import metrics
+from common.errors import NostrValidationError
+from events.verifier import EventVerifier
+
+from tests.events.utils import generate_event
+
+
+def create_verifier(**overrides) -> EventVerifier:
+    config = dict(
+        max_content_length=100,
+        max_tags=10,
+        max_age=60,
+        max_future=0,
+        workers=2,
+        process_pool=False,
+        max_batch_size=8,
+        max_delay=0.001,
+        cache_size=100,
+    )
+    return EventVerifier(**{**config, **overrides})  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_verifier_accepts_valid_events() -> None:
+    verifier = create_verifier()
+    events = [generate_event() for _ in range(20)]
+    for event in events:
+        await verifier.verify(event)
+
+    hits = metrics.snapshot().get("verifier.cache_hits", 0)
+    # rebroadcasted events skip the signature check
+    await verifier.verify(events[0])
+    assert metrics.snapshot()["verifier.cache_hits"] == hits + 1
+    await verifier.close()
+
+
+@pytest.mark.asyncio
+async def test_verifier_rejects_invalid_events() -> None:
+    verifier = create_verifier()
+    event = generate_event()
+    other = generate_event()
+    invalid_events = [
+        event.copy(update={"content": "x" * 101}),  # too large
+        event.copy(update={"created_at": event.created_at - 120}),  # too old
+        event.copy(update={"content": "tampered"}),  # id mismatch
+        event.copy(update={"sig": other.sig}),  # signature of another event
+    ]
+    await verifier.verify(event)
+    for invalid_event in invalid_events:
+        with pytest.raises(NostrValidationError):
+            await verifier.verify(invalid_event)
+    await verifier.close()
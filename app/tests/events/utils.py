@@ -5,7 +5,6 @@ from hashlib import sha256
 import secp256k1
 from events.data import Event
 from tags.data import Tag
-from tags.data.base import BaseTag
 
 
 def _generate_keypairs() -> tuple[secp256k1.PrivateKey, secp256k1.PublicKey]:
@@ -16,13 +15,11 @@ def _generate_keypairs() -> tuple[secp256k1.PrivateKey, secp256k1.PublicKey]:
     return privkey, pubkey
 
 
-def serialize_event(pubkey: str, created_at: int, kind: int, tags: list[BaseTag], content: str):
-    return json.dumps(
-        [0, pubkey, created_at, kind, [tag.nostr_dict for tag in tags], content], separators=(",", ":"), ensure_ascii=False
-    ).encode()
+def serialize_event(pubkey: str, created_at: int, kind: int, tags: list[list[str]], content: str):
+    return json.dumps([0, pubkey, created_at, kind, tags, content], separators=(",", ":"), ensure_ascii=False).encode()
 
 
-def generate_event(content: str | None = None, tags: list[BaseTag] | None = None, kind: int | None = None) -> Event:
+def generate_event(content: str | None = None, tags: list[list[str]] | None = None, kind: int | None = None) -> Event:
     priv, pub = _generate_keypairs()
     event_dict = {
         "pubkey": pub.serialize().hex()[2:],  # Strip the 02 in the beginning
@@ -1,6 +1,20 @@
+from hashlib import sha256
 from typing import cast
+
 import pytest
-from events.crud import write_event
+from common import metrics
+from common.hll import precision_for_error, standard_error
+from db.core import connect_db_pool
+from events.codec import FastCodec
+from events.crud import (
+    approximate_count_events,
+    build_count_sketches,
+    count_events,
+    delete_events,
+    replace_event,
+    write_event,
+    write_events,
+)
 from events.enums import MessageTypes
 from events.filters import Filters
 from message_handlers.count import handle_received_count
@@ -37,3 +51,87 @@ async def test_req_handler() -> None:
     msg_t, subs_id, count_data = cast(tuple[str, str, dict[str, int]], counter)
     assert msg_t == MessageTypes.Count.value, f"Message Type Mismatch, Expected {MessageTypes.Count.value} Found, {msg_t}"
     assert count_data["count"] == event_count
+
+
+@pytest.mark.asyncio
+async def test_count_from_reference_counters() -> None:
+    target = generate_event()
+    followed = generate_event().pubkey
+    replies = [
+        FastCodec().decode_event({**generate_event().nostr_dict, "tags": [["e", target.id], ["e", target.id], ["p", followed]]})
+        for _ in range(3)
+    ]
+    recommendation = FastCodec().decode_event({**generate_event(kind=2).nostr_dict, "tags": [["e", target.id]]})
+    contact_lists = [generate_event(kind=3) for _ in range(2)]
+    contact_lists = [FastCodec().decode_event({**event.nostr_dict, "tags": [["p", followed]]}) for event in contact_lists]
+    await write_events([target, *replies, recommendation])
+    for contact_list in contact_lists:
+        assert await replace_event(contact_list)
+
+    replies_filter = Filters(**{"kinds": [1], "#e": [target.id]})
+    counted = metrics.snapshot().get("count_events.counters", 0)
+    assert await count_events(replies_filter) == 3, "An event is counted once for its tags of the same value!"
+    assert await count_events(Filters(**{"#e": [target.id]})) == 4
+    assert await count_events(Filters(**{"#e": [target.id], "limit": 2})) == 2
+    assert await count_events(Filters(**{"kinds": [3], "#p": [followed]})) == 2
+    assert metrics.snapshot()["count_events.counters"] - counted == 4
+    # the general query agrees with the counters
+    assert await count_events(replies_filter, replies_filter) == 3
+
+    await delete_events(replies[0].pubkey, [replies[0].id])
+    assert await count_events(replies_filter) == 2
+    unfollowed = contact_lists[0].copy(
+        update={"id": sha256(contact_lists[0].id.encode()).hexdigest(), "created_at": contact_lists[0].created_at + 1, "tags": []}
+    )
+    assert await replace_event(unfollowed)
+    assert await count_events(Filters(**{"kinds": [3], "#p": [followed]})) == 1
+
+    # the counters dropping to 0 are deleted
+    await delete_events(recommendation.pubkey, [recommendation.id])
+    assert await count_events(Filters(**{"kinds": [2], "#e": [target.id]})) == 0
+    pool = connect_db_pool()
+    async with pool.connection() as conn:
+        cur = await conn.execute("SELECT count(*) FROM tag_reference_count WHERE value = %s AND kind = 2", (target.id,))
+        assert await cur.fetchone() == (0,)
+
+
+@pytest.mark.asyncio
+async def test_approximate_count_from_sketches(monkeypatch: pytest.MonkeyPatch) -> None:
+    index_bits = precision_for_error(0.02)
+    await build_count_sketches(index_bits)
+    author_event = generate_event()
+    day = author_event.created_at // 86400 * 86400
+    events = [
+        author_event.copy(update={"id": sha256(f"{author_event.id}{i}".encode()).hexdigest(), "created_at": day - (i % 3) * 86400 + 10})
+        for i in range(3000)
+    ]
+    await write_events(events)
+    error_bound = 5 * standard_error(index_bits)
+
+    authors_filter = Filters(authors=[author_event.pubkey], kinds=[author_event.kind])
+    estimate = await approximate_count_events(authors_filter)
+    assert estimate is not None and abs(estimate - 3000) <= error_bound * 3000, estimate
+    # the events matching both of the filters are counted once
+    assert await approximate_count_events(authors_filter, Filters(authors=[author_event.pubkey])) == estimate
+    last_day = await approximate_count_events(Filters(authors=[author_event.pubkey], since=day))
+    assert last_day is not None and abs(last_day - 1000) <= error_bound * 1000, last_day
+    first_day = await approximate_count_events(Filters(authors=[author_event.pubkey], until=day - 86400 - 1))
+    assert first_day is not None and abs(first_day - 1000) <= error_bound * 1000, first_day
+    assert await approximate_count_events(Filters(authors=[generate_event().pubkey])) == 0
+    # the exact count is cheap for these
+    assert await approximate_count_events(Filters(authors=[author_event.pubkey[:10]])) is None
+    assert await approximate_count_events(Filters(authors=[author_event.pubkey], limit=10)) is None
+    # the sketches cannot be split within a day
+    assert await approximate_count_events(Filters(authors=[author_event.pubkey], since=day + 5)) is None
+    # merging more sketches would cost more than counting
+    monkeypatch.setenv("count_sketch_max_merged", "2")
+    assert await approximate_count_events(authors_filter) is None
+    monkeypatch.delenv("count_sketch_max_merged")
+
+    mocked_ws = MockAsyncSenderWebsocket()
+    await handle_received_count(mocked_ws, "approximate", [authors_filter])
+    monkeypatch.setenv("count_approximate", "1")
+    await handle_received_count(mocked_ws, "approximate", [authors_filter])
+    exact, approximate = cast(list[tuple[str, str, dict]], mocked_ws.get_data())
+    assert exact[2] == {"count": 3000}
+    assert approximate[2] == {"count": estimate, "approximate": True}
@@ -1,9 +1,10 @@
-from asyncio import create_task, wait_for
+from asyncio import Event as Event_, create_task, wait_for
 import pytest
+from events.codec import FastCodec
 from events.crud import fetch_event
 from events.data import Event
 from events.enums import MessageTypes
-from message_handlers.event import handle_received_event
+from message_handlers.event import get_seen_event_ids, handle_received_event
 
 from tests.events.utils import assert_two_events_same, generate_event
 from tests.handlers.utils import event_listener
@@ -16,7 +17,10 @@ import standalone_app
 @pytest.mark.asyncio
 async def test_event_handler():
     event = generate_event()
-    task = create_task(event_listener(event))
+    subscribed = Event_()
+    task = create_task(event_listener(event, subscribed=subscribed))
+    # the event is published only to the listeners subscribed at that moment
+    await wait_for(subscribed.wait(), timeout=1)
     await handle_received_event(event.nostr_dict)
     await wait_for(task, timeout=1)
     stored_event_dict = await fetch_event(event.id)
@@ -29,6 +33,23 @@ async def test_event_handler():
     assert not stored_event
 
 
+@pytest.mark.asyncio
+async def test_deleted_events_are_not_seen():
+    event = generate_event()
+    await handle_received_event(event.nostr_dict)
+    seen_event_ids = get_seen_event_ids()
+    assert seen_event_ids.is_duplicate(event.id)
+    # another pubkey cannot delete it, it is still a duplicate
+    await handle_received_event(generate_event(kind=5, tags=[["e", event.id]]).nostr_dict)
+    assert seen_event_ids.is_duplicate(event.id)
+    assert await fetch_event(event.id)
+
+    deletion = FastCodec().decode_event({**event.nostr_dict, "id": generate_event().id, "kind": 5, "tags": [["e", event.id]]})
+    await handle_received_event(deletion.nostr_dict)
+    assert not seen_event_ids.is_duplicate(event.id)
+    assert not await fetch_event(event.id)
+
+
 @pytest.mark.asyncio
 async def test_ws_event_handler():
     client_count = 4
@@ -1,7 +1,9 @@
-from asyncio import Barrier, create_task
+from asyncio import Barrier, Event as AsyncEvent, create_task, gather, sleep
 from typing import cast
 import pytest
-from events.crud import write_event
+from common import metrics
+from db.core import connect_db_pool
+from events.crud import query_events, write_event, write_events
 from events.data import Event
 from events.enums import MessageTypes
 from events.filters import Filters
@@ -14,6 +16,26 @@ from tests.events.utils import assert_two_events_same, generate_event
 from tests.handlers.utils import MockAsyncSenderWebsocket, listen_new_events
 
 
+class BlockingAsyncSenderWebsocket(MockAsyncSenderWebsocket):
+    """
+    Blocks on the first message, as a client that stopped reading
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.first_sent = AsyncEvent()
+
+    async def send_json(self, data) -> None:
+        await super().send_json(data)
+        self.first_sent.set()
+        await AsyncEvent().wait()
+
+    async def send_text(self, data: str) -> None:
+        await super().send_text(data)
+        self.first_sent.set()
+        await AsyncEvent().wait()
+
+
 @pytest.mark.asyncio
 async def test_req_handler() -> None:
     event_count = 5
@@ -81,3 +103,53 @@ async def test_ws_broadcaster_req_handler() -> None:
     assert len(sorted_events) == len(sorted_new_events), "Event Counts Are Not Matching!"
     for e1, e2 in zip(sorted_events, sorted_new_events):
         assert_two_events_same(e1, e2)
+
+
+@pytest.mark.asyncio
+async def test_req_handler_streams_and_cancels(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("req_chunk_size", "2")
+    events = [generate_event() for _ in range(10)]
+    await write_events(events)
+    # prefixes, the ids written directly are not known to the seen ids filter
+    f1 = Filters(ids=[event.id[:20] for event in events])
+
+    mocked_ws = MockAsyncSenderWebsocket()
+    await handle_received_req(mocked_ws, "streamed", [f1])
+    assert len(mocked_ws.get_data()) == len(events) + 1
+
+    # the first event is sent before the rest is read
+    blocking_ws = BlockingAsyncSenderWebsocket()
+    task = create_task(handle_received_req(blocking_ws, "blocked", [f1]))
+    await blocking_ws.first_sent.wait()
+    task.cancel()
+    await task
+    assert len(blocking_ws.get_data()) == 1
+
+    # cancelled while the queries are running
+    returns_bad = connect_db_pool().get_stats().get("returns_bad", 0)
+    for pause in range(10):
+        task = create_task(handle_received_req(MockAsyncSenderWebsocket(), "cancelled", [f1]))
+        for _ in range(pause):
+            await sleep(0)
+        task.cancel()
+        # the handler may be cancelled even before it starts
+        await gather(task, return_exceptions=True)
+    # the running queries are cancelled on the server, none of the pool connections are left busy
+    assert connect_db_pool().get_stats().get("returns_bad", 0) == returns_bad
+    results = await gather(*(query_events(f1) for _ in range(8)))
+    assert all(len(result) == len(events) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reqs_share_the_query() -> None:
+    events = [generate_event() for _ in range(3)]
+    await write_events(events)
+    filters = [Filters(authors=[event.pubkey for event in events], limit=10)]
+    started = metrics.snapshot().get("req_flights.started", 0)
+    shared = metrics.snapshot().get("req_flights.shared", 0)
+    sockets = [MockAsyncSenderWebsocket() for _ in range(5)]
+    await gather(*(handle_received_req(ws, f"coalesced-{i}", filters) for i, ws in enumerate(sockets)))
+    assert metrics.snapshot()["req_flights.started"] - started == 1
+    assert metrics.snapshot()["req_flights.shared"] - shared == 4
+    for ws in sockets:
+        assert len(ws.get_data()) == len(events) + 1
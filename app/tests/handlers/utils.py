@@ -1,5 +1,6 @@
 import json
 from asyncio import Barrier
+from asyncio import Event as Event_
 from typing import Any, Callable
 from common.typings import SerializableDataType
 
@@ -18,10 +19,17 @@ from tests.events.utils import assert_two_events_same
 class MockAsyncSenderWebsocket:
     def __init__(self):
         self._sent_data_container: list[SerializableDataType] = []
+        self.close_code: int | None = None
 
     async def send_json(self, data: SerializableDataType) -> None:
         self._sent_data_container.append(data)
 
+    async def send_text(self, data: str) -> None:
+        self._sent_data_container.append(json.loads(data))
+
+    async def close(self, code: int = 1000) -> None:
+        self.close_code = code
+
     def get_data(self, *, sort_key: Callable[[SerializableDataType], Any] | None = None) -> list[SerializableDataType]:
         if sort_key:
             return sorted(self._sent_data_container, key=sort_key)
@@ -29,9 +37,11 @@ class MockAsyncSenderWebsocket:
             return self._sent_data_container
 
 
-async def event_listener(*expected_events: Event):
+async def event_listener(*expected_events: Event, subscribed: Event_ | None = None):
     events_by_id = {event.id: event for event in expected_events}
     async with listen_on_key(NEW_EVENT_KEY) as listener:
+        if subscribed:
+            subscribed.set()
         async for event_as_str in listener:
             if event_as_str["type"] == "message":
                 event_nostr: EventNostrDict = json.loads(event_as_str["data"])
@@ -0,0 +1,89 @@
+import json
+from asyncio import Queue, wait_for
+
+import pytest
+from cache.crud import broadcast
+from events.filters import Filters
+from subscriptions.hub import BroadcastEvent, SubscriptionHub, SubscriptionUnavailableError
+
+from tests.events.utils import generate_event
+
+
+@pytest.mark.asyncio
+async def test_hub_fan_out() -> None:
+    channel = "test-hub-channel"
+    hub = SubscriptionHub(channel)
+    event1 = generate_event()
+    event2 = generate_event()
+    subscriber_count = 100
+    queues: list[Queue[BroadcastEvent]] = [Queue() for _ in range(subscriber_count)]
+    try:
+        for i, q in enumerate(queues):
+            # even subscriptions are interested in event1, odd ones in event2
+            target = event1 if i % 2 == 0 else event2
+            await hub.subscribe(("conn", i), (Filters(authors=[target.pubkey[:12]]),), q.put_nowait)
+        assert hub.subscription_count == subscriber_count
+
+        await broadcast(channel, json.dumps(event1.nostr_dict))
+        await broadcast(channel, json.dumps(event2.nostr_dict))
+        for i, q in enumerate(queues):
+            received = await wait_for(q.get(), timeout=1)
+            assert json.loads(received.encoded) == received.event, "Encoded Event Mismatch!"
+            assert received.event["id"] == (event1.id if i % 2 == 0 else event2.id), "Event is delivered to a wrong subscription!"
+            assert q.empty(), "Event is delivered more than once!"
+
+        hub.unsubscribe(("conn", 0))
+        assert hub.subscription_count == subscriber_count - 1
+    finally:
+        await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_hub_subscribe_times_out(monkeypatch) -> None:
+    # nothing listens on the port, the hub cannot listen the channel
+    monkeypatch.setenv("redis_port", "1")
+    hub = SubscriptionHub("test-unavailable-channel", subscribe_timeout=0.1)
+    try:
+        with pytest.raises(SubscriptionUnavailableError):
+            await hub.subscribe(("conn", 0), (Filters(),), lambda _: None)
+        assert hub.subscription_count == 0
+    finally:
+        await hub.close()
+
+
+def test_hub_dispatch_survives_failing_callbacks() -> None:
+    hub = SubscriptionHub("test-failing-callbacks")
+    event = generate_event()
+    received: list[BroadcastEvent] = []
+
+    def fail(_: BroadcastEvent) -> None:
+        raise RuntimeError("broken tap")
+
+    hub.add_tap(fail)
+    hub.add_tap(received.append)
+    hub._index.add(("conn", 0), (Filters(),))
+    hub._deliverers[("conn", 0)] = fail
+    hub._index.add(("conn", 1), (Filters(),))
+    hub._deliverers[("conn", 1)] = received.append
+    hub.dispatch(json.dumps(event.nostr_dict))
+    assert [broadcasted.event["id"] for broadcasted in received] == [event.id, event.id]
+
+
+@pytest.mark.asyncio
+async def test_hub_survives_failing_reconnect_listeners() -> None:
+    hub = SubscriptionHub("test-failing-reconnect-listeners")
+    reconnected: list[bool] = []
+
+    def fail() -> None:
+        raise RuntimeError("broken listener")
+
+    hub.add_reconnect_listener(fail)
+    hub.add_reconnect_listener(lambda: reconnected.append(True))
+    # the channel was listened before the connection is lost
+    hub._has_listened = True
+    try:
+        await wait_for(hub.start(), timeout=1)
+        assert reconnected == [True]
+        await hub.subscribe(("conn", 0), (Filters(),), lambda _: None)
+    finally:
+        await hub.close()
@@ -0,0 +1,31 @@
+from events.filters import Filters
+from events.typings import EventNostrDict
+from subscriptions.index import SubscriptionIndex
+
+from tests.events.utils import generate_event
+
+
+def test_subscription_index() -> None:
+    event = generate_event()
+    event_dict = EventNostrDict(**event.nostr_dict)  # type: ignore
+    event_dict["tags"] = [("e", "ab" * 32)]
+    other_event = generate_event(kind=1001)
+    index = SubscriptionIndex()
+    index.add("ids", [Filters(ids=[event.id[:8]])])
+    index.add("authors", [Filters(authors=["0000", event.pubkey[:20]], kinds=[1])])
+    index.add("wrong-kind", [Filters(authors=[event.pubkey[:20]], kinds=[2])])
+    index.add("e-tag", [Filters(**{"#e": ["abab"]})])
+    index.add("kinds", [Filters(kinds=[1001])])
+    index.add("multi", [Filters(kinds=[2]), Filters(ids=[other_event.id[:3]])])
+    index.add("residual", [Filters(since=event.created_at - 10)])
+
+    assert index.match(event_dict) == {"ids", "authors", "e-tag", "residual"}
+    assert index.match(other_event.nostr_dict) == {"kinds", "multi", "residual"}
+
+    index.remove("residual")
+    index.remove("ids")
+    assert index.match(event_dict) == {"authors", "e-tag"}
+    # re-adding a key replaces its filters
+    index.add("authors", [Filters(authors=["0000"])])
+    assert index.match(event_dict) == {"e-tag"}
+    assert len(index) == 5
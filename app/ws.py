@@ -1,19 +1,23 @@
 from asyncio import ALL_COMPLETED, CancelledError, Task, create_task, wait
 from typing import Awaitable
 
+from common.outbound import OutboundQueue, outbound_queue_config
+from events.codec import get_codec
 from events.enums import MessageTypes
-from events.filters import Filters
 from fastapi import WebSocket, WebSocketDisconnect
 from message_handlers.count import handle_received_count
 from message_handlers.event import handle_received_event
-from message_handlers.req import create_listener, handle_received_req
+from message_handlers.req import handle_received_req, subscribe_to_new_events, unsubscribe_from_new_events
 from common.tools import surpress_exc_coroutine
+from subscriptions.hub import SubscriptionUnavailableError
+from subscriptions.index import SubscriptionKey
 
 
 EVENT_HANDLER_PREFIX = "EVENT-HANDLER"
 REQ_HANDLER_PREFIX = "REQ-HANDLER"
 COUNT_HANDLER_PREFIX = "COUNT-HANDLER"
-EVENT_LISTENER_PREFIX = "EVENT-LISTENER"
+OUTBOUND_WRITER_PREFIX = "OUTBOUND-WRITER"
+OUTBOUND_FLUSH_TIMEOUT = 1  # seconds
 
 
 def get_event_handler_task_name(event_id: str) -> str:
@@ -28,17 +32,22 @@ def get_count_handler_task_name(subs_id: str) -> str:
     return f"{COUNT_HANDLER_PREFIX}-[{subs_id}]"
 
 
-def get_filter_listener_task_name(subs_id: str) -> str:
-    return f"{EVENT_LISTENER_PREFIX}-[{subs_id}]"
+def get_subscription_key(websocket: WebSocket, subs_id: str) -> SubscriptionKey:
+    return (id(websocket), subs_id)
 
 
 async def nostr_server(websocket: WebSocket) -> None:
     await websocket.accept()
+    codec = get_codec()
     bg_tasks: dict[str, Task] = {}
-    filter_listener_task: Task | None = None
+    subscriptions: set[SubscriptionKey] = set()
+    # every message to the client goes through the outbound queue,
+    # a single writer task sends them so a slow client never blocks the handlers
+    outbound = OutboundQueue(websocket, **outbound_queue_config())
+    writer_task = create_task(outbound.run(), name=f"{OUTBOUND_WRITER_PREFIX}-[{id(websocket)}]")
     try:
         while True:
-            data = await websocket.receive_json()
+            data = codec.decode_frame(await websocket.receive_text())
             print(f"RECEIVED DATA: {data}")
             match data:
                 case [MessageTypes.Event.value, dict() as event_dict]:
@@ -49,42 +58,48 @@ async def nostr_server(websocket: WebSocket) -> None:
                         bg_tasks.setdefault(task_name, event_task)
 
                 case [MessageTypes.Req.value, str() as subs_id, *f_dicts]:
-                    filters = [Filters(**filters_dict) for filters_dict in f_dicts]
+                    filters = [codec.decode_filters(filters_dict) for filters_dict in f_dicts]
                     handler_task_name = get_req_handler_task_name(subs_id=subs_id)
-                    filter_listener_task_name = get_filter_listener_task_name(subs_id=subs_id)
+                    subscription_key = get_subscription_key(websocket, subs_id)
                     # Make sure There is no ongoing process
                     # If there is pending task, cancel it and wait until it finishes
-                    if old_handler_task := bg_tasks.get(handler_task_name, None):
+                    if old_handler_task := bg_tasks.pop(handler_task_name, None):
                         old_handler_task.cancel("New Req Received!")
                         await surpress_exc_coroutine(old_handler_task, CancelledError)
-                    if old_listener_task := bg_tasks.get(filter_listener_task_name, None):
-                        old_listener_task.cancel("New Req Received!")
-                        await surpress_exc_coroutine(old_listener_task, CancelledError)
-
-                    # Create new tasks
+                    unsubscribe_from_new_events(subscription_key)
+
+                    # Subscribe before querying the stored events,
+                    # so the events stored in between are not missed
+                    try:
+                        await subscribe_to_new_events(subscription_key, filters, outbound, subs_id)
+                    except SubscriptionUnavailableError:
+                        # the connection keeps serving the other messages
+                        await outbound.send_json(
+                            [
+                                MessageTypes.Notice.value,
+                                {"error": f"Subscription {subs_id} is not available, please try again later."},
+                            ]
+                        )
+                        continue
+                    subscriptions.add(subscription_key)
                     handler_task = create_task(
-                        handle_received_req(websocket, subs_id, filters),
+                        handle_received_req(outbound, subs_id, filters),
                         name=handler_task_name,
                     )
-                    filter_listener_task = create_task(
-                        create_listener(*filters, ws=websocket, subscription_id=subs_id),
-                        name=filter_listener_task_name,
-                    )
-                    # register them in the tasks dict to not to be garbage-collected
-                    # and to cancel them gracefully when connection closed
-                    bg_tasks.setdefault(handler_task_name, handler_task)
-                    bg_tasks.setdefault(filter_listener_task_name, filter_listener_task)
+                    # register it in the tasks dict to not to be garbage-collected
+                    # and to cancel it gracefully when connection closed
+                    bg_tasks[handler_task_name] = handler_task
 
                 case [MessageTypes.Count.value, str() as subs_id, *f_dicts]:
-                    filters = [Filters(**filter_dict) for filter_dict in f_dicts]
+                    filters = [codec.decode_filters(filter_dict) for filter_dict in f_dicts]
                     task_name = get_count_handler_task_name(subs_id)
-                    counter_task = create_task(handle_received_count(websocket, subs_id, filters), name=task_name)
+                    counter_task = create_task(handle_received_count(outbound, subs_id, filters), name=task_name)
                     bg_tasks.setdefault(task_name, counter_task)
 
                 case [MessageTypes.Close.value, str() as subs_id]:
                     break
                 case _:
-                    await websocket.send_json(
+                    await outbound.send_json(
                         [
                             MessageTypes.Notice.value,
                             {"error": "Invalid Message! Closing the connection."},
@@ -99,6 +114,12 @@ async def nostr_server(websocket: WebSocket) -> None:
         print(e)
         print("-----" * 100)
     finally:
+        for subscription_key in subscriptions:
+            unsubscribe_from_new_events(subscription_key)
+        # give the writer a chance to send the remaining messages (i.e. NOTICE)
+        await outbound.flush(OUTBOUND_FLUSH_TIMEOUT)
+        outbound.stop()
+        await surpress_exc_coroutine(writer_task, BaseException)
         await surpress_exc_coroutine(websocket.close(), BaseException)
         await_for: list[Awaitable] = []
         for tname, task in bg_tasks.items():